@@ -0,0 +1,165 @@
+import boto3
+import os
+import time
+from botocore.exceptions import ClientError
+from stats_keys import histogram_key, question_key
+
+# Per-exam summary items, if the table is deployed
+stats_table_name = os.environ.get('STATS_TABLE_NAME')
+# Markers of the stream records already counted, kept with the score card idempotency records
+idempotency_table_name = os.environ.get('IDEMPOTENCY_TABLE_NAME')
+idempotency_ttl_seconds = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 7 * 24 * 60 * 60))
+dynamodb_client = boto3.client('dynamodb')
+
+# DynamoDB TransactWriteItems limit
+TRANSACT_MAX_ITEMS = 100
+
+def contribution(item):
+    """
+    Counters one attempt adds to the summary of its exam.
+
+    :param item: Attempt item, as plain JSON.
+    :return: Dictionary of counter name to increment.
+    """
+    counters = {
+        'attempts': 1,
+        'score_sum': int(item.get('score', 0)),
+        'percentage_sum': int(item.get('percentage', 0)),
+        'passed': int(item.get('result') == 'passed'),
+        histogram_key(item.get('percentage', 0)): 1,
+    }
+    for detail in item.get('details', []):
+        key = question_key(detail.get('question', ''))
+        counters[key] = counters.get(key, 0) + int(bool(detail.get('is_correct')))
+    return counters
+
+def record_delta(record, to_json):
+    """
+    Counter changes of a stream record: the new attempt minus the one it replaced, if any.
+
+    :param record: DynamoDB stream record.
+    :param to_json: Function converting a DynamoDB image to plain JSON.
+    :return: (exam, dictionary of counter name to non-zero increment), or (None, {}) when there is nothing to count.
+    """
+    images = record['dynamodb']
+    new = to_json(images['NewImage']) if images.get('NewImage') else {}
+    old = to_json(images['OldImage']) if images.get('OldImage') else {}
+    exam = new.get('exam') or old.get('exam')
+    if not exam:
+        return None, {}  # results written before attempts recorded the exam
+    delta = contribution(new) if new else {}
+    for name, value in (contribution(old) if old else {}).items():
+        delta[name] = delta.get(name, 0) - value
+    return exam, {name: value for name, value in delta.items() if value}
+
+def update_expression(exam, counters):
+    """
+    Build the update of the summary item of an exam, adding every counter atomically.
+    """
+    names = {f'#c{i}': name for i, name in enumerate(counters)}
+    values = {f':c{i}': {'N': str(value)} for i, value in enumerate(counters.values())}
+    names['#updated_at'] = 'updated_at'
+    values[':updated_at'] = {'N': str(int(time.time()))}
+    return {
+        'TableName': stats_table_name,
+        'Key': {'exam': {'S': exam}},
+        'UpdateExpression': 'SET #updated_at = :updated_at ADD ' + ', '.join(f'#c{i} :c{i}' for i in range(len(counters))),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values,
+    }
+
+def build_chunks(deltas):
+    """
+    Group (record id, event id, exam, counters) deltas into transactions of at most TRANSACT_MAX_ITEMS
+    items: one marker per record plus one summary update per exam.
+    """
+    chunks = []
+    current, exams = [], set()
+    for delta in deltas:
+        added_exams = exams | {delta[2]}
+        if current and len(current) + 1 + len(added_exams) > TRANSACT_MAX_ITEMS:
+            chunks.append(current)
+            current, added_exams = [], {delta[2]}
+        current.append(delta)
+        exams = added_exams
+    if current:
+        chunks.append(current)
+    return chunks
+
+def apply_chunk(chunk):
+    """
+    Add the counters of a chunk of records in one transaction, together with a marker per record,
+    so that a record retried by the stream is never counted twice.
+
+    :return: Number of records counted by this call.
+    """
+    if idempotency_table_name is None:
+        # Without markers, the counters are at least once
+        for exam, counters in merge(chunk).items():
+            dynamodb_client.update_item(**update_expression(exam, counters))
+        return len(chunk)
+    now = int(time.time())
+    items = [{'Put': {
+        'TableName': idempotency_table_name,
+        'Item': {'notification_id': {'S': 'stats#' + event_id}, 'status': {'S': 'counted'},
+                 'claimed_at': {'N': str(now)}, 'expires_at': {'N': str(now + idempotency_ttl_seconds)}},
+        'ConditionExpression': 'attribute_not_exists(notification_id)',
+    }} for _, event_id, _, _ in chunk]
+    items += [{'Update': update_expression(exam, counters)} for exam, counters in merge(chunk).items()]
+    try:
+        dynamodb_client.transact_write_items(TransactItems=items)
+        return len(chunk)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        reasons = e.response.get('CancellationReasons', [])
+        counted = {i for i, reason in enumerate(reasons[:len(chunk)]) if reason.get('Code') == 'ConditionalCheckFailed'}
+        if not counted:
+            raise
+        # Some records were counted by a previous attempt of this batch: count the others only
+        print(f"Skipping {len(counted)} records already counted in the exam statistics")
+        remaining = [delta for i, delta in enumerate(chunk) if i not in counted]
+        return apply_chunk(remaining) if remaining else 0
+
+def merge(chunk):
+    """
+    Sum the counters of a chunk of records per exam.
+    """
+    totals = {}
+    for _, _, exam, counters in chunk:
+        exam_totals = totals.setdefault(exam, {})
+        for name, value in counters.items():
+            exam_totals[name] = exam_totals.get(name, 0) + value
+    return {exam: {name: value for name, value in counters.items() if value} for exam, counters in totals.items()
+            if any(counters.values())}
+
+def update_exam_stats(records, to_json):
+    """
+    Add the attempts of a batch of stream records to the summary items of their exams.
+
+    :param records: INSERT and MODIFY stream records.
+    :param to_json: Function converting a DynamoDB image to plain JSON.
+    :return: (number of records counted, sequence numbers of the records that failed).
+    """
+    if stats_table_name is None:
+        return 0, []
+    deltas = []
+    failed = []
+    for record in records:
+        record_id = record['dynamodb']['SequenceNumber']
+        try:
+            exam, counters = record_delta(record, to_json)
+        except Exception as e:
+            print(f"Error reading record {record_id} for the exam statistics: {e}")
+            failed.append(record_id)
+            continue
+        if counters:
+            deltas.append((record_id, record['eventID'], exam, counters))
+    counted = 0
+    for chunk in build_chunks(deltas):
+        try:
+            counted += apply_chunk(chunk)
+        except Exception as e:
+            print(f"Error updating the exam statistics: {e}")
+            failed.extend(record_id for record_id, _, _, _ in chunk)
+    return counted, failed
@@ -1,17 +1,33 @@
 import boto3
-import json
 import os
+import time
 from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from exam_stats import update_exam_stats
+from instrumentation import emit, span, timed
 
 sns_client = boto3.client('sns')
 
+SCORE_CARD_SUBJECT = 'Exam-Generator - Score Card'
+# SNS PublishBatch limits
+SNS_BATCH_MAX_MESSAGES = 10
+SNS_BATCH_MAX_BYTES = 256 * 1024
+publish_workers = int(os.environ.get('PUBLISH_WORKERS', 4))
+# Attributes shown on the score card; MODIFY events that change none of them are skipped
+SCORE_CARD_FIELDS = ('email', 'score', 'result', 'details')
+# Idempotency records of the score cards already sent, if the table is deployed
+idempotency_table = boto3.resource('dynamodb').Table(os.environ['IDEMPOTENCY_TABLE_NAME']) if os.environ.get('IDEMPOTENCY_TABLE_NAME') else None
+idempotency_ttl_seconds = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 7 * 24 * 60 * 60))
+idempotency_lease_seconds = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 15 * 60))
+
 # Utility function to convert DynamoDB item to regular JSON
 def dynamodb_to_json(dynamodb_item):
     deserializer = TypeDeserializer()
     return {k: deserializer.deserialize(v) for k, v in dynamodb_item.items()}
 
 def format_score_card(item_json):
-    score_card_title = "Exam-Generator - Score Card"
+    score_card_title = SCORE_CARD_SUBJECT
     student_email = item_json.get("email", "No email provided")
     result = item_json.get("result", "Result not available")
     score = item_json.get("score", "Score not available")
@@ -36,32 +52,165 @@ def format_score_card(item_json):
 
     return message_body
 
+def build_batches(entries):
+    """
+    Group (record id, message) pairs into SNS batches of at most 10 messages and 256 KB.
+    """
+    batches = []
+    current = []
+    current_size = 0
+    for record_id, message in entries:
+        size = len(message.encode('utf-8')) + len(SCORE_CARD_SUBJECT)
+        if current and (len(current) == SNS_BATCH_MAX_MESSAGES or current_size + size > SNS_BATCH_MAX_BYTES):
+            batches.append(current)
+            current, current_size = [], 0
+        current.append((record_id, message))
+        current_size += size
+    if current:
+        batches.append(current)
+    return batches
+
+def publish_batch(sns_topic_arn, batch):
+    """
+    Publish one batch of score cards and return the ids of the records that were not delivered.
+    """
+    try:
+        response = sns_client.publish_batch(
+            TopicArn=sns_topic_arn,
+            PublishBatchRequestEntries=[
+                {'Id': str(i), 'Message': message, 'Subject': SCORE_CARD_SUBJECT}
+                for i, (_, message) in enumerate(batch)
+            ]
+        )
+    except Exception as e:
+        print(f"Error sending SNS notifications: {e}")
+        return [record_id for record_id, _ in batch]
+    for success in response.get('Successful', []):
+        print("SNS notification sent. Message ID:", success['MessageId'])
+    failed = []
+    for failure in response.get('Failed', []):
+        print(f"Error sending SNS notification: {failure.get('Code')} {failure.get('Message')}")
+        failed.append(batch[int(failure['Id'])][0])
+    return failed
+
+def has_relevant_change(record):
+    """
+    Tell whether a stream record changes anything that appears on the score card.
+    """
+    if record['eventName'] != 'MODIFY':
+        return True
+    old_image = record['dynamodb'].get('OldImage')
+    new_image = record['dynamodb'].get('NewImage', {})
+    if not old_image:
+        return True
+    return any(old_image.get(field) != new_image.get(field) for field in SCORE_CARD_FIELDS)
+
+def claim_notification(event_id):
+    """
+    Record that the score card of a stream event is being sent.
+
+    :return: False if the event was already sent (or is being sent by another invocation).
+    """
+    if idempotency_table is None:
+        return True
+    now = int(time.time())
+    try:
+        idempotency_table.put_item(
+            Item={'notification_id': event_id, 'status': 'sending', 'claimed_at': now,
+                  'expires_at': now + idempotency_ttl_seconds},
+            # A claim left behind by a crashed invocation can be taken over after the lease
+            ConditionExpression='attribute_not_exists(notification_id) OR (#status = :sending AND claimed_at < :lease_start)',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':sending': 'sending', ':lease_start': now - idempotency_lease_seconds}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+
+def complete_notifications(sent_event_ids, failed_event_ids):
+    """
+    Mark delivered score cards as sent and release the claims of the failed ones for the retry.
+    """
+    if idempotency_table is None:
+        return
+    now = int(time.time())
+    with idempotency_table.batch_writer() as batch:
+        for event_id in sent_event_ids:
+            batch.put_item(Item={'notification_id': event_id, 'status': 'sent', 'claimed_at': now,
+                                 'expires_at': now + idempotency_ttl_seconds})
+        for event_id in failed_event_ids:
+            batch.delete_item(Key={'notification_id': event_id})
+
+@timed('score_cards')
 def lambda_handler(event, context):
     sns_topic_arn = os.environ['SNS_TOPIC_ARN']
 
+    entries = []
+    failed = []
+    event_ids = {}
     for record in event['Records']:
         # Process both new insertions and updates
         if record['eventName'] in ['INSERT', 'MODIFY']:
-            image = record['dynamodb'].get('NewImage', {})
+            record_id = record['dynamodb']['SequenceNumber']
+            if not has_relevant_change(record):
+                print(f"Skipping record {record_id}: score card unchanged")
+                continue
+            event_ids[record_id] = record['eventID']
+            try:
+                image = record['dynamodb'].get('NewImage', {})
 
-            # Convert DynamoDB JSON to regular JSON
-            item_json = dynamodb_to_json(image)
+                # Convert DynamoDB JSON to regular JSON
+                item_json = dynamodb_to_json(image)
 
-            # Format the message as a score card
-            message = format_score_card(item_json)
+                # Format the message as a score card
+                entries.append((record_id, format_score_card(item_json)))
+            except Exception as e:
+                print(f"Error formatting score card for record {record_id}: {e}")
+                failed.append(record_id)
 
+    with ThreadPoolExecutor(max_workers=publish_workers) as executor:
+        # Skip the score cards a previous attempt of this batch already delivered
+        def claim(entry):
             try:
-                response = sns_client.publish(
-                    TopicArn=sns_topic_arn,
-                    Message=message,
-                    Subject='Exam-Generator - Score Card'
-                )
-                print("SNS notification sent. Message ID:", response['MessageId'])
+                return claim_notification(event_ids[entry[0]])
             except Exception as e:
-                print(f"Error sending SNS notification: {e}")
-                raise
+                print(f"Error claiming notification for record {entry[0]}: {e}")
+                return None
+        claimed = []
+        for entry, status in zip(entries, executor.map(claim, entries)):
+            if status is None:
+                failed.append(entry[0])
+            elif status:
+                claimed.append(entry)
+            else:
+                print(f"Skipping record {entry[0]}: score card already sent")
+
+        # Publish up to 10 score cards per call, several calls at a time
+        publish_failed = []
+        for batch_failed in executor.map(lambda batch: publish_batch(sns_topic_arn, batch), build_batches(claimed)):
+            publish_failed.extend(batch_failed)
+    failed.extend(publish_failed)
+
+    # Add the attempts to the per-exam statistics
+    with span('exam_stats') as stats_span:
+        stats_counted, stats_failed = update_exam_stats(
+            [record for record in event['Records'] if record['eventName'] in ['INSERT', 'MODIFY']], dynamodb_to_json)
+        stats_span.metric('RecordsCounted', stats_counted)
+    failed.extend(record_id for record_id in stats_failed if record_id not in failed)
+
+    try:
+        complete_notifications([event_ids[record_id] for record_id, _ in claimed if record_id not in publish_failed],
+                               [event_ids[record_id] for record_id in publish_failed])
+    except Exception as e:
+        # Delivered cards stay claimed until the lease expires, which still prevents quick re-sends
+        print(f"Error updating notification records: {e}")
+
+    emit({'Records': len(event['Records']), 'ScoreCardsSent': len(claimed) - len(publish_failed),
+          'FailedRecords': len(failed)}, dimensions={'Stage': 'score_cards'})
 
+    # Only the failed records are retried by the event source mapping
     return {
-        'statusCode': 200,
-        'body': json.dumps('Lambda executed successfully!')
+        'batchItemFailures': [{'itemIdentifier': record_id} for record_id in failed]
     }
@@ -1,9 +1,19 @@
 from utils.helper_files import HelperFiles
 from utils.helper_bedrock import HelperBedrock
+from utils.helper_exam import HelperExam
+from utils.helper_cache import DiskCache, S3Cache, TieredCache
+from utils.helper_index import HelperIndex
+from utils.helper_jobs import HelperJobs
+from utils.helper_pool import HelperPool
+from utils.helper_scheduler import BedrockCapacityError
+from instrumentation import bind, emit, span
+import exam_format
 import json
 import boto3
 import urllib.parse
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 sns = boto3.client('sns')
 s3 = boto3.client('s3')
 bedrock = HelperBedrock()
@@ -11,50 +21,134 @@ bedrock = HelperBedrock()
 sns_topic_arn = os.environ['SNS_TOPIC_ARN']
 #email_address = os.environ['NotificationEmail']
 questions_bank_location = 'questions_bank'
+# 'exam' writes the compressed exam format (see exam_format), 'json' plain JSON arrays
+exam_file_format = os.environ.get('EXAM_FORMAT', 'exam').lower()
+text_cache_location = os.environ.get('TEXT_CACHE_PREFIX', 'text_cache')
+text_cache_disk_max_bytes = int(os.environ.get('TEXT_CACHE_DISK_MAX_BYTES', 512 * 1024 * 1024))
+text_caches = {}
+dedup_enabled = os.environ.get('DEDUP', 'on').lower() == 'on'
+dedup_index_location = os.environ.get('DEDUP_INDEX_PREFIX', 'dedup_index')
+dedup_threshold = float(os.environ.get('DEDUP_THRESHOLD', 0.5))
+# The first exam of a document fills its pool with at least this many questions; later exams are sampled from it
+pool_enabled = os.environ.get('QUESTION_POOL', 'on').lower() == 'on'
+pool_location = os.environ.get('QUESTION_POOL_PREFIX', 'question_pool')
+pool_size_mcq = int(os.environ.get('POOL_SIZE_MCQ', 30))
+pool_size_tfq = int(os.environ.get('POOL_SIZE_TFQ', 20))
+pool_topics = int(os.environ.get('POOL_TOPICS', 8))
+# Exams generated in parallel from one SQS batch
+exam_batch_workers = int(os.environ.get('EXAM_BATCH_WORKERS', 2))
+deadline_margin_seconds = int(os.environ.get('DEADLINE_MARGIN_SECONDS', 20))
+jobs_helper = HelperJobs(os.environ.get('JOBS_TABLE_NAME'))
+index_helper = HelperIndex(os.environ['INDEX_TABLE_NAME']) if os.environ.get('INDEX_TABLE_NAME') else None
 
 
+def get_text_cache(bucket_name):
+    """
+    Return the extracted-text cache for a bucket: /tmp of the warm container, then S3.
+    """
+    if bucket_name not in text_caches:
+        text_caches[bucket_name] = TieredCache([
+            DiskCache(os.path.join('/tmp', text_cache_location), text_cache_disk_max_bytes),
+            S3Cache(bucket_name, text_cache_location, client=s3),
+        ])
+    return text_caches[bucket_name]
+
+
+def get_s3_objects(body):
+    """
+    Return the (bucket, key, sequencer) of the objects of an S3 event notification, skipping
+    s3:TestEvent messages. The sequencer tells uploads of the same key apart, even with identical content.
+    """
+    notification = json.loads(body) if isinstance(body, str) else body
+    objects = []
+    for record in notification.get('Records', []):
+        if 's3' not in record:
+            continue
+        objects.append((record['s3']['bucket']['name'],
+                        urllib.parse.unquote_plus(record['s3']['object']['key'], encoding='utf-8'),
+                        record['s3']['object'].get('sequencer')))
+    return objects
+
+
+def process_sqs_batch(records, context, process=None):
+    """
+    Generate the exams of a batch of SQS messages, at most exam_batch_workers at a time.
+    Every message is processed; the ones that failed are returned for redelivery.
+
+    :param records: SQS records of the Lambda event, each holding an S3 event notification.
+    :param context: Lambda context.
+    :param process: Function (bucket_name, file_key, context, sequencer) generating one exam; generate_exam by default.
+    :return: Partial batch response listing the message ids of the failed records.
+    """
+    process = process or generate_exam
+
+    def run(record):
+        try:
+            for bucket_name, file_key, sequencer in get_s3_objects(record['body']):
+                process(bucket_name, file_key, context, sequencer)
+            return None
+        except Exception as e:
+            print(f"An error occurred processing message {record['messageId']}: {e!r}")
+            return record['messageId']
+
+    with ThreadPoolExecutor(max_workers=max(1, min(exam_batch_workers, len(records)))) as executor:
+        failed = [message_id for message_id in executor.map(run, records) if message_id]
+    emit({'BatchSize': len(records), 'FailedUploads': len(failed)}, dimensions={'Stage': 'batch'})
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
 
-response_format = """[
-{
-    "question": "What is the colour of the car in the book?",
-    "options": ["Blue", "Green", "Yellow", "Grey"],
-    "correct_answer": "Yellow"
-},
-{
-    "question": "what is the capital of France?",
-    "options": ["Paris", "Brussels", "Dublin", "London"],
-    "correct_answer": "Paris"
-},
-{
-    "question": "The Sky is blue?",
-    "options": ["True", "False"],
-    "correct_answer": "True"
-}
-]"""
-escaped_format = response_format.replace('{', '{{').replace('}', '}}')
-template_formatted=f"""
-    Human: using this format {escaped_format} as reference, modify this response to json
-    <response>
-    {{text}}
-    </response>
-
-    Assistant:"""
 
 def main(event, context):
-    
-    file_key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
-    bucket_name = event['Records'][0]['s3']['bucket']['name']
+    if event.get('action') == 'backfill_index':
+        # One-off maintenance call: index the exams written before the index existed
+        count = index_helper.backfill_from_s3(event['bucket'], questions_bank_location + '/')
+        return {'statusCode': 200, 'body': json.dumps(f'{count} exams indexed')}
+    if event.get('action') == 'assemble_exam':
+        # New exam on an already processed document, sampled from its pool without calling the model
+        file_path = assemble_exam(event['bucket'], event['source_hash'], event['name'], int(event.get('n_mcq', 5)),
+                                  int(event.get('n_tfq', 3)), int(event.get('n_mcq_options', 4)), event.get('seed'))
+        return {'statusCode': 200, 'body': json.dumps(file_path)}
+
+    records = event.get('Records', [])
+    if records and records[0].get('eventSource') == 'aws:sqs':
+        return process_sqs_batch(records, context)
+
+    # Direct S3 notification: process every record, then fail if any of them failed
+    errors = []
+    for bucket_name, file_key, sequencer in get_s3_objects(event):
+        try:
+            generate_exam(bucket_name, file_key, context, sequencer)
+        except Exception as e:
+            print(f"An error occurred creating the exam of {file_key}: {e!r}")
+            errors.append(e)
+    if errors:
+        raise errors[0]
+    return {
+        'statusCode': 200,
+        'body': json.dumps('file saved to file_path!'),
+    }
+
+
+def generate_exam(bucket_name, file_key, context, sequencer=None):
+    """
+    Generate the exam of one uploaded PDF, store it in the question bank and notify.
+    Each stage is recorded in the jobs table and its output checkpointed, so a retry
+    resumes after the last completed stage.
+
+    :param bucket_name: Name of the S3 bucket.
+    :param file_key: Key of the uploaded PDF (e.g. 'exams/lecture1.pdf').
+    :param context: Lambda context, used for the generation deadline.
+    :param sequencer: Sequencer of the S3 event of the upload, so that every upload starts its own job.
+    :return: Key of the exam in the question bank.
+    """
     print(f"Creating exam from file {file_key}")
     
+    file_helper = HelperFiles(bucket_name=bucket_name, file_key=file_key)
     try:
-        response = s3.get_object(Bucket=bucket_name, Key=file_key)
-        file_object = response['Body'].read()
+        response = s3.head_object(Bucket=bucket_name, Key=file_key)
     except Exception as e:
         print(e)
         print('Error getting object {} from bucket {}. Make sure they exist and your bucket is in the same region as this function.'.format(file_key, bucket_name))
         raise e
-    file_helper = HelperFiles(bucket_name=bucket_name, file_object=file_object)
-    file = file_helper.get_pdfobject_text()
     
     #setting default values for metadata 
     n_mcq = 5
@@ -69,60 +163,184 @@ def main(event, context):
         print(f"params {n_mcq=}, {n_tfq=}, {n_mcq_options=}")
     except:
         print(f"no metadata found, setting default values")
-    
-    template_instruction = f"""Human: You are a teacher during examination time and you are responsible for creating exam questions from the student study book.before creating the questions- Analyze the book found between <exam_book> </exam_book> tags, to identify distinct chapters, sections, or themes for question generation.
-                               - For true/false questions, select statements that can be clearly identified as true or false based on the book's content.
-                               - For MCQs, develop questions that challenge the understanding of the material, ensuring one correct answer and {n_mcq_options-1} distractors that are relevant but incorrect.
-                               - Randomize the selection of pages or topics for each run to generate a new set of questions, ensuring no two sets are identical.
-                               Please provide the questions in this format exactly
-                               for MCQ:
-                                  - the output should be like     
-                                   "question": "What is the colour of the car in the book?",
-                                   "options": ["Blue", "Green", "Yellow", "Grey"],
-                                   "correct_answer": "Yellow"
-                               For True/False:
-                                  - the output should be like     
-                                   "question": "is the sky Blue?",
-                                   "options": ["True", "False"],
-                                   "correct_answer": "True"
-                               
-                               
-                               Generate {n_tfq} true/false and {n_mcq} multiple-choice questions (MCQs) ensuring each question pertains to different pages or topics within the book. For MCQs, provide [n_mcq_options] options for each question. Focus on creating unique questions that cover a broad spectrum of the book's content, avoiding repetition and ensuring a diverse examination of the material. Use the following guidelines:
-                               
-                               1. True/False Questions:
-                                  - Craft each true/false question based on factual statements or key concepts from the book.
-                                  - Ensure each question spans a wide range of topics to cover the book comprehensively.
-                               
-                               
-                               2. Multiple-Choice Questions (MCQs):
-                                  - Formulate each MCQ to assess understanding of significant themes, events, or facts.
-                                  - Include {n_mcq_options} options per MCQ, making sure one is correct and the others are plausible but incorrect.
-                                  - Diversify the content areas and pages/topics for each MCQ to avoid overlap and repetition. 
-                                  """   
-    template_instruction += """
-                           <exam_book>
-                           {text}
-                           </exam_book>
-                           
-                           Assistant:"""  
-
-
-    response = bedrock.get_response(file, template_instruction)
-    response = bedrock.get_response(response, template_formatted)
-    json_exam = file_helper.convert_to_json_in_memory(response)
-
-    file_directory = file_key.split("/")[0]
-    file_name = file_key.split("/")[1].split(".")[0]
-    file_path = questions_bank_location +'/'+file_name+'.json'
-    file_helper.upload_to_s3(json_exam, bucket_name, file_path)
-    
-    # Publish the message to the SNS topic
-    email_message = 'Hello, Exam Generated'
-    sns.publish(
-        TopicArn=sns_topic_arn,
-        Message=email_message
-    )
-    return {
-        'statusCode': 200,
-        'body': json.dumps('file saved to file_path!'),
-    }
\ No newline at end of file
+
+    # The version id identifies the upload in versioned buckets, the event sequencer otherwise
+    job_id = HelperJobs.make_job_id(bucket_name, file_key, response.get('ETag'),
+                                    {'n_mcq': n_mcq, 'n_tfq': n_tfq, 'n_mcq_options': n_mcq_options},
+                                    upload=response.get('VersionId') or sequencer)
+    with bind(job_id=job_id, file_key=file_key), span('exam') as exam_span:
+        job = jobs_helper.start(job_id, file_key)
+        checkpoints = jobs_helper.checkpoints(bucket_name, job_id)
+        stage = 'extract'
+        try:
+            with span('extract') as extract_span:
+                # The extracted text is checkpointed by the text cache, keyed by the PDF's ETag and hash
+                file = file_helper.get_pdf_text_cached(get_text_cache(bucket_name), etag=response.get('ETag'))
+                extract_span.metric('Chars', len(file))
+            if 'extract' not in job['stages']:
+                jobs_helper.complete_stage(job_id, 'extract', source_hash=file_helper.file_hash or '')
+
+            stage = 'generate'
+            with span('generate') as generate_span:
+                questions = None
+                saved = checkpoints.get('questions.json')
+                if saved is not None:
+                    questions = json.loads(saved)
+                    print(f"resuming from {len(questions)} checkpointed questions")
+                    if 'generate' not in job['stages']:
+                        jobs_helper.complete_stage(job_id, 'generate', question_count=len(questions))
+                else:
+                    questions = generate_questions(file_helper, file, bucket_name, file_key, n_mcq, n_tfq,
+                                                   n_mcq_options, context, checkpoints, seed=job_id)
+                    checkpoints.put('questions.json', json.dumps(questions).encode('utf-8'))
+                    jobs_helper.complete_stage(job_id, 'generate', question_count=len(questions))
+                generate_span.metric('Questions', len(questions))
+
+            stage = 'upload'
+            file_name = file_key.split("/")[1].split(".")[0]
+            file_path = questions_bank_location + '/' + file_name + exam_extension()
+            if 'upload' not in job['stages']:
+                with span('upload'):
+                    write_exam(file_helper, bucket_name, file_name, questions,
+                               file_helper.file_hash or job.get('source_hash'))
+                jobs_helper.complete_stage(job_id, 'upload', exam_key=file_path)
+
+            stage = 'notify'
+            if 'notify' not in job['stages']:
+                with span('notify'):
+                    # Publish the message to the SNS topic
+                    email_message = 'Hello, Exam Generated'
+                    sns.publish(
+                        TopicArn=sns_topic_arn,
+                        Message=email_message
+                    )
+                jobs_helper.complete_stage(job_id, 'notify')
+        except Exception as e:
+            exam_span.set(failed_stage=stage)
+            jobs_helper.fail(job_id, stage, e)
+            raise
+    return file_path
+
+
+def assemble_exam(bucket_name, source_hash, name, n_mcq, n_tfq, n_mcq_options, seed=None):
+    """
+    Write an exam sampled from the question pool of a source document to the question bank.
+
+    :param bucket_name: Name of the S3 bucket.
+    :param source_hash: Content hash of the source document (the source_hash of its job).
+    :param name: Name of the exam in the question bank, without extension.
+    :param n_mcq: Number of multiple-choice questions.
+    :param n_tfq: Number of true/false questions.
+    :param n_mcq_options: Number of options per multiple-choice question.
+    :param seed: Seed of the sampling; random by default.
+    :return: Key of the exam in the question bank.
+    """
+    pool = HelperPool(S3Cache(bucket_name, pool_location, client=s3), pool_topics)
+    pooled = pool.load(source_hash, n_mcq_options)
+    have_mcq, have_tfq = HelperPool.count(pooled)
+    if have_mcq < n_mcq or have_tfq < n_tfq:
+        raise ValueError(f"the pool of {source_hash} holds {have_mcq} MCQs and {have_tfq} true/false questions")
+    questions = pool.assemble(pooled, n_mcq, n_tfq, seed if seed is not None else os.urandom(8))
+    return write_exam(HelperFiles(bucket_name=bucket_name), bucket_name, name, questions, source_hash)
+
+
+def exam_extension():
+    """
+    Return the file extension of the exams written to the question bank.
+    """
+    return '.json' if exam_file_format == 'json' else exam_format.EXTENSION
+
+
+def write_exam(file_helper, bucket_name, name, questions, source_hash=None):
+    """
+    Write an exam to the question bank in the EXAM_FORMAT format and add it to the index.
+
+    :param file_helper: HelperFiles instance.
+    :param bucket_name: Name of the S3 bucket.
+    :param name: Name of the exam, without extension.
+    :param questions: List of question dictionaries.
+    :param source_hash: Content hash of the source document, if known.
+    :return: Key of the exam in the question bank.
+    """
+    file_name = name + exam_extension()
+    file_path = questions_bank_location + '/' + file_name
+    if exam_file_format == 'json':
+        data = json.dumps(questions).encode('utf-8')
+        content_type = 'application/json'
+    else:
+        data = file_helper.questions_to_exam_bytes(questions)
+        content_type = exam_format.CONTENT_TYPE
+    file_helper.upload_to_s3(data, bucket_name, file_path, content_type=content_type)
+    if index_helper:
+        index_helper.put_exam(file_name, len(data), len(questions), source_hash=source_hash)
+    return file_path
+
+
+def generate_questions(file_helper, file, bucket_name, file_key, n_mcq, n_tfq, n_mcq_options, context, checkpoints,
+                       seed=None):
+    """
+    Run the generate stage: ask the model for questions until the invocation deadline,
+    then replace the near-duplicates of questions asked before about the same source.
+    With question pools, the model is only called while the pool of the source is too
+    small; the exam is then sampled from the pool.
+
+    :param seed: Seed of the sampling from the pool (the job id, so a retry picks the same questions).
+    :return: List of question dictionaries.
+    """
+    pool = None
+    pooled = []
+    generate_mcq, generate_tfq = n_mcq, n_tfq
+    if pool_enabled and file_helper.file_hash:
+        pool = HelperPool(S3Cache(bucket_name, pool_location, client=s3), pool_topics)
+        pooled = pool.load(file_helper.file_hash, n_mcq_options)
+        have_mcq, have_tfq = HelperPool.count(pooled)
+        if have_mcq >= n_mcq and have_tfq >= n_tfq:
+            print(f"assembling the exam from a pool of {len(pooled)} questions")
+            return pool.assemble(pooled, n_mcq, n_tfq, seed)
+        generate_mcq = max(max(n_mcq, pool_size_mcq) - have_mcq, 0)
+        generate_tfq = max(max(n_tfq, pool_size_tfq) - have_tfq, 0)
+        print(f"filling the question pool with {generate_mcq} MCQs and {generate_tfq} true/false questions")
+
+    # Leave time to upload the exam and notify before the Lambda timeout
+    deadline = None
+    if context is not None:
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000 - deadline_margin_seconds
+    generation_start = time.time()
+    first_question = []
+
+    def on_question(question):
+        # Only the latency is recorded here: the exam helper checkpoints each section's questions as they
+        # are streamed, so a stream cut short by the deadline or the end of the invocation resumes from them
+        if not first_question:
+            first_question.append(question)
+            emit({'TimeToFirstQuestion': round((time.time() - generation_start) * 1000, 3)},
+                 dimensions={'Stage': 'generate'}, units={'TimeToFirstQuestion': 'Milliseconds'})
+
+    exam_helper = HelperExam(bedrock, file_helper, n_mcq=generate_mcq, n_tfq=generate_tfq, n_mcq_options=n_mcq_options,
+                             deadline=deadline, on_question=on_question, checkpoints=checkpoints)
+    try:
+        questions = exam_helper.generate(file)
+    except BedrockCapacityError as e:
+        # Fail before the Lambda timeout; the retry resumes from the checkpointed model responses
+        emit({'Throttled': 1}, dimensions={'Stage': 'generate'}, resumable=e.resumable,
+             retry_after=e.retry_after, scheduler=bedrock.scheduler_stats())
+        raise
+    if dedup_enabled and file_helper.file_hash:
+        # numpy is only imported once questions need checking
+        from utils.helper_dedup import HelperDedup
+        dedup = HelperDedup(S3Cache(bucket_name, dedup_index_location, client=s3), dedup_threshold)
+        dedup.load(file_helper.file_hash)
+        questions = exam_helper.deduplicate(questions, dedup)
+        dedup.save(file_helper.file_hash)
+    if exam_helper.timed_out:
+        print(f"generation stopped at the deadline, saving the {len(questions)} questions received")
+    if pool is not None and questions:
+        pool.tag_topics(questions, file)
+        pooled = pool.add(file_helper.file_hash, n_mcq_options, questions)
+        questions = pool.assemble(pooled, n_mcq, n_tfq, seed)
+    if not questions:
+        raise RuntimeError(f"no question could be generated from {file_key}")
+    # Counters accumulate over the lifetime of a warm container, so they are logged as properties
+    emit({'GeneratedQuestions': len(questions), 'TimedOut': int(exam_helper.timed_out)},
+         dimensions={'Stage': 'generate'}, bedrock_cache=bedrock.cache_stats(), bedrock_scheduler=bedrock.scheduler_stats())
+    return questions
@@ -2,21 +2,57 @@
 # SPDX-License-Identifier: MIT-0
 """Helper utilities for working with Amazon Bedrock from Python notebooks"""
 # Python Built-Ins:
+import functools
 import os
 from typing import Optional
 
 # External Dependencies:
 import boto3
+import botocore.session
 from botocore.config import Config
+from botocore.credentials import RefreshableCredentials
 
 
+def _assumed_role_session(session_kwargs: dict, assumed_role: str):
+    """Create a boto3 Session whose credentials come from assuming `assumed_role`
+
+    The credentials are refreshed by botocore shortly before they expire, so a warm Lambda
+    container calls STS once per credential lifetime instead of once per client.
+    """
+    sts = boto3.Session(**session_kwargs).client("sts")
+
+    def refresh():
+        response = sts.assume_role(
+            RoleArn=str(assumed_role),
+            RoleSessionName="langchain-llm-1"
+        )
+        return {
+            "access_key": response["Credentials"]["AccessKeyId"],
+            "secret_key": response["Credentials"]["SecretAccessKey"],
+            "token": response["Credentials"]["SessionToken"],
+            "expiry_time": response["Credentials"]["Expiration"].isoformat(),
+        }
+
+    botocore_session = botocore.session.get_session()
+    botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+        metadata=refresh(),
+        refresh_using=refresh,
+        method="sts-assume-role",
+    )
+    return boto3.Session(botocore_session=botocore_session, region_name=session_kwargs.get("region_name"))
+
+
+@functools.lru_cache(maxsize=None)
 def get_bedrock_client(
     assumed_role: Optional[str] = None,
     region: Optional[str] = None,
     runtime: Optional[bool] = True,
+    max_attempts: int = 10,
 ):
     """Create a boto3 client for Amazon Bedrock, with optional configuration overrides
 
+    Clients are cached per set of arguments, so repeated calls in a warm container reuse them.
+
     Parameters
     ----------
     assumed_role :
@@ -27,6 +63,8 @@ def get_bedrock_client(
         If not specified, AWS_REGION or AWS_DEFAULT_REGION environment variable will be used.
     runtime :
         Optional choice of getting different client to perform operations with the Amazon Bedrock service.
+    max_attempts :
+        Optional number of attempts botocore makes for a call, retries included (default 10).
     """
     if region is None:
         target_region = os.environ.get("AWS_REGION", os.environ.get("AWS_DEFAULT_REGION"))
@@ -45,23 +83,16 @@ def get_bedrock_client(
     retry_config = Config(
         region_name=target_region,
         retries={
-            "max_attempts": 10,
+            "max_attempts": max_attempts,
             "mode": "standard",
         },
     )
-    session = boto3.Session(**session_kwargs)
-
     if assumed_role:
         print(f"  Using role: {assumed_role}", end='')
-        sts = session.client("sts")
-        response = sts.assume_role(
-            RoleArn=str(assumed_role),
-            RoleSessionName="langchain-llm-1"
-        )
+        session = _assumed_role_session(session_kwargs, assumed_role)
         print(" ... successful!")
-        client_kwargs["aws_access_key_id"] = response["Credentials"]["AccessKeyId"]
-        client_kwargs["aws_secret_access_key"] = response["Credentials"]["SecretAccessKey"]
-        client_kwargs["aws_session_token"] = response["Credentials"]["SessionToken"]
+    else:
+        session = boto3.Session(**session_kwargs)
 
     if runtime:
         service_name='bedrock-runtime'
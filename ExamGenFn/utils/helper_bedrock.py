@@ -1,30 +1,44 @@
 import json
 import os
-import sys
-import boto3
-from langchain.llms.bedrock import Bedrock
-from langchain.prompts import PromptTemplate
 
-module_path = ".."
-sys.path.append(os.path.abspath(module_path))
-print(sys.path.append(os.path.abspath(module_path)))
-from utils import bedrock, print_ww  # Importing utility functions
+from instrumentation import span
+from utils import bedrock  # Importing utility functions
+from utils.helper_cache import DiskCache, ExpiringCache, MemoryCache, ResponseCache, S3Cache, TieredCache
+from utils.helper_scheduler import BedrockCapacityError, BedrockScheduler, is_throttling_error
+from utils.helper_text import CHARS_PER_TOKEN, estimate_tokens
+
+# On-demand price of the model in USD per 1000 tokens, for the cost estimate logged with each call
+PRICE_INPUT_PER_1K = float(os.environ.get("BEDROCK_PRICE_INPUT_PER_1K", 0.008))
+PRICE_OUTPUT_PER_1K = float(os.environ.get("BEDROCK_PRICE_OUTPUT_PER_1K", 0.024))
+
+
+def format_claude_prompt(prompt):
+    """
+    Makes a prompt follow the Human/Assistant turn format required by Claude models on Bedrock.
+
+    :param prompt: Rendered prompt, possibly with indentation around the turn markers.
+    :return: Prompt starting with "\n\nHuman:" and ending with "\n\nAssistant:".
+    """
+    prompt = prompt.strip()
+    if prompt.startswith("Human:"):
+        prompt = "\n\n" + prompt
+    else:
+        prompt = "\n\nHuman: " + prompt
+    if prompt.endswith("Assistant:"):
+        prompt = prompt[:-len("Assistant:")].rstrip()
+    return prompt + "\n\nAssistant:"
 
 class HelperBedrock(object):
     """
     This class provides an interface to interact with the Bedrock API for generating text responses.
     """
     
-    def __init__(self):
+    def __init__(self, client=None):
         """
         Initializes the HelperBedrock object by setting up the Bedrock client with the appropriate configuration.
-        """
-        # Obtain the Bedrock client using the utility function
-        boto3_bedrock = bedrock.get_bedrock_client(
-            assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE", None),
-            region=os.environ.get("AWS_DEFAULT_REGION", None)
-        )
 
+        :param client: Optional bedrock-runtime client (e.g. a local stub), created on first use otherwise.
+        """
         # Configuration for inference requests
         inference_modifier = {
             'max_tokens_to_sample': 4096, 
@@ -35,28 +49,252 @@ class HelperBedrock(object):
         }
 
         # Initialize the Bedrock LLM with the specified model and configuration
-        self.textgen_llm = Bedrock(
-            model_id="anthropic.claude-v2",
-            client=boto3_bedrock, 
-            model_kwargs=inference_modifier 
-        )
+        self.model_id = "anthropic.claude-v2"
+        self.inference_modifier = inference_modifier
+        self._client = client
+        self._textgen_llm = None
+        self.response_cache = self._build_response_cache()
+        self.scheduler = self._build_scheduler()
+
+    @property
+    def client(self):
+        """
+        The bedrock-runtime client, created on first use so that cached responses never pay for it.
+        """
+        if self._client is None:
+            # Obtain the Bedrock client using the utility function
+            # With the scheduler, throttled calls are retried there, within the invocation deadline
+            self._client = bedrock.get_bedrock_client(
+                assumed_role=os.environ.get("BEDROCK_ASSUME_ROLE", None),
+                region=os.environ.get("AWS_DEFAULT_REGION", None),
+                max_attempts=2 if self.scheduler else 10
+            )
+        return self._client
+
+    @property
+    def textgen_llm(self):
+        """
+        The langchain Bedrock LLM when BEDROCK_CLIENT=langchain, otherwise None.
+        """
+        if self._textgen_llm is None and os.environ.get("BEDROCK_CLIENT", "direct") == "langchain":
+            # langchain is only imported when explicitly requested, it dominates the cold start
+            from langchain.llms.bedrock import Bedrock
+            self._textgen_llm = Bedrock(
+                model_id=self.model_id,
+                client=self.client, 
+                model_kwargs=self.inference_modifier 
+            )
+        return self._textgen_llm
 
-    def get_response(self, text, template):
+    def _build_response_cache(self):
+        """
+        Builds the optional response cache from the BEDROCK_CACHE environment variable, a
+        comma-separated list of layers from fastest to slowest: memory, disk and/or s3.
+
+        :return: ResponseCache instance, or None when caching is disabled.
+        """
+        backends = [name.strip() for name in os.environ.get("BEDROCK_CACHE", "").split(",") if name.strip()]
+        if not backends:
+            return None
+        prefix = os.environ.get("BEDROCK_CACHE_PREFIX", "bedrock_cache")
+        layers = []
+        for name in backends:
+            if name == "memory":
+                layers.append(MemoryCache(int(os.environ.get("BEDROCK_CACHE_MAX_ENTRIES", 256))))
+            elif name == "disk":
+                layers.append(DiskCache(os.path.join("/tmp", prefix),
+                                        int(os.environ.get("BEDROCK_CACHE_DISK_MAX_BYTES", 256 * 1024 * 1024))))
+            elif name == "s3":
+                layers.append(S3Cache(os.environ["BEDROCK_CACHE_BUCKET"], prefix))
+            else:
+                raise ValueError(f"unknown BEDROCK_CACHE backend: {name}")
+        ttl_seconds = int(os.environ.get("BEDROCK_CACHE_TTL", 24 * 60 * 60))
+        print(f"Bedrock response cache enabled: {backends}, ttl {ttl_seconds}s")
+        return ResponseCache(ExpiringCache(TieredCache(layers), ttl_seconds))
+
+    def _build_scheduler(self):
+        """
+        Builds the call scheduler unless BEDROCK_SCHEDULER=false. BEDROCK_TPM_BUDGET and
+        BEDROCK_RPM_BUDGET are the share of the account quota given to one container.
+
+        :return: BedrockScheduler instance, or None when disabled.
+        """
+        if os.environ.get("BEDROCK_SCHEDULER", "true").lower() != "true":
+            return None
+        tokens_per_minute = int(os.environ.get("BEDROCK_TPM_BUDGET", 0)) or None
+        requests_per_minute = int(os.environ.get("BEDROCK_RPM_BUDGET", 0)) or None
+        return BedrockScheduler(tokens_per_minute=tokens_per_minute,
+                                requests_per_minute=requests_per_minute,
+                                max_concurrency=int(os.environ.get("BEDROCK_MAX_CONCURRENCY", 8)))
+
+    def estimate_call_tokens(self, prompt):
+        """
+        Estimates the tokens a call counts against the quota: the prompt plus the largest completion.
+
+        :param prompt: Fully rendered prompt.
+        :return: Estimated token count.
+        """
+        return estimate_tokens(prompt) + self.inference_modifier['max_tokens_to_sample']
+
+    def scheduler_stats(self):
+        """
+        Returns the scheduler counters, or None when the scheduler is disabled.
+        """
+        return self.scheduler.stats() if self.scheduler else None
+
+    def cache_stats(self):
+        """
+        Returns the response cache hit/miss/deduplication counters, or None when caching is disabled.
+        """
+        return self.response_cache.stats() if self.response_cache else None
+
+    def invoke(self, prompt, deadline=None):
+        """
+        Calls the model once through the scheduler, straight through the bedrock-runtime client.
+
+        :param prompt: Fully rendered prompt.
+        :param deadline: Optional epoch time by which the call must have completed.
+        :return: The completion text.
+        :raise BedrockCapacityError: When throttling keeps the call from completing before the deadline.
+        """
+        if self.scheduler is None:
+            return self._invoke(prompt)
+        prompt_tokens = estimate_tokens(prompt)
+        return self.scheduler.call(lambda: self._invoke(prompt), self.estimate_call_tokens(prompt), deadline,
+                                   count_tokens=lambda completion: prompt_tokens + estimate_tokens(completion))
+
+    @staticmethod
+    def record_usage(call_span, prompt, completion, input_tokens=None, output_tokens=None):
+        """
+        Adds the token counts and estimated cost of a call to its span. Counts reported by
+        Bedrock are used when available, estimates from the text otherwise.
+
+        :param call_span: Span of the call.
+        :param prompt: Prompt sent.
+        :param completion: Completion received (possibly partial).
+        :param input_tokens: Input token count reported by Bedrock.
+        :param output_tokens: Output token count reported by Bedrock.
+        """
+        input_tokens = int(input_tokens) if input_tokens is not None else estimate_tokens(prompt)
+        output_tokens = int(output_tokens) if output_tokens is not None else estimate_tokens(completion)
+        call_span.metric('InputTokens', input_tokens)
+        call_span.metric('OutputTokens', output_tokens)
+        call_span.metric('CostUSD', round(input_tokens / 1000 * PRICE_INPUT_PER_1K
+                                          + output_tokens / 1000 * PRICE_OUTPUT_PER_1K, 6), 'None')
+
+    def _invoke(self, prompt):
+        with span('bedrock.invoke', model_id=self.model_id) as call_span:
+            if self.textgen_llm is not None:
+                completion = self.textgen_llm(prompt)
+                self.record_usage(call_span, prompt, completion)
+                return completion
+            response = self.client.invoke_model(
+                modelId=self.model_id,
+                body=json.dumps({"prompt": format_claude_prompt(prompt), **self.inference_modifier}),
+                accept="application/json",
+                contentType="application/json"
+            )
+            completion = json.loads(response["body"].read())["completion"]
+            headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+            self.record_usage(call_span, prompt, completion, headers.get("x-amzn-bedrock-input-token-count"),
+                              headers.get("x-amzn-bedrock-output-token-count"))
+            return completion
+
+    def get_response(self, text, template, deadline=None):
         """
         Generates a response based on the provided text and template.
 
         :param text: Input text for the prompt.
         :param template: Template for formatting the prompt.
+        :param deadline: Optional epoch time by which the response is needed.
         :return: The generated response from the model.
         """
-        # Create a prompt template with multiple input variables
-        multi_var_prompt = PromptTemplate(
-            input_variables=['text'], 
-            template=template
-        )
-
-        # Format the prompt with the input text
-        prompt = multi_var_prompt.format(text=text)
+        # Format the prompt with the input text; templates use {text} and {{ }} like PromptTemplate
+        prompt = template.format(text=text)
         # Generate the response using the configured LLM
-        response = self.textgen_llm(prompt)
-        return response
\ No newline at end of file
+        if self.response_cache is None:
+            return self.invoke(prompt, deadline)
+        # Identical requests (e.g. S3 event redeliveries) are answered from the cache
+        key = ResponseCache.make_key(model_id=self.model_id, params=self.inference_modifier, prompt=prompt)
+        return self.response_cache.get_or_compute(key, lambda: self.invoke(prompt, deadline))
+
+    def invoke_stream(self, prompt, deadline=None):
+        """
+        Calls the model with invoke_model_with_response_stream and yields the completion as it arrives.
+        The scheduler slot of the call is held until the stream is read or closed.
+
+        :param prompt: Fully rendered prompt.
+        :param deadline: Optional epoch time by which the stream must have started.
+        :return: Generator of completion text pieces.
+        :raise BedrockCapacityError: When throttling keeps the call from starting before the deadline.
+        """
+        def start():
+            return self.client.invoke_model_with_response_stream(
+                modelId=self.model_id,
+                body=json.dumps({"prompt": format_claude_prompt(prompt), **self.inference_modifier}),
+                accept="application/json",
+                contentType="application/json"
+            )
+
+        tokens = self.estimate_call_tokens(prompt)
+        with span('bedrock.stream', model_id=self.model_id) as call_span:
+            response = self.scheduler.start(start, tokens, deadline) if self.scheduler else start()
+            call_span.metric('TimeToStream', round(call_span.elapsed() * 1000, 3), 'Milliseconds')
+            stream = response["body"]
+            pieces = []
+            invocation_metrics = {}
+            throttled = False
+            try:
+                for event in stream:
+                    chunk = event.get("chunk")
+                    if chunk:
+                        data = json.loads(chunk["bytes"])
+                        # The last chunk carries the token counts of the call
+                        invocation_metrics = data.get("amazon-bedrock-invocationMetrics") or invocation_metrics
+                        completion = data.get("completion")
+                        if completion:
+                            if not pieces:
+                                call_span.metric('TimeToFirstToken', round(call_span.elapsed() * 1000, 3),
+                                                 'Milliseconds')
+                            pieces.append(completion)
+                            yield completion
+            except Exception as e:
+                # Throttling can also arrive as an error event in the middle of the stream
+                throttled = is_throttling_error(e)
+                if throttled:
+                    raise BedrockCapacityError(f"Bedrock stream throttled: {e}") from e
+                raise
+            finally:
+                # Stops the download when the caller gives up early (e.g. near the Lambda timeout)
+                stream.close()
+                completion = ''.join(pieces)
+                self.record_usage(call_span, prompt, completion, invocation_metrics.get("inputTokenCount"),
+                                  invocation_metrics.get("outputTokenCount"))
+                if self.scheduler:
+                    used = estimate_tokens(prompt) + -(-len(completion) // CHARS_PER_TOKEN)
+                    self.scheduler.release(throttled=throttled, unused_tokens=tokens - used)
+
+    def stream_response(self, text, template, deadline=None):
+        """
+        Generates a response like get_response, yielding it piece by piece as the model writes it.
+
+        :param text: Input text for the prompt.
+        :param template: Template for formatting the prompt.
+        :param deadline: Optional epoch time by which the response is needed.
+        :return: Generator of response text pieces.
+        """
+        prompt = template.format(text=text)
+        key = None
+        if self.response_cache is not None:
+            key = ResponseCache.make_key(model_id=self.model_id, params=self.inference_modifier, prompt=prompt)
+            cached = self.response_cache.lookup(key)
+            if cached is not None:
+                yield cached
+                return
+        pieces = []
+        for piece in self.invoke_stream(prompt, deadline):
+            pieces.append(piece)
+            yield piece
+        # Only complete responses are cached, never ones cut short by the caller
+        if key is not None:
+            self.response_cache.store(key, ''.join(pieces))
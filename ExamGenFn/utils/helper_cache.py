@@ -0,0 +1,352 @@
+"""Byte caches (in-process, local /tmp and S3 shared by all Lambda containers) and a response memoizer"""
+# Python Built-Ins:
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# External Dependencies:
+import boto3
+from botocore.exceptions import ClientError
+
+# Expiry timestamp stored in front of values by ExpiringCache
+EXPIRY_HEADER = struct.Struct('>d')
+
+
+class DiskCache:
+    """
+    Size-bounded cache of files in a local directory, evicting the least recently used
+    entries first. Survives across invocations of a warm Lambda container.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """
+        Initializes the DiskCache.
+
+        :param directory: Directory holding the cache files; created if missing.
+        :param max_bytes: Total size above which the least recently used files are evicted.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace('/', '_'))
+
+    def get(self, key):
+        """
+        Looks up a cache entry.
+
+        :param key: Cache key.
+        :return: Cached bytes, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        # Record the access so that eviction keeps recently used entries
+        os.utime(path)
+        return value
+
+    def put(self, key, value):
+        """
+        Stores a cache entry and evicts old entries beyond the size limit.
+
+        :param key: Cache key.
+        :param value: Bytes to store.
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.part'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+
+class S3Cache:
+    """
+    Cache of objects stored under a prefix of an S3 bucket.
+    """
+
+    def __init__(self, bucket_name, prefix, client=None):
+        """
+        Initializes the S3Cache.
+
+        :param bucket_name: Name of the S3 bucket.
+        :param prefix: Key prefix of the cache objects (e.g. 'text_cache').
+        :param client: Optional boto3 S3 client.
+        """
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip('/')
+        self.client = client or boto3.client('s3')
+
+    def get(self, key):
+        """
+        Looks up a cache entry.
+
+        :param key: Cache key.
+        :return: Cached bytes, or None on a miss.
+        """
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=f"{self.prefix}/{key}")
+            return response['Body'].read()
+        except ClientError as e:
+            # Missing keys show up as AccessDenied when the role cannot list the prefix
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404', 'AccessDenied', '403'):
+                print(f"An error occurred reading cache entry {key} from s3: {e}")
+            return None
+
+    def put(self, key, value):
+        """
+        Stores a cache entry.
+
+        :param key: Cache key.
+        :param value: Bytes to store.
+        """
+        try:
+            self.client.put_object(Bucket=self.bucket_name, Key=f"{self.prefix}/{key}", Body=value)
+        except ClientError as e:
+            print(f"An error occurred writing cache entry {key} to s3: {e}")
+
+
+class TieredCache:
+    """
+    Chain of caches ordered from fastest to slowest. Hits in a slower layer are copied
+    into the faster layers, writes go to every layer.
+    """
+
+    def __init__(self, layers):
+        """
+        Initializes the TieredCache.
+
+        :param layers: List of caches with get(key) and put(key, value) methods.
+        """
+        self.layers = layers
+
+    def get(self, key):
+        """
+        Looks up a cache entry in each layer in turn.
+
+        :param key: Cache key.
+        :return: Cached bytes, or None on a miss in every layer.
+        """
+        for i, layer in enumerate(self.layers):
+            value = layer.get(key)
+            if value is not None:
+                for faster_layer in self.layers[:i]:
+                    faster_layer.put(key, value)
+                return value
+        return None
+
+    def put(self, key, value):
+        """
+        Stores a cache entry in every layer.
+
+        :param key: Cache key.
+        :param value: Bytes to store.
+        """
+        for layer in self.layers:
+            layer.put(key, value)
+
+
+class MemoryCache:
+    """
+    In-process LRU cache holding at most `max_entries` entries.
+    """
+
+    def __init__(self, max_entries=256):
+        """
+        Initializes the MemoryCache.
+
+        :param max_entries: Number of entries above which the least recently used one is evicted.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Looks up a cache entry.
+
+        :param key: Cache key.
+        :return: Cached bytes, or None on a miss.
+        """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        Stores a cache entry, evicting the least recently used entry when full.
+
+        :param key: Cache key.
+        :param value: Bytes to store.
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class ExpiringCache:
+    """
+    Adds a time to live to any cache by prefixing stored values with their expiry time.
+    """
+
+    def __init__(self, cache, ttl_seconds):
+        """
+        Initializes the ExpiringCache.
+
+        :param cache: Underlying cache with get(key) and put(key, value) methods.
+        :param ttl_seconds: Lifetime of an entry; expired entries are treated as misses.
+        """
+        self.cache = cache
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        """
+        Looks up a cache entry that has not expired yet.
+
+        :param key: Cache key.
+        :return: Cached bytes, or None on a miss.
+        """
+        value = self.cache.get(key)
+        if value is None or len(value) < EXPIRY_HEADER.size:
+            return None
+        (expires_at,) = EXPIRY_HEADER.unpack_from(value)
+        if expires_at < time.time():
+            return None
+        return value[EXPIRY_HEADER.size:]
+
+    def put(self, key, value):
+        """
+        Stores a cache entry that expires after the configured time to live.
+
+        :param key: Cache key.
+        :param value: Bytes to store.
+        """
+        self.cache.put(key, EXPIRY_HEADER.pack(time.time() + self.ttl_seconds) + value)
+
+
+class ResponseCache:
+    """
+    Memoizes the results of expensive calls (e.g. model invocations) in a cache, and makes
+    concurrent callers asking for the same key share a single call.
+    """
+
+    def __init__(self, cache):
+        """
+        Initializes the ResponseCache.
+
+        :param cache: Cache with get(key) and put(key, value) methods storing UTF-8 text.
+        """
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.counters = {'hits': 0, 'misses': 0, 'deduplicated': 0}
+
+    @staticmethod
+    def make_key(**fields):
+        """
+        Builds a cache key from the fields identifying a request.
+
+        :param fields: JSON-serializable values, e.g. model id, parameters and prompt.
+        :return: Hex SHA-256 digest of the fields.
+        """
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached result for `key`, or computes, caches and returns it.
+
+        :param key: Cache key.
+        :param compute: Function without arguments returning the result as a string.
+        :return: The cached or computed string.
+        """
+        value = self.cache.get(key)
+        if value is not None:
+            self._count('hits')
+            return value.decode('utf-8')
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[key] = future
+        if not owner:
+            # An identical request is already running: wait for its result
+            self._count('deduplicated')
+            return future.result()
+
+        self._count('misses')
+        try:
+            result = compute()
+            self.cache.put(key, result.encode('utf-8'))
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def lookup(self, key):
+        """
+        Returns the cached result for `key` without computing it, counting a hit or a miss.
+
+        :param key: Cache key.
+        :return: The cached string, or None.
+        """
+        value = self.cache.get(key)
+        self._count('hits' if value is not None else 'misses')
+        return value.decode('utf-8') if value is not None else None
+
+    def store(self, key, result):
+        """
+        Caches a result computed outside of get_or_compute (e.g. assembled from a stream).
+
+        :param key: Cache key.
+        :param result: Result string.
+        """
+        self.cache.put(key, result.encode('utf-8'))
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        """
+        Returns the hit, miss and deduplication counters since the container started.
+        """
+        with self.lock:
+            return dict(self.counters)
@@ -0,0 +1,198 @@
+"""Near-duplicate question detection with MinHash signatures and an LSH index per source document"""
+# Python Built-Ins:
+import io
+import json
+import zlib
+
+# External Dependencies:
+import numpy as np
+
+# Local Dependencies:
+from utils.helper_text import normalize_text
+
+# Mersenne prime larger than any CRC32 value, for the (a * x + b) mod p hash family
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def question_shingles(question, size=5):
+    """
+    Returns the character shingles of a question, robust to rewording of a few words.
+
+    :param question: Question dictionary.
+    :param size: Shingle length in characters.
+    :return: Set of shingle strings.
+    """
+    text = normalize_text(f"{question.get('question', '')} {question.get('correct_answer', '')}")
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class MinHashIndex:
+    """
+    MinHash signatures of questions, banded into an LSH table so that candidate duplicates
+    are found without comparing a question against every stored one.
+    """
+
+    def __init__(self, num_perm=128, bands=32, seed=1):
+        """
+        Initializes an empty index.
+
+        :param num_perm: Number of hash functions in a signature.
+        :param bands: Number of LSH bands; num_perm / bands rows per band. 32 bands of 4 rows
+                      make pairs above ~0.4 Jaccard similarity likely candidates.
+        :param seed: Seed of the hash functions; stored signatures are only comparable with the same seed.
+        """
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.texts = []
+        self.buckets = {}
+
+    def signature(self, shingles):
+        """
+        Computes the MinHash signature of a shingle set.
+
+        :param shingles: Set of strings.
+        :return: Array of num_perm uint32 values.
+        """
+        hashes = np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in shingles], dtype=np.uint64)
+        permuted = (hashes[:, None] * self.a[None, :] + self.b[None, :]) % MERSENNE_PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def add(self, signature, text):
+        """
+        Adds a signature to the index.
+
+        :param signature: MinHash signature.
+        :param text: Question text, kept to explain rejections.
+        """
+        position = len(self.texts)
+        self.signatures = np.vstack([self.signatures, signature[None, :]])
+        self.texts.append(text)
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, []).append(position)
+
+    def most_similar(self, signature):
+        """
+        Finds the stored question most similar to a signature among the LSH candidates.
+
+        :param signature: MinHash signature.
+        :return: (estimated Jaccard similarity, position), or (0.0, None) without candidates.
+        """
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self.buckets.get(key, ()))
+        if not candidates:
+            return 0.0, None
+        positions = np.fromiter(candidates, dtype=np.int64)
+        similarities = (self.signatures[positions] == signature[None, :]).mean(axis=1)
+        best = int(np.argmax(similarities))
+        return float(similarities[best]), int(positions[best])
+
+    def to_bytes(self):
+        """
+        Serializes the signatures and question texts (the LSH table is rebuilt on load).
+        """
+        buffer = io.BytesIO()
+        texts = np.frombuffer(json.dumps(self.texts).encode('utf-8'), dtype=np.uint8)
+        np.savez_compressed(buffer, signatures=self.signatures, texts=texts)
+        return buffer.getvalue()
+
+    def load_bytes(self, data):
+        """
+        Adds the entries of a serialized index.
+
+        :param data: Bytes returned by to_bytes() of an index with the same parameters.
+        """
+        with np.load(io.BytesIO(data)) as arrays:
+            signatures = arrays['signatures']
+            texts = json.loads(arrays['texts'].tobytes().decode('utf-8'))
+        offset = len(self.texts)
+        self.signatures = np.vstack([self.signatures, signatures.astype(np.uint32)])
+        self.texts.extend(texts)
+        for position, signature in enumerate(signatures, start=offset):
+            for key in self._band_keys(signature):
+                self.buckets.setdefault(key, []).append(position)
+
+    def __len__(self):
+        return len(self.texts)
+
+
+class HelperDedup:
+    """
+    This class rejects questions that nearly duplicate another question of the same exam or
+    of a previous exam generated from the same source document. Each source document has
+    its own index, stored in a cache under its content hash.
+    """
+
+    def __init__(self, store, threshold=0.5):
+        """
+        Initializes the HelperDedup.
+
+        :param store: Cache with get(key) and put(key, value) methods holding the indexes.
+        :param threshold: Estimated Jaccard similarity above which a question is a duplicate.
+        """
+        self.store = store
+        self.threshold = threshold
+        self.index = MinHashIndex()
+        self.new_entries = []
+
+    def load(self, source_hash):
+        """
+        Loads the index of the questions already generated from a source document.
+
+        :param source_hash: Content hash of the source document.
+        """
+        data = self.store.get(f"{source_hash}.npz")
+        if data is not None:
+            self.index.load_bytes(data)
+        print(f"dedup index of {source_hash} holds {len(self.index)} questions")
+
+    def filter(self, questions):
+        """
+        Splits questions into accepted ones, which join the index, and near-duplicates.
+
+        :param questions: List of question dictionaries.
+        :return: (accepted questions, rejected questions).
+        """
+        accepted, rejected = [], []
+        for question in questions:
+            signature = self.index.signature(question_shingles(question))
+            similarity, position = self.index.most_similar(signature)
+            if similarity >= self.threshold:
+                print(f"rejected near-duplicate ({similarity:.2f}): {question.get('question')!r} "
+                      f"~ {self.index.texts[position]!r}")
+                rejected.append(question)
+                continue
+            self.index.add(signature, str(question.get('question', '')))
+            self.new_entries.append((signature, str(question.get('question', ''))))
+            accepted.append(question)
+        return accepted, rejected
+
+    def save(self, source_hash):
+        """
+        Stores the index with the questions accepted since load(), merged into the latest
+        stored version to keep the entries added meanwhile by concurrent jobs.
+
+        :param source_hash: Content hash of the source document.
+        """
+        if not self.new_entries:
+            return
+        latest = MinHashIndex()
+        data = self.store.get(f"{source_hash}.npz")
+        if data is not None:
+            latest.load_bytes(data)
+        known = set(latest.texts)
+        for signature, text in self.new_entries:
+            if text not in known:
+                latest.add(signature, text)
+        self.store.put(f"{source_hash}.npz", latest.to_bytes())
+        self.new_entries = []
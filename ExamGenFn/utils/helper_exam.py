@@ -0,0 +1,492 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import span
+from utils.helper_files import QuestionStreamParser
+from utils.helper_scheduler import BedrockCapacityError
+from utils.helper_text import estimate_tokens, normalize_text, split_text, spread_indices
+
+response_format = """[
+{
+    "question": "What is the colour of the car in the book?",
+    "options": ["Blue", "Green", "Yellow", "Grey"],
+    "correct_answer": "Yellow"
+},
+{
+    "question": "what is the capital of France?",
+    "options": ["Paris", "Brussels", "Dublin", "London"],
+    "correct_answer": "Paris"
+},
+{
+    "question": "The Sky is blue?",
+    "options": ["True", "False"],
+    "correct_answer": "True"
+}
+]"""
+escaped_format = response_format.replace('{', '{{').replace('}', '}}')
+template_formatted=f"""
+    Human: using this format {escaped_format} as reference, modify this response to json
+    <response>
+    {{text}}
+    </response>
+
+    Assistant:"""
+
+
+def get_instruction_template(n_mcq, n_tfq, n_mcq_options, avoid=None):
+    """
+    Builds the question generation prompt for the requested question counts.
+
+    :param n_mcq: Number of multiple-choice questions.
+    :param n_tfq: Number of true/false questions.
+    :param n_mcq_options: Number of options per multiple-choice question.
+    :param avoid: Optional list of question texts the new questions must not repeat.
+    :return: Prompt template with a single {text} input variable.
+    """
+    template_instruction = f"""Human: You are a teacher during examination time and you are responsible for creating exam questions from the student study book.before creating the questions- Analyze the book found between <exam_book> </exam_book> tags, to identify distinct chapters, sections, or themes for question generation.
+                               - For true/false questions, select statements that can be clearly identified as true or false based on the book's content.
+                               - For MCQs, develop questions that challenge the understanding of the material, ensuring one correct answer and {n_mcq_options-1} distractors that are relevant but incorrect.
+                               - Randomize the selection of pages or topics for each run to generate a new set of questions, ensuring no two sets are identical.
+                               Please provide the questions in this format exactly
+                               for MCQ:
+                                  - the output should be like
+                                   "question": "What is the colour of the car in the book?",
+                                   "options": ["Blue", "Green", "Yellow", "Grey"],
+                                   "correct_answer": "Yellow"
+                               For True/False:
+                                  - the output should be like
+                                   "question": "is the sky Blue?",
+                                   "options": ["True", "False"],
+                                   "correct_answer": "True"
+
+
+                               Generate {n_tfq} true/false and {n_mcq} multiple-choice questions (MCQs) ensuring each question pertains to different pages or topics within the book. For MCQs, provide [n_mcq_options] options for each question. Focus on creating unique questions that cover a broad spectrum of the book's content, avoiding repetition and ensuring a diverse examination of the material. Use the following guidelines:
+
+                               1. True/False Questions:
+                                  - Craft each true/false question based on factual statements or key concepts from the book.
+                                  - Ensure each question spans a wide range of topics to cover the book comprehensively.
+
+
+                               2. Multiple-Choice Questions (MCQs):
+                                  - Formulate each MCQ to assess understanding of significant themes, events, or facts.
+                                  - Include {n_mcq_options} options per MCQ, making sure one is correct and the others are plausible but incorrect.
+                                  - Diversify the content areas and pages/topics for each MCQ to avoid overlap and repetition.
+
+                               Return only a JSON array of the questions, using this format {escaped_format} as reference, between <questions></questions> tags.
+                                  """
+    if avoid:
+        existing = "\n".join(f"- {question}" for question in avoid).replace('{', '{{').replace('}', '}}')
+        template_instruction += f"""
+                               Do not ask again about what these existing questions cover:
+                               <existing_questions>
+                               {existing}
+                               </existing_questions>
+                                  """
+    template_instruction += """
+                           <exam_book>
+                           {text}
+                           </exam_book>
+
+                           Assistant:"""
+    return template_instruction
+
+
+def is_true_false(question):
+    """
+    Tells whether a parsed question is a true/false question.
+
+    :param question: Question dictionary with an 'options' list.
+    :return: True for true/false questions, False for MCQs.
+    """
+    options = [str(option).strip().lower() for option in question.get('options', [])]
+    return sorted(options) == ['false', 'true']
+
+
+def normalize_question(question):
+    """
+    Normalizes question text so that trivially different duplicates compare equal.
+
+    :param question: Question dictionary.
+    :return: Lower-cased question text without punctuation and extra spaces.
+    """
+    return normalize_text(question.get('question', ''))
+
+
+class HelperExam:
+    """
+    This class turns extracted book text into a list of exam questions, either with a
+    single prompt or by generating questions per section of a large book in parallel.
+    """
+
+    def __init__(self, bedrock, file_helper, n_mcq=5, n_tfq=3, n_mcq_options=4, deadline=None, on_question=None,
+                 checkpoints=None):
+        """
+        Initializes the HelperExam with the Bedrock and file helpers and the requested counts.
+
+        :param bedrock: HelperBedrock instance used to call the model.
+        :param file_helper: HelperFiles instance used to parse model responses.
+        :param n_mcq: Number of multiple-choice questions to generate.
+        :param n_tfq: Number of true/false questions to generate.
+        :param n_mcq_options: Number of options per multiple-choice question.
+        :param deadline: Optional epoch time by which generation must end; model calls are scheduled
+                         earliest deadline first and streamed generation keeps what it has at the deadline.
+        :param on_question: Optional callback receiving each question as soon as it is streamed.
+        :param checkpoints: Optional store (get/put of bytes) keeping the raw model responses of a job,
+                            and the questions of interrupted streams, so that a retried job does not
+                            call the model again for what it already received.
+        """
+        self.bedrock = bedrock
+        self.file_helper = file_helper
+        self.n_mcq = n_mcq
+        self.n_tfq = n_tfq
+        self.n_mcq_options = n_mcq_options
+        self.generation_mode = os.environ.get('GENERATION_MODE', 'auto')
+        self.chunk_max_tokens = int(os.environ.get('CHUNK_MAX_TOKENS', 24000))
+        self.chunk_workers = int(os.environ.get('CHUNK_WORKERS', 6))
+        self.chunk_overgeneration = float(os.environ.get('CHUNK_OVERGENERATION', 1.5))
+        self.retrieval = os.environ.get('RETRIEVAL', 'on').lower() == 'on'
+        self.retrieval_passage_tokens = int(os.environ.get('RETRIEVAL_PASSAGE_TOKENS', 600))
+        self.retrieval_passages_per_question = float(os.environ.get('RETRIEVAL_PASSAGES_PER_QUESTION', 1.5))
+        self.streaming = os.environ.get('BEDROCK_STREAMING', 'false').lower() == 'true'
+        self.deadline = deadline
+        self.on_question = on_question
+        self.timed_out = False
+        self.checkpoints = checkpoints
+        self.dedup_topup_rounds = int(os.environ.get('DEDUP_TOPUP_ROUNDS', 2))
+        self.book_text = None
+
+    def generate(self, text):
+        """
+        Generates the exam questions, switching to chunked mode for large books.
+
+        :param text: Extracted book text.
+        :return: List of question dictionaries.
+        """
+        if self.retrieval:
+            # numpy is only imported once a book is actually processed
+            from utils.helper_retrieval import select_passages
+            book_tokens = estimate_tokens(text)
+            text = select_passages(text, self.n_mcq + self.n_tfq, self.retrieval_passage_tokens,
+                                   self.retrieval_passages_per_question)
+            print(f"prompt reduced from ~{book_tokens} to ~{estimate_tokens(text)} book tokens")
+        self.book_text = text
+        n_tokens = estimate_tokens(text)
+        chunked = self.generation_mode == 'chunked' or (
+            self.generation_mode == 'auto' and n_tokens > self.chunk_max_tokens)
+        print(f"book has ~{n_tokens} tokens, generation mode: {'chunked' if chunked else 'single'}")
+        if chunked:
+            questions = self.generate_chunked(text)
+        else:
+            questions = self.generate_section(text, self.n_mcq, self.n_tfq)
+        return questions
+
+    def generate_section(self, text, n_mcq, n_tfq, name='response', avoid=None):
+        """
+        Generates questions for a piece of text with a single prompt.
+
+        :param text: Book text or a section of it.
+        :param n_mcq: Number of multiple-choice questions for this text.
+        :param n_tfq: Number of true/false questions for this text.
+        :param name: Checkpoint name of the model response.
+        :param avoid: Optional list of question texts the new questions must not repeat.
+        :return: List of question dictionaries.
+        """
+        saved = self.load_checkpoint(name)
+        if saved is not None:
+            print(f"resuming from checkpointed model response {name}")
+            return self.parse_response(saved, name)
+        if self.streaming:
+            # A stream interrupted by the deadline or the end of the invocation left its questions:
+            # only the missing ones are asked for
+            streamed = self.load_partial(name)
+            if streamed:
+                have_tfq = sum(1 for question in streamed if is_true_false(question))
+                n_tfq = max(n_tfq - have_tfq, 0)
+                n_mcq = max(n_mcq - (len(streamed) - have_tfq), 0)
+                print(f"resuming {name} from {len(streamed)} streamed questions, {n_mcq + n_tfq} left")
+                if not (n_mcq or n_tfq):
+                    return streamed
+                avoid = (avoid or []) + [question['question'] for question in streamed]
+            template_instruction = get_instruction_template(n_mcq, n_tfq, self.n_mcq_options, avoid)
+            return self.generate_section_streaming(text, template_instruction, name, streamed)
+        template_instruction = get_instruction_template(n_mcq, n_tfq, self.n_mcq_options, avoid)
+        response = self.bedrock.get_response(text, template_instruction, self.deadline)
+        self.save_checkpoint(name, response)
+        return self.parse_response(response, name)
+
+    def load_checkpoint(self, name):
+        """
+        Returns a checkpointed model response, or None.
+
+        :param name: Checkpoint name.
+        """
+        if self.checkpoints is None:
+            return None
+        value = self.checkpoints.get(f"{name}.txt")
+        return value.decode('utf-8') if value is not None else None
+
+    def save_checkpoint(self, name, response):
+        """
+        Checkpoints a complete model response.
+
+        :param name: Checkpoint name.
+        :param response: Model response.
+        """
+        if self.checkpoints is not None:
+            self.checkpoints.put(f"{name}.txt", response.encode('utf-8'))
+
+    def load_partial(self, name):
+        """
+        Returns the questions checkpointed from an interrupted stream, or an empty list.
+
+        :param name: Checkpoint name.
+        """
+        if self.checkpoints is None:
+            return []
+        value = self.checkpoints.get(f"{name}.partial.json")
+        return json.loads(value) if value is not None else []
+
+    def save_partial(self, name, questions):
+        """
+        Checkpoints the questions received so far from a stream that has not ended yet.
+
+        :param name: Checkpoint name.
+        :param questions: Validated questions, those of earlier interrupted streams included.
+        """
+        if self.checkpoints is not None:
+            self.checkpoints.put(f"{name}.partial.json", json.dumps(questions).encode('utf-8'))
+
+    def generate_section_streaming(self, text, template_instruction, name='response', streamed=None):
+        """
+        Generates questions for a piece of text from a streamed response, handing each question
+        to on_question as soon as it is complete and stopping at the deadline. The questions are
+        checkpointed as they arrive, so a stream cut short by the deadline or by the end of the
+        invocation is resumed from them.
+
+        :param text: Book text or a section of it.
+        :param template_instruction: Question generation prompt.
+        :param name: Checkpoint name of the model response.
+        :param streamed: Questions of earlier interrupted streams of this section.
+        :return: List of question dictionaries.
+        """
+        streamed = list(streamed or [])
+        resumed = bool(streamed)
+        parser = QuestionStreamParser()
+        pieces = []
+        saved = len(streamed)
+        stream = self.bedrock.stream_response(text, template_instruction, self.deadline)
+        try:
+            for piece in stream:
+                pieces.append(piece)
+                for question in parser.feed(piece):
+                    streamed.append(question)
+                    if self.on_question:
+                        self.on_question(question)
+                if len(streamed) > saved:
+                    self.save_partial(name, streamed)
+                    saved = len(streamed)
+                if self.deadline and time.time() > self.deadline:
+                    print(f"deadline reached mid-stream, keeping {len(streamed)} questions")
+                    self.timed_out = True
+                    break
+        finally:
+            stream.close()
+            if len(streamed) > saved:
+                self.save_partial(name, streamed)
+        if self.timed_out:
+            return streamed
+        if not parser.questions:
+            # Nothing could be picked out incrementally: repair or reformat the whole response
+            if not resumed:
+                self.save_checkpoint(name, ''.join(pieces))
+                return self.parse_response(''.join(pieces), name)
+            streamed += self.parse_response(''.join(pieces), name)
+        else:
+            if not resumed:
+                self.save_checkpoint(name, ''.join(pieces))
+            # Responses parsed locally vs. responses that needed the reformat round-trip
+            with span('parse', section=name) as parse_span:
+                parse_span.metric('Fallback', 0)
+        if resumed:
+            # The response only holds the questions missing after the interruption: the checkpoint
+            # of the section is the JSON of all its questions
+            self.save_checkpoint(name, json.dumps(streamed))
+        return streamed
+
+    def parse_response(self, response, name='response'):
+        """
+        Parses the questions out of a model response, asking the model to reformat it only
+        when local repair fails.
+
+        :param response: Model response to the question generation prompt.
+        :param name: Checkpoint name of the model response.
+        :return: List of question dictionaries.
+        """
+        with span('parse', section=name) as parse_span:
+            try:
+                questions = self.file_helper.parse_questions(response)
+                parse_span.metric('Fallback', 0)
+                return questions
+            except ValueError as e:
+                # Only pay for the reformat round-trip when local repair could not recover the JSON
+                print(f"local JSON repair failed ({e}), asking the model to reformat the response")
+                parse_span.metric('Fallback', 1)
+            reformatted = self.load_checkpoint(f"{name}.reformatted")
+            if reformatted is None:
+                reformatted = self.bedrock.get_response(response, template_formatted, self.deadline)
+                self.save_checkpoint(f"{name}.reformatted", reformatted)
+            return self.file_helper.parse_questions(reformatted)
+
+    def deduplicate(self, questions, dedup):
+        """
+        Drops near-duplicate questions, within the exam and against previous exams of the
+        same source, and asks the model for replacements of the dropped questions only.
+
+        :param questions: Generated questions.
+        :param dedup: HelperDedup loaded with the index of the source document.
+        :return: List of question dictionaries, near-duplicates only where no replacement was found.
+        """
+        accepted, rejected = dedup.filter(questions)
+        missing_tfq = sum(1 for question in rejected if is_true_false(question))
+        missing_mcq = len(rejected) - missing_tfq
+        sections = split_text(self.book_text or '', self.chunk_max_tokens) or ['']
+        for round_number in range(1, self.dedup_topup_rounds + 1):
+            if not (missing_mcq or missing_tfq) or self.timed_out or (self.deadline and time.time() > self.deadline):
+                break
+            print(f"top-up round {round_number}: replacing {missing_mcq} MCQs and {missing_tfq} true/false questions")
+            section = sections[(round_number - 1) % len(sections)]
+            try:
+                candidates = self.generate_section(section, missing_mcq, missing_tfq, name=f"topup-{round_number}",
+                                                   avoid=[question['question'] for question in accepted])
+            except Exception as e:
+                print(f"An error occurred generating top-up questions: {e}")
+                break
+            # Only fill the rejected slots, by question type
+            tfqs = [question for question in candidates if is_true_false(question)][:missing_tfq]
+            mcqs = [question for question in candidates if not is_true_false(question)][:missing_mcq]
+            new, rejected_again = dedup.filter(tfqs + mcqs)
+            rejected += rejected_again
+            new_tfq = sum(1 for question in new if is_true_false(question))
+            missing_tfq -= new_tfq
+            missing_mcq -= len(new) - new_tfq
+            accepted += new
+        if missing_mcq or missing_tfq:
+            # A repeated question is better than a missing one: refill the slots still open
+            # with rejected questions that are not exact copies of an accepted one
+            print(f"{missing_mcq + missing_tfq} slots could not be filled with new questions, reusing near-duplicates")
+            seen = {normalize_question(question) for question in accepted}
+            for question in rejected:
+                key = normalize_question(question)
+                if key in seen:
+                    continue
+                if is_true_false(question) and missing_tfq:
+                    missing_tfq -= 1
+                elif not is_true_false(question) and missing_mcq:
+                    missing_mcq -= 1
+                else:
+                    continue
+                seen.add(key)
+                accepted.append(question)
+        print(f"{len(accepted)} questions after deduplication")
+        return accepted
+
+    def allocate(self, n_sections, n_questions):
+        """
+        Spreads a question count over sections, favouring sections spread across the book.
+
+        :param n_sections: Number of sections the book was split into.
+        :param n_questions: Number of questions to distribute.
+        :return: List with the number of questions to ask for each section.
+        """
+        quotas = [0] * n_sections
+        if n_questions <= 0:
+            return quotas
+        picked = spread_indices(n_sections, n_questions)
+        for i in range(n_questions):
+            quotas[picked[i % len(picked)]] += 1
+        return quotas
+
+    def generate_chunked(self, text):
+        """
+        Splits the book into token-budgeted sections, generates questions for the sections
+        concurrently and merges the results down to the requested counts.
+
+        :param text: Extracted book text.
+        :return: List of question dictionaries.
+        """
+        sections = split_text(text, self.chunk_max_tokens)
+        # Ask for a few more questions than needed to leave room for deduplication
+        mcq_quotas = self.allocate(len(sections), round(self.n_mcq * self.chunk_overgeneration))
+        tfq_quotas = self.allocate(len(sections), round(self.n_tfq * self.chunk_overgeneration))
+        jobs = [(i, sections[i], mcq_quotas[i], tfq_quotas[i])
+                for i in range(len(sections)) if mcq_quotas[i] or tfq_quotas[i]]
+        print(f"split book into {len(sections)} sections, generating from {len(jobs)}")
+
+        capacity_errors = []
+
+        def run(job):
+            index, section, n_mcq, n_tfq = job
+            try:
+                return index, self.generate_section(section, n_mcq, n_tfq, name=f"section-{index:03d}")
+            except BedrockCapacityError as e:
+                print(f"No Bedrock capacity for section {index} before the deadline: {e}")
+                capacity_errors.append(e)
+                return index, None
+            except Exception as e:
+                print(f"An error occurred generating questions for section {index}: {e}")
+                return index, None
+
+        with ThreadPoolExecutor(max_workers=max(1, self.chunk_workers)) as executor:
+            results = list(executor.map(run, jobs))
+
+        per_section = [questions for _, questions in results if questions]
+        if not per_section:
+            if capacity_errors:
+                # Sections answered so far are in the response cache, a retry resumes from there
+                raise capacity_errors[0]
+            raise RuntimeError("question generation failed for every section")
+        if capacity_errors:
+            self.timed_out = True
+        return self.merge(per_section)
+
+    def merge(self, per_section):
+        """
+        Deduplicates questions across sections and picks them round-robin so that the
+        final exam covers as many sections as possible.
+
+        :param per_section: List of question lists, one per section in book order.
+        :return: List of at most n_tfq true/false questions followed by at most n_mcq MCQs.
+        """
+        seen = set()
+        mcq_queues, tfq_queues = [], []
+        for questions in per_section:
+            mcqs, tfqs = [], []
+            for question in questions:
+                key = normalize_question(question)
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                (tfqs if is_true_false(question) else mcqs).append(question)
+            mcq_queues.append(mcqs)
+            tfq_queues.append(tfqs)
+        return self._round_robin(tfq_queues, self.n_tfq) + self._round_robin(mcq_queues, self.n_mcq)
+
+    @staticmethod
+    def _round_robin(queues, limit):
+        """
+        Takes items from each queue in turn until `limit` items are picked.
+
+        :param queues: List of lists to pick from.
+        :param limit: Maximum number of items to pick.
+        :return: List of picked items.
+        """
+        picked = []
+        depth = 0
+        while len(picked) < limit and any(depth < len(queue) for queue in queues):
+            for queue in queues:
+                if depth < len(queue) and len(picked) < limit:
+                    picked.append(queue[depth])
+            depth += 1
+        return picked
@@ -1,23 +1,92 @@
 import boto3
 from botocore.exceptions import NoCredentialsError
-from pdfminer.high_level import extract_text
 from io import BytesIO
+import gzip
+import hashlib
 import io
+import multiprocessing
+import os
+import tempfile
+import uuid
 
 import json
 import csv
+import re
+
+import exam_format
+from instrumentation import span, timed
+
+# pdfminer is imported inside the functions that parse PDFs: cached text never needs it,
+# which keeps it out of the Lambda cold start
+
+# Typographic quotes models sometimes emit instead of plain JSON quotes
+SMART_QUOTES = '\u201c\u201d'
+
+
+def _open_pdf(source):
+    """
+    Open a PDF given either as a local path or as raw bytes.
+
+    :param source: Path of the PDF file, or its content as bytes.
+    :return: Binary file-like object.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return BytesIO(source)
+    return open(source, 'rb')
+
+
+def _page_text(page_layout):
+    """
+    Collect the text of a pdfminer page layout.
+
+    :param page_layout: LTPage object.
+    :return: Text of the page.
+    """
+    from pdfminer.layout import LTTextContainer
+    return ''.join(element.get_text() for element in page_layout if isinstance(element, LTTextContainer))
+
+
+def _extract_page_range(source, first_page, last_page, conn):
+    """
+    Worker entry point: extract pages [first_page, last_page) and send them back through a pipe.
+
+    :param source: Path of the PDF file, or its content as bytes.
+    :param first_page: Zero-based index of the first page to extract.
+    :param last_page: Zero-based index after the last page to extract.
+    :param conn: Write end of a multiprocessing Pipe.
+    """
+    from pdfminer.high_level import extract_pages
+    try:
+        with _open_pdf(source) as pdf_file:
+            pages = [_page_text(page_layout) for page_layout in
+                     extract_pages(pdf_file, page_numbers=range(first_page, last_page), maxpages=last_page)]
+        conn.send(pages)
+    except Exception as e:
+        conn.send(e)
+    finally:
+        conn.close()
+
 
 class HelperFiles:
-    def __init__(self, bucket_name=None, file_key=None, file_object=None):
+    def __init__(self, bucket_name=None, file_key=None, file_object=None, file_path=None):
         """
         Initializes the HelperFiles with specified bucket and file key.
 
         :param bucket_name: Name of the S3 bucket.
         :param file_key: Key of the file in the S3 bucket.
+        :param file_object: Content of the PDF file as bytes.
+        :param file_path: Local path of the PDF file, used instead of file_object when set.
         """
         self.bucket_name = bucket_name
         self.file_key = file_key
         self.file_object = file_object
+        self.file_path = file_path
+        self.file_hash = None
+        self.pdf_workers = int(os.environ.get('PDF_WORKERS', os.cpu_count() or 1))
+        self.pdf_max_pages = int(os.environ.get('PDF_MAX_PAGES', 0)) or None
+        self.pdf_parallel_min_pages = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 32))
+        # 'spawn' or 'forkserver': safe to start from a multithreaded process
+        self.pdf_start_method = os.environ.get('PDF_START_METHOD', 'spawn')
 
     def get_pdf_text_local(self):
         """
@@ -25,6 +94,7 @@ class HelperFiles:
 
         :return: Extracted text from the PDF.
         """
+        from pdfminer.high_level import extract_text
         text = extract_text(self.file_key)
         return text
      
@@ -34,6 +104,7 @@ class HelperFiles:
 
         :return: Extracted text from the PDF.
         """
+        from pdfminer.high_level import extract_text
         try:
             # Create a new S3 client instance
             s3 = boto3.client('s3')
@@ -59,6 +130,7 @@ class HelperFiles:
         
         :return: Extracted text from the PDF.
         """
+        from pdfminer.high_level import extract_text
         try:
             # Use BytesIO to create a file-like object from the file content
             with BytesIO(self.file_object) as pdf_file:
@@ -70,6 +142,171 @@ class HelperFiles:
             print(f"An error occurred while accessing S3: {e}")
             return None
 
+    def _pdf_source(self):
+        """
+        Return the PDF as a local path when available, otherwise as bytes.
+        """
+        return self.file_path if self.file_path else self.file_object
+
+    def get_pdf_page_count(self):
+        """
+        Read the number of pages from the PDF page tree without parsing page contents.
+
+        :return: Number of pages in the PDF.
+        """
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfparser import PDFParser
+        from pdfminer.pdftypes import resolve1
+        with _open_pdf(self._pdf_source()) as pdf_file:
+            document = PDFDocument(PDFParser(pdf_file))
+            return int(resolve1(resolve1(document.catalog['Pages'])['Count']))
+
+    def iter_pdf_pages(self, max_pages=None, workers=None):
+        """
+        Lazily extract the text of the PDF page by page.
+
+        Page ranges are fanned out to worker processes when the document is large enough.
+        Processes talk over Pipes because Lambda has no /dev/shm for multiprocessing queues.
+        Workers are spawned, not forked: this runs in the threads of an SQS batch, and a process
+        forked while another thread holds a lock (boto3, urllib3, print) can deadlock.
+
+        :param max_pages: Stop after this many pages (all pages when None).
+        :param workers: Number of worker processes (PDF_WORKERS by default).
+        :return: Generator of page texts, in document order.
+        """
+        from pdfminer.high_level import extract_pages
+        source = self._pdf_source()
+        max_pages = max_pages or self.pdf_max_pages
+        workers = workers or self.pdf_workers
+
+        try:
+            n_pages = self.get_pdf_page_count()
+        except Exception as e:
+            print(f"Could not read the page count, extracting serially: {e}")
+            n_pages = None
+        if n_pages is not None and max_pages:
+            n_pages = min(n_pages, max_pages)
+
+        if n_pages is None or workers <= 1 or n_pages < self.pdf_parallel_min_pages:
+            with _open_pdf(source) as pdf_file:
+                for page_layout in extract_pages(pdf_file, maxpages=max_pages or 0):
+                    yield _page_text(page_layout)
+            return
+
+        # Contiguous page ranges, one per worker; workers only need the file path (or bytes) and their range
+        context = multiprocessing.get_context(self.pdf_start_method)
+        bounds = [n_pages * i // workers for i in range(workers + 1)]
+        processes = []
+        for first_page, last_page in zip(bounds, bounds[1:]):
+            if first_page == last_page:
+                continue
+            parent_conn, child_conn = context.Pipe(duplex=False)
+            process = context.Process(target=_extract_page_range,
+                                      args=(source, first_page, last_page, child_conn))
+            process.start()
+            child_conn.close()
+            processes.append((process, parent_conn))
+        print(f"extracting {n_pages} pages with {len(processes)} worker processes")
+
+        try:
+            for process, parent_conn in processes:
+                pages = parent_conn.recv()
+                if isinstance(pages, Exception):
+                    raise pages
+                yield from pages
+        finally:
+            for process, parent_conn in processes:
+                parent_conn.close()
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+    def get_pdf_text(self, max_pages=None, workers=None):
+        """
+        Extract the text of the PDF using page-parallel extraction.
+
+        :param max_pages: Stop after this many pages (all pages when None).
+        :param workers: Number of worker processes (PDF_WORKERS by default).
+        :return: Extracted text, pages separated by form feeds like pdfminer's extract_text.
+        """
+        with span('pdf_extract', file_key=self.file_key) as extract_span:
+            pages = list(self.iter_pdf_pages(max_pages=max_pages, workers=workers))
+            text = ''.join(page + '\f' for page in pages)
+            extract_span.metric('Pages', len(pages))
+            extract_span.metric('Chars', len(text))
+        return text
+
+    def compute_file_hash(self):
+        """
+        Compute the SHA-256 content hash of the PDF, reading the local file in blocks.
+
+        :return: Hex digest of the file content.
+        """
+        digest = hashlib.sha256()
+        if self.file_path:
+            with open(self.file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+        else:
+            digest.update(self.file_object)
+        return digest.hexdigest()
+
+    def download_from_s3(self, local_path):
+        """
+        Stream the PDF from S3 to a local file and use that file from now on.
+
+        :param local_path: Destination path on local storage.
+        """
+        s3 = boto3.client('s3')
+        with span('s3_download', file_key=self.file_key) as download_span:
+            s3.download_file(self.bucket_name, self.file_key, local_path)
+            download_span.metric('Bytes', os.path.getsize(local_path), 'Bytes')
+        self.file_path = local_path
+
+    def get_pdf_text_cached(self, text_cache, etag=None):
+        """
+        Return the text of the PDF from the content-addressed cache, extracting and caching it on a miss.
+
+        Entries are keyed by the SHA-256 of the file and stored gzip-compressed. When the S3
+        ETag of the upload is given, a small pointer from the ETag to the hash lets repeat
+        uploads of the same file skip the download as well as the extraction.
+
+        :param text_cache: Cache with get(key) and put(key, value) methods (see utils.helper_cache).
+        :param etag: Optional S3 ETag of the uploaded object.
+        :return: Extracted text from the PDF.
+        """
+        etag_key = 'etag/' + etag.strip('"') if etag else None
+        if etag_key:
+            file_hash = text_cache.get(etag_key)
+            if file_hash is not None:
+                compressed = text_cache.get(file_hash.decode() + '.txt.gz')
+                if compressed is not None:
+                    self.file_hash = file_hash.decode()
+                    print(f"text cache hit for {self.file_key} (etag)")
+                    return gzip.decompress(compressed).decode('utf-8')
+
+        local_path = None
+        if not self.file_path and self.file_object is None:
+            local_path = os.path.join(tempfile.gettempdir(), 'exam-source-' + uuid.uuid4().hex + '.pdf')
+            self.download_from_s3(local_path)
+        try:
+            self.file_hash = self.compute_file_hash()
+            compressed = text_cache.get(self.file_hash + '.txt.gz')
+            if compressed is not None:
+                print(f"text cache hit for {self.file_key} ({self.file_hash})")
+                text = gzip.decompress(compressed).decode('utf-8')
+            else:
+                print(f"text cache miss for {self.file_key} ({self.file_hash})")
+                text = self.get_pdf_text()
+                text_cache.put(self.file_hash + '.txt.gz', gzip.compress(text.encode('utf-8')))
+        finally:
+            if local_path:
+                os.remove(local_path)
+                self.file_path = None
+        if etag_key:
+            text_cache.put(etag_key, self.file_hash.encode())
+        return text
+
     def convert_to_csv_in_memory(self, text):
         """
         Convert list text to CSV and store it in memory.
@@ -78,9 +315,7 @@ class HelperFiles:
         :return: File-like object containing CSV data.
         """
         # Parse the JSON string to convert it into a Python object (list of dictionaries)
-        start_index = text.find('[')  # Find the index where JSON starts
-        json_string = text[start_index:].strip("```")  # Substring from start_index to the end
-        data_list = json.loads(json_string)
+        data_list = self.parse_questions(text)
 
         # Create an in-memory text stream (this will hold the CSV data)
         output = io.StringIO()
@@ -113,6 +348,180 @@ class HelperFiles:
         # The 'output' object now contains the CSV data in memory
         return output
 
+    @staticmethod
+    def _repair_json(json_string):
+        """
+        Fix the mistakes models most often make when writing JSON by hand, outside of string
+        values only: typographic quotes around keys and values, and trailing commas. Quotes and
+        commas inside strings (e.g. a question quoting someone) are kept.
+
+        :param json_string: Candidate JSON text.
+        :return: Repaired JSON text.
+        """
+        def next_char(i):
+            while i < len(json_string) and json_string[i].isspace():
+                i += 1
+            return json_string[i] if i < len(json_string) else ''
+
+        output = []
+        quote = None  # '"' inside a JSON string, 'smart' inside a string opened by a typographic quote
+        escaped = False
+        for i, char in enumerate(json_string):
+            if escaped:
+                output.append(char)
+                escaped = False
+            elif quote is not None and char == '\\':
+                output.append(char)
+                escaped = True
+            elif quote == '"':
+                output.append(char)
+                if char == '"':
+                    quote = None
+            elif quote == 'smart':
+                # A typographic quote closes the string only where JSON expects the string to end
+                if char in SMART_QUOTES and next_char(i + 1) in (',', ':', '}', ']', ''):
+                    output.append('"')
+                    quote = None
+                else:
+                    output.append('\\"' if char == '"' else char)
+            elif char == '"':
+                output.append(char)
+                quote = '"'
+            elif char in SMART_QUOTES:
+                output.append('"')
+                quote = 'smart'
+            elif char == ',' and next_char(i + 1) in (']', '}'):
+                continue  # trailing comma
+            else:
+                output.append(char)
+        return ''.join(output)
+
+    @staticmethod
+    def _scan_balanced(text, start):
+        """
+        Find the end of the bracketed value starting at text[start], ignoring brackets in strings.
+
+        :param text: Text to scan.
+        :param start: Index of the opening '[' or '{'.
+        :return: Tuple (end index or None if unbalanced, index after the last complete top-level object).
+        """
+        depth = 0
+        in_string = False
+        escaped = False
+        last_object_end = None
+        for i in range(start, len(text)):
+            char = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+            elif char in ']}':
+                depth -= 1
+                if depth == 0:
+                    return i + 1, last_object_end
+                if depth == 1 and char == '}':
+                    last_object_end = i + 1
+        return None, last_object_end
+
+    def _extract_json_array(self, text):
+        """
+        Extract and repair the JSON array of questions from free-form model output.
+
+        :param text: Model response.
+        :return: Parsed list, or None if no array could be recovered.
+        """
+        # Prefer the content of <questions> tags and drop markdown code fences
+        match = re.search(r"<questions>(.*?)(?:</questions>|$)", text, re.DOTALL)
+        if match:
+            text = match.group(1)
+        text = re.sub(r"```[a-zA-Z]*", "", text)
+
+        # Find the index where the array of objects starts, skipping stray brackets in prose
+        match = re.search(r"\[\s*\{", text)
+        if not match:
+            return None
+        start_index = match.start()
+        end_index, last_object_end = self._scan_balanced(text, start_index)
+        if end_index is not None:
+            json_string = text[start_index:end_index]
+        elif last_object_end is not None:
+            # The response was cut off: keep the complete objects and close the array
+            json_string = text[start_index:last_object_end] + ']'
+        else:
+            return None
+        for candidate in (json_string, self._repair_json(json_string)):
+            try:
+                return json.loads(candidate)
+            except json.JSONDecodeError:
+                pass
+
+        # Last resort: salvage every object that parses on its own
+        data_list = []
+        index = text.find('{', start_index)
+        while index != -1:
+            end, _ = self._scan_balanced(text, index)
+            if end is None:
+                break
+            for candidate in (text[index:end], self._repair_json(text[index:end])):
+                try:
+                    data_list.append(json.loads(candidate))
+                    break
+                except json.JSONDecodeError:
+                    pass
+            index = text.find('{', end)
+        return data_list or None
+
+    @staticmethod
+    def _validate_question(item):
+        """
+        Check a parsed question against the exam schema and normalize it.
+
+        :param item: Parsed JSON value.
+        :return: Normalized question dictionary, or None if the item is not a usable question.
+        """
+        if not isinstance(item, dict):
+            return None
+        question = item.get('question')
+        options = item.get('options')
+        correct_answer = item.get('correct_answer')
+        if not isinstance(question, str) or not question.strip():
+            return None
+        if not isinstance(options, list) or len(options) < 2:
+            return None
+        options = [str(option).strip() for option in options]
+        if len(set(options)) != len(options):
+            return None
+        # The answer must be one of the options, compared case-insensitively
+        matches = [option for option in options if option.lower() == str(correct_answer).strip().lower()]
+        if not matches:
+            return None
+        return {'question': question.strip(), 'options': options, 'correct_answer': matches[0]}
+
+    def parse_questions(self, text):
+        """
+        Parse, repair and validate the list of questions out of a model response.
+
+        :param text: Model response containing a JSON array of questions.
+        :return: List of question dictionaries.
+        :raises ValueError: If no valid question could be recovered from the response.
+        """
+        data_list = self._extract_json_array(text)
+        if not isinstance(data_list, list):
+            raise ValueError("no JSON array of questions found in the response")
+        questions = [question for question in map(self._validate_question, data_list) if question]
+        if not questions:
+            raise ValueError("no valid question found in the response")
+        if len(questions) < len(data_list):
+            print(f"dropped {len(data_list) - len(questions)} invalid question(s)")
+        return questions
+
     def convert_to_json_in_memory(self, text):
         """
         Keep the JSON text and store it in memory.
@@ -121,10 +530,16 @@ class HelperFiles:
         :return: File-like object containing JSON data.
         """
         # Parse the JSON string to ensure it's valid JSON and to convert it into a Python object
-        start_index = text.find('[')  # Find the index where JSON starts
-        json_string = text[start_index:].strip("```")  # Substring from start_index to the end, removing any extra characters
-        data_list = json.loads(json_string)  # This also validates the JSON content
+        data_list = self.parse_questions(text)
+        return self.questions_to_json_in_memory(data_list)
+
+    def questions_to_json_in_memory(self, data_list):
+        """
+        Store a list of questions as JSON in memory.
 
+        :param data_list: List of question dictionaries.
+        :return: File-like object containing JSON data.
+        """
         # Create an in-memory text stream (this will hold the JSON data)
         output = io.StringIO()
     
@@ -136,18 +551,37 @@ class HelperFiles:
 
         # The 'output' object now contains the JSON data in memory
         return output
-    def upload_to_s3(self, file_obj, bucket_name, s3_file_path):
+
+    def questions_to_exam_bytes(self, data_list):
         """
-        Upload a file-like object to an S3 bucket.
+        Encode a list of questions in the compressed exam format (see exam_format).
 
-        :param file_obj: File-like object to upload (must support 'read()' method).
+        :param data_list: List of question dictionaries.
+        :return: Exam file content as bytes.
+        """
+        return exam_format.encode(data_list)
+
+    @timed('s3_upload')
+    def upload_to_s3(self, file_obj, bucket_name, s3_file_path, content_type=None):
+        """
+        Upload a file-like object, or bytes, to an S3 bucket.
+
+        :param file_obj: File-like object to upload (must support 'read()' method), or bytes.
         :param bucket_name: Name of the S3 bucket.
         :param s3_file_path: The file path in the S3 bucket (e.g., 'folder/filename.csv').
+        :param content_type: Content type of the object, for bytes.
         """
         # Create an S3 client
         s3 = boto3.client('s3')
 
         try:
+            if isinstance(file_obj, (bytes, bytearray)):
+                # Bytes are sent as they are, in a single request
+                print("file path in helper="+ s3_file_path)
+                s3.put_object(Bucket=bucket_name, Key=s3_file_path, Body=file_obj,
+                              ContentType=content_type or 'application/octet-stream')
+                print(f"File uploaded to {bucket_name}/{s3_file_path}")
+                return
             # Check if the file object is a string-based file-like object (e.g., StringIO)
             # and convert it to a byte-based file-like object (e.g., BytesIO) if necessary.
             if isinstance(file_obj, io.StringIO):
@@ -165,4 +599,97 @@ class HelperFiles:
             s3.upload_fileobj(file_obj_bytes, bucket_name, s3_file_path)
             print(f"File uploaded to {bucket_name}/{s3_file_path}")
         except Exception as e:
-            print(f"An error occurred uploading to s3: {e}")
\ No newline at end of file
+            print(f"An error occurred uploading to s3: {e}")
+            # Callers must not report a file that was never written
+            raise
+
+class QuestionStreamParser:
+    """
+    Incremental parser that picks complete question objects out of a streamed model response
+    as soon as their closing brace arrives.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty parser.
+        """
+        self.buffer = ''
+        self.position = 0  # next character of the buffer to scan
+        self.in_array = False
+        self.done = False  # set once the array is closed
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+        self.questions = []
+
+    def feed(self, chunk):
+        """
+        Adds a piece of the response and returns the questions completed by it.
+
+        :param chunk: Next piece of streamed text.
+        :return: List of newly completed, validated question dictionaries.
+        """
+        completed = []
+        if self.done:
+            return completed
+        self.buffer += chunk
+        if not self.in_array:
+            # Wait for the opening of the array of objects
+            match = re.search(r"\[\s*\{", self.buffer[self.position:])
+            if not match:
+                # Keep scanning from near the end, the '[' may be followed by '{' in the next chunk
+                self.position = max(self.position, len(self.buffer) - 64)
+                return completed
+            self.in_array = True
+            self.position += match.start() + 1
+        buffer = self.buffer
+        for i in range(self.position, len(buffer)):
+            char = buffer[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '[{':
+                if self.depth == 0 and char == '{':
+                    self.object_start = i
+                self.depth += 1
+            elif char in ']}':
+                self.depth -= 1
+                if self.depth == 0 and char == '}' and self.object_start is not None:
+                    question = self._parse_object(buffer[self.object_start:i + 1])
+                    if question:
+                        completed.append(question)
+                    self.object_start = None
+                elif self.depth < 0:
+                    # End of the array: ignore anything after it
+                    self.in_array = False
+                    self.done = True
+                    self.depth = 0
+                    self.position = len(buffer)
+                    self.buffer = buffer[:i + 1]
+                    self.questions.extend(completed)
+                    return completed
+        self.position = len(buffer)
+        self.questions.extend(completed)
+        return completed
+
+    @staticmethod
+    def _parse_object(json_string):
+        """
+        Parses and validates one question object.
+
+        :param json_string: Text of a single JSON object.
+        :return: Normalized question dictionary, or None if it is not a valid question.
+        """
+        for candidate in (json_string, HelperFiles._repair_json(json_string)):
+            try:
+                return HelperFiles._validate_question(json.loads(candidate))
+            except json.JSONDecodeError:
+                pass
+        return None
@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timezone
+
+import boto3
+
+import exam_format
+
+
+class HelperIndex:
+    """
+    This class maintains the question bank index: one small DynamoDB item per exam, so
+    that listing the bank is a paginated query instead of an S3 bucket listing.
+    """
+
+    def __init__(self, table_name, bank='questions_bank'):
+        """
+        Initializes the HelperIndex.
+
+        :param table_name: Name of the DynamoDB index table.
+        :param bank: Partition key value grouping the exams of one question bank.
+        """
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.bank = bank
+
+    def put_exam(self, name, size, question_count, source_hash=None, created=None):
+        """
+        Adds or replaces the index entry of an exam.
+
+        :param name: File name of the exam in the question bank (e.g. 'lecture1.json').
+        :param size: Size of the exam file in bytes.
+        :param question_count: Number of questions in the exam.
+        :param source_hash: SHA-256 of the source PDF, if known.
+        :param created: ISO 8601 creation time; defaults to now.
+        """
+        item = {
+            'bank': self.bank,
+            'name': name,
+            'size': size,
+            'question_count': question_count,
+            'created': created or datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        if source_hash:
+            item['source_hash'] = source_hash
+        self.table.put_item(Item=item)
+        print(f"Indexed {name} ({question_count} questions, {size} bytes)")
+
+    def backfill_from_s3(self, bucket_name, prefix):
+        """
+        Indexes every exam already stored under a prefix, e.g. after the index was introduced.
+
+        :param bucket_name: Name of the S3 bucket.
+        :param prefix: Prefix of the question bank (e.g. 'questions_bank/').
+        :return: Number of exams indexed.
+        """
+        s3 = boto3.client('s3')
+        count = 0
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'] == prefix:
+                    continue
+                body = s3.get_object(Bucket=bucket_name, Key=obj['Key'])['Body'].read()
+                try:
+                    # The compressed format carries the count in its header
+                    question_count = (exam_format.read_header(body)[0]['count'] if exam_format.is_exam(body)
+                                      else len(json.loads(body)))
+                except ValueError:
+                    print(f"Skipping {obj['Key']}: not an exam")
+                    continue
+                self.put_exam(obj['Key'][len(prefix):], obj['Size'], question_count,
+                              created=obj['LastModified'].astimezone(timezone.utc).isoformat(timespec='seconds'))
+                count += 1
+        return count
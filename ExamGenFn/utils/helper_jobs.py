@@ -0,0 +1,133 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+import boto3
+
+from utils.helper_cache import S3Cache
+
+# Stages of an exam generation job, in order
+STAGES = ('extract', 'generate', 'upload', 'notify')
+
+
+class HelperJobs:
+    """
+    This class tracks exam generation jobs: a status item per job in DynamoDB, readable by
+    the frontend, and the output of each stage checkpointed in S3 under jobs/<job_id>/, so
+    that a retried job resumes after its last completed stage.
+    """
+
+    def __init__(self, table_name, prefix='jobs', ttl_days=7):
+        """
+        Initializes the HelperJobs.
+
+        :param table_name: Name of the DynamoDB jobs table; None to keep checkpoints without status items.
+        :param prefix: Key prefix of the checkpoints in the bucket of the uploaded files.
+        :param ttl_days: Number of days the status items are kept.
+        """
+        self.table = boto3.resource('dynamodb').Table(table_name) if table_name else None
+        self.prefix = prefix
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+
+    @staticmethod
+    def make_job_id(bucket_name, file_key, etag, params, upload=None):
+        """
+        Builds the id of a job, stable across retries of the same upload.
+
+        :param bucket_name: Name of the S3 bucket.
+        :param file_key: Key of the uploaded PDF.
+        :param etag: ETag of the uploaded PDF, so that a new version of the file starts a new job.
+        :param params: Generation parameters (e.g. question counts).
+        :param upload: Version id of the PDF or sequencer of its S3 event, so that uploading the same
+            file again starts a new job (and a new sample of the question pool) instead of resolving
+            to the job that already succeeded.
+        :return: Hex job id.
+        """
+        source = f"{bucket_name}/{file_key}@{etag}:{sorted(params.items())}"
+        if upload:
+            source += f"#{upload}"
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()[:32]
+
+    def checkpoints(self, bucket_name, job_id):
+        """
+        Returns the checkpoint store of a job.
+
+        :param bucket_name: Name of the S3 bucket.
+        :param job_id: Job id.
+        :return: S3Cache under jobs/<job_id>/.
+        """
+        return S3Cache(bucket_name, f"{self.prefix}/{job_id}")
+
+    def start(self, job_id, file_key):
+        """
+        Marks a job as running and counts the attempt.
+
+        :param job_id: Job id.
+        :param file_key: Key of the uploaded PDF, used by the frontend to find the job.
+        :return: Job item; its 'stages' map holds the stages completed by previous attempts.
+        """
+        if self.table is None:
+            return {'job_id': job_id, 'stages': {}}
+        now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        response = self.table.update_item(
+            Key={'job_id': job_id},
+            UpdateExpression='SET file_key = :file_key, job_status = :running, updated_at = :now, '
+                             'expires_at = :expires_at, created_at = if_not_exists(created_at, :now), '
+                             'stages = if_not_exists(stages, :empty) ADD attempts :one REMOVE job_error',
+            ExpressionAttributeValues={
+                ':file_key': file_key, ':running': 'running', ':now': now, ':empty': {}, ':one': 1,
+                ':expires_at': int(time.time()) + self.ttl_seconds,
+            },
+            ReturnValues='ALL_NEW',
+        )
+        item = response['Attributes']
+        completed = [stage for stage in STAGES if stage in item['stages']]
+        print(f"Job {job_id} attempt {item['attempts']}, completed stages: {completed}")
+        return item
+
+    def complete_stage(self, job_id, stage, **fields):
+        """
+        Records that a stage completed.
+
+        :param job_id: Job id.
+        :param stage: Stage name from STAGES.
+        :param fields: Extra attributes to store on the job (e.g. exam_key).
+        """
+        if self.table is None:
+            return
+        now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        names = {'#stage': stage}
+        values = {':now': now}
+        assignments = ['stages.#stage = :now', 'updated_at = :now']
+        for i, (name, value) in enumerate(fields.items()):
+            names[f'#f{i}'] = name
+            values[f':f{i}'] = value
+            assignments.append(f'#f{i} = :f{i}')
+        if stage == STAGES[-1]:
+            values[':succeeded'] = 'succeeded'
+            assignments.append('job_status = :succeeded')
+        self.table.update_item(
+            Key={'job_id': job_id},
+            UpdateExpression='SET ' + ', '.join(assignments),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+
+    def fail(self, job_id, stage, error):
+        """
+        Records that a stage failed; the job is resumed from that stage when retried.
+
+        :param job_id: Job id.
+        :param stage: Stage that failed.
+        :param error: Exception raised by the stage.
+        """
+        if self.table is None:
+            return
+        self.table.update_item(
+            Key={'job_id': job_id},
+            UpdateExpression='SET job_status = :failed, failed_stage = :stage, job_error = :error, updated_at = :now',
+            ExpressionAttributeValues={
+                ':failed': 'failed', ':stage': stage, ':error': repr(error)[:1000],
+                ':now': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            },
+        )
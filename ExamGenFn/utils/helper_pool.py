@@ -0,0 +1,120 @@
+import gzip
+import json
+import random
+
+from utils.helper_exam import is_true_false
+
+
+class HelperPool:
+    """
+    This class keeps a pool of generated questions per source document, tagged with the
+    part of the book (topic) they come from, so that new exams on an already processed
+    document are assembled by sampling the pool instead of calling the model.
+    """
+
+    def __init__(self, store, n_topics=8):
+        """
+        Initializes the HelperPool.
+
+        :param store: Cache with get(key) and put(key, value) methods holding the pools.
+        :param n_topics: Number of consecutive parts of the book used as topics.
+        """
+        self.store = store
+        self.n_topics = n_topics
+
+    @staticmethod
+    def _key(source_hash, n_mcq_options):
+        # MCQs of a pool all have the same number of options
+        return f"{source_hash}-{n_mcq_options}.json.gz"
+
+    def load(self, source_hash, n_mcq_options):
+        """
+        Loads the pool of a source document.
+
+        :param source_hash: Content hash of the source document.
+        :param n_mcq_options: Number of options per multiple-choice question.
+        :return: List of pooled question dictionaries with a 'topic' tag.
+        """
+        data = self.store.get(self._key(source_hash, n_mcq_options))
+        if data is None:
+            return []
+        return json.loads(gzip.decompress(data))['questions']
+
+    def add(self, source_hash, n_mcq_options, questions):
+        """
+        Adds questions to the pool of a source document, merged into the latest stored
+        version to keep the questions added meanwhile by concurrent jobs.
+
+        :param source_hash: Content hash of the source document.
+        :param n_mcq_options: Number of options per multiple-choice question.
+        :param questions: List of question dictionaries with a 'topic' tag.
+        :return: The whole pool.
+        """
+        pool = self.load(source_hash, n_mcq_options)
+        known = {question.get('question') for question in pool}
+        pool.extend(question for question in questions if question.get('question') not in known)
+        data = json.dumps({'version': 1, 'questions': pool}, separators=(',', ':'))
+        self.store.put(self._key(source_hash, n_mcq_options), gzip.compress(data.encode('utf-8')))
+        print(f"question pool of {source_hash} holds {len(pool)} questions")
+        return pool
+
+    @staticmethod
+    def count(questions):
+        """
+        Counts the questions of each type.
+
+        :param questions: List of question dictionaries.
+        :return: (number of MCQs, number of true/false questions).
+        """
+        n_tfq = sum(1 for question in questions if is_true_false(question))
+        return len(questions) - n_tfq, n_tfq
+
+    def tag_topics(self, questions, text):
+        """
+        Tags each question with the part of the book its best matching passage belongs to.
+
+        :param questions: List of question dictionaries, tagged in place.
+        :param text: Extracted book text.
+        """
+        # numpy is only imported when a pool is filled
+        from utils.helper_retrieval import PassageIndex
+        from utils.helper_text import split_text
+        passages = split_text(text, 600) or ['']
+        index = PassageIndex(passages)
+        for question in questions:
+            query = f"{question.get('question', '')} {question.get('correct_answer', '')}"
+            best, _ = index.query(query, top_k=1)[0]
+            question['topic'] = min(self.n_topics - 1, best * self.n_topics // len(passages))
+
+    def assemble(self, questions, n_mcq, n_tfq, seed):
+        """
+        Samples an exam from a pool, spreading the questions over as many topics as possible.
+
+        :param questions: Pooled question dictionaries with 'topic' tags.
+        :param n_mcq: Number of multiple-choice questions.
+        :param n_tfq: Number of true/false questions.
+        :param seed: Seed of the sampling, e.g. the job id.
+        :return: List of at most n_tfq true/false questions followed by at most n_mcq MCQs, without tags.
+        """
+        rng = random.Random(seed)
+
+        def sample(candidates, limit):
+            by_topic = {}
+            for question in candidates:
+                by_topic.setdefault(question.get('topic', 0), []).append(question)
+            queues = list(by_topic.values())
+            for queue in queues:
+                rng.shuffle(queue)
+            rng.shuffle(queues)
+            picked = []
+            depth = 0
+            while len(picked) < limit and any(depth < len(queue) for queue in queues):
+                for queue in queues:
+                    if depth < len(queue) and len(picked) < limit:
+                        picked.append(queue[depth])
+                depth += 1
+            return picked
+
+        tfqs = sample([question for question in questions if is_true_false(question)], n_tfq)
+        mcqs = sample([question for question in questions if not is_true_false(question)], n_mcq)
+        return [{key: value for key, value in question.items() if key != 'topic'} for question in tfqs + mcqs]
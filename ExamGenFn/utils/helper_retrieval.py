@@ -0,0 +1,148 @@
+"""Lexical passage selection, so that prompts carry only as much of the book as the questions need"""
+# Python Built-Ins:
+import math
+import re
+from collections import Counter
+
+# External Dependencies:
+import numpy as np
+
+# Local Dependencies:
+from utils.helper_text import split_text
+
+WORD_PATTERN = re.compile(r"[a-z][a-z0-9\-]{2,}")
+STOP_WORDS = frozenset("""
+about above after again against all also and any are because been before being below between both but
+can could did does doing down during each few for from further had has have having her here hers herself
+him himself his how into its itself just more most not now off once only other our ours ourselves out over
+own same she should some such than that the their theirs them themselves then there these they this those
+through too under until very was were what when where which while who whom why will with would you your
+yours yourself yourselves may might must shall upon within without however therefore thus
+""".split())
+
+
+def tokenize(text):
+    """
+    Splits text into lower-cased content words.
+
+    :param text: Passage text.
+    :return: List of words, stop words and words shorter than 3 letters removed.
+    """
+    return [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+
+
+class PassageIndex:
+    """
+    In-memory BM25 index of the passages of a book, stored as a dense NumPy matrix of
+    L2-normalized BM25 term weights (one row per passage).
+    """
+
+    def __init__(self, passages, max_features=4096, k1=1.5, b=0.75):
+        """
+        Builds the index.
+
+        :param passages: List of passage strings, in book order.
+        :param max_features: Vocabulary size limit; the terms found in most passages are kept.
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 passage length normalization.
+        """
+        self.passages = passages
+        tokenized = [Counter(tokenize(passage)) for passage in passages]
+        document_frequency = Counter()
+        for counts in tokenized:
+            document_frequency.update(counts.keys())
+        n_passages = len(passages)
+        # Terms present in almost every passage carry no topic information
+        candidates = [(df, term) for term, df in document_frequency.items() if n_passages < 4 or df <= 0.5 * n_passages]
+        vocabulary = [term for _, term in sorted(candidates, key=lambda x: (-x[0], x[1]))[:max_features]]
+        self.vocabulary = {term: i for i, term in enumerate(vocabulary)}
+
+        tf = np.zeros((n_passages, len(vocabulary)), dtype=np.float32)
+        for row, counts in enumerate(tokenized):
+            columns = [self.vocabulary[term] for term in counts if term in self.vocabulary]
+            tf[row, columns] = [counts[term] for term in counts if term in self.vocabulary]
+        lengths = np.array([sum(counts.values()) for counts in tokenized], dtype=np.float32)
+        average_length = max(float(lengths.mean()) if n_passages else 0.0, 1.0)
+        df = np.array([document_frequency[term] for term in vocabulary], dtype=np.float32)
+        idf = np.log((n_passages - df + 0.5) / (df + 0.5) + 1.0)
+        norm = k1 * (1 - b + b * lengths / average_length)
+        weights = tf * (k1 + 1) / (tf + norm[:, None]) * idf[None, :]
+        row_norms = np.linalg.norm(weights, axis=1, keepdims=True)
+        self.vectors = weights / np.maximum(row_norms, 1e-9)
+        self.lengths = lengths
+
+    def query(self, text, top_k=5):
+        """
+        Ranks the passages by BM25 similarity to a query.
+
+        :param text: Query text.
+        :param top_k: Number of passages to return.
+        :return: List of (passage index, score), best first.
+        """
+        counts = Counter(term for term in tokenize(text) if term in self.vocabulary)
+        query = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for term, count in counts.items():
+            query[self.vocabulary[term]] = count
+        scores = self.vectors @ query
+        best = np.argsort(-scores)[:top_k]
+        return [(int(i), float(scores[i])) for i in best]
+
+    def centrality(self):
+        """
+        Scores how representative each passage is of the whole book: its similarity to the
+        centroid of all passages, lowered for passages with little text (titles, captions).
+
+        :return: Array of scores, one per passage.
+        """
+        centroid = self.vectors.mean(axis=0)
+        centroid /= max(float(np.linalg.norm(centroid)), 1e-9)
+        scores = self.vectors @ centroid
+        density = np.minimum(1.0, self.lengths / max(float(np.median(self.lengths)), 1.0))
+        return scores * density
+
+    def select(self, n_picks, diversity=0.5):
+        """
+        Picks representative passages spread over the book and over its topics: the book is
+        cut into n_picks consecutive regions and each region contributes the passage that
+        best trades centrality against similarity to the passages already picked (MMR).
+
+        :param n_picks: Number of passages to pick.
+        :param diversity: Share of the centrality lost by a passage identical to one already picked.
+        :return: Sorted list of passage indices.
+        """
+        n_passages = len(self.passages)
+        if n_picks >= n_passages:
+            return list(range(n_passages))
+        relevance = self.centrality()
+        boundaries = np.linspace(0, n_passages, n_picks + 1).astype(int)
+        picked = []
+        redundancy = np.zeros(n_passages, dtype=np.float32)
+        # Regions are visited from the most to the least central so the best passages go first
+        regions = sorted(range(n_picks), key=lambda r: -float(relevance[boundaries[r]:boundaries[r + 1]].max()))
+        for region in regions:
+            start, end = boundaries[region], boundaries[region + 1]
+            scores = relevance[start:end] * (1 - diversity * redundancy[start:end])
+            best = start + int(np.argmax(scores))
+            picked.append(best)
+            redundancy = np.maximum(redundancy, self.vectors @ self.vectors[best])
+        return sorted(picked)
+
+
+def select_passages(text, n_questions, passage_tokens=600, passages_per_question=1.5):
+    """
+    Reduces a book to the passages needed for a number of questions.
+
+    :param text: Extracted book text.
+    :param n_questions: Number of questions to be generated.
+    :param passage_tokens: Token budget of a passage.
+    :param passages_per_question: Passages sent per requested question.
+    :return: Selected passages in book order, separated by form feeds.
+    """
+    passages = split_text(text, passage_tokens)
+    n_picks = max(1, math.ceil(n_questions * passages_per_question))
+    if n_picks >= len(passages):
+        return text
+    index = PassageIndex(passages)
+    picked = index.select(n_picks)
+    print(f"selected {len(picked)} of {len(passages)} passages for {n_questions} questions")
+    return "\f".join(passages[i] for i in picked)
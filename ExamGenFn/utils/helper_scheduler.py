@@ -0,0 +1,247 @@
+"""Client-side admission control for model calls: rate budgets, adaptive concurrency and deadlines"""
+# Python Built-Ins:
+import heapq
+import itertools
+import random
+import threading
+import time
+
+# External Dependencies:
+from botocore.exceptions import ClientError
+
+# Error codes Bedrock returns when the account is over its quota or the model is overloaded
+# (error events of response streams use lower camel case)
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+                          'ModelNotReadyException', 'throttlingException', 'serviceUnavailableException')
+
+
+class BedrockCapacityError(Exception):
+    """
+    Raised when a call cannot complete before its deadline because of rate limits or
+    throttling. The work done so far is kept (e.g. in the response cache), so the request
+    can be resumed by retrying it later.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.resumable = True
+
+
+def is_throttling_error(error):
+    """
+    Tells whether an exception raised by the Bedrock client is a throttling error.
+
+    :param error: Exception raised by a client call.
+    :return: True when the call should be retried later with less concurrency.
+    """
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+class TokenBucket:
+    """
+    Budget of units (requests or tokens) refilled continuously at `per_window` units per window.
+    """
+
+    def __init__(self, per_window, window_seconds=60):
+        """
+        Initializes the TokenBucket, full.
+
+        :param per_window: Units allowed per window (e.g. tokens per minute).
+        :param window_seconds: Length of the window in seconds.
+        """
+        self.capacity = float(per_window)
+        self.rate = self.capacity / window_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """
+        Returns how long to wait before `amount` units are available.
+
+        :param amount: Units needed; capped to the bucket capacity.
+        :param now: Current time.monotonic() value.
+        :return: Seconds to wait, 0 when the units are available now.
+        """
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        """
+        Takes units from the bucket; the level may go negative for oversized amounts.
+
+        :param amount: Units to take.
+        """
+        self.level -= amount
+
+    def give_back(self, amount):
+        """
+        Returns units reserved in excess (e.g. output tokens that were not generated).
+
+        :param amount: Units to return.
+        """
+        self.level = min(self.capacity, self.level + amount)
+
+
+class BedrockScheduler:
+    """
+    Admission control for the model calls of one container. A call is started when it fits
+    in the requests-per-minute and tokens-per-minute budgets and in the concurrency limit;
+    waiting calls are started earliest deadline first. The concurrency limit grows by one
+    per round of successful calls and is halved on throttling (AIMD).
+    """
+
+    def __init__(self, tokens_per_minute=None, requests_per_minute=None, max_concurrency=8,
+                 min_concurrency=1, window_seconds=60, max_attempts=6, base_backoff=1.0):
+        """
+        Initializes the BedrockScheduler.
+
+        :param tokens_per_minute: Token budget of this container, None for no budget.
+        :param requests_per_minute: Request budget of this container, None for no budget.
+        :param max_concurrency: Upper bound of the adaptive concurrency limit (and its initial value).
+        :param min_concurrency: Lower bound of the adaptive concurrency limit.
+        :param window_seconds: Length of the budget window; 60 except in offline load tests.
+        :param max_attempts: Attempts per call before giving up on throttling.
+        :param base_backoff: First backoff delay in seconds after a throttling error.
+        """
+        self.tokens = TokenBucket(tokens_per_minute, window_seconds) if tokens_per_minute else None
+        self.requests = TokenBucket(requests_per_minute, window_seconds) if requests_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.active = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.counters = {'calls': 0, 'throttled': 0, 'rejected': 0, 'wait_seconds': 0.0}
+
+    def _wait_time(self, tokens, now):
+        """
+        Returns how long the budgets delay a call of `tokens` tokens; call with the lock held.
+        """
+        wait = 0.0
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        return wait
+
+    def acquire(self, tokens, deadline=None):
+        """
+        Blocks until a call may start, then reserves its budget and a concurrency slot.
+
+        :param tokens: Estimated tokens of the call (prompt plus expected completion).
+        :param deadline: Optional epoch time by which the call must have completed.
+        :raise BedrockCapacityError: When the call cannot start before its deadline.
+        """
+        entry = (deadline or float('inf'), next(self.sequence))
+        started = time.monotonic()
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(tokens, now)
+                    if self.waiting[0] == entry and self.active < int(self.limit) and wait == 0:
+                        break
+                    if deadline is not None and time.time() + wait >= deadline:
+                        # Waiting for the budget would burn the rest of the invocation for nothing
+                        self.counters['rejected'] += 1
+                        raise BedrockCapacityError(
+                            f"no Bedrock capacity before the deadline (budget wait {wait:.1f}s, "
+                            f"{self.active} active, limit {int(self.limit)})", retry_after=wait)
+                    timeout = wait if wait > 0 else None
+                    if deadline is not None:
+                        timeout = min(timeout or float('inf'), max(0.0, deadline - time.time()))
+                    self.condition.wait(timeout)
+            finally:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+            if self.tokens:
+                self.tokens.take(tokens)
+            if self.requests:
+                self.requests.take(1)
+            self.active += 1
+            self.counters['calls'] += 1
+            self.counters['wait_seconds'] += time.monotonic() - started
+
+    def release(self, throttled=False, unused_tokens=0):
+        """
+        Frees the concurrency slot of a call and adapts the concurrency limit.
+
+        :param throttled: True when the call failed with a throttling error.
+        :param unused_tokens: Reserved tokens the call did not use, returned to the budget.
+        """
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.counters['throttled'] += 1
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+                # Throttled calls still count against the quota on the service side
+                if self.tokens:
+                    self.tokens.level = min(self.tokens.level, 0.0)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / max(1.0, self.limit))
+                if self.tokens and unused_tokens > 0:
+                    self.tokens.give_back(unused_tokens)
+            self.condition.notify_all()
+
+    def start(self, fn, tokens, deadline=None):
+        """
+        Starts a model call under the scheduler, retrying throttled attempts with jittered
+        exponential backoff while the deadline allows. The concurrency slot stays taken until
+        release() is called, e.g. once a response stream has been read.
+
+        :param fn: Function without arguments making the call.
+        :param tokens: Estimated tokens of the call (prompt plus expected completion).
+        :param deadline: Optional epoch time by which the call must have completed.
+        :return: The result of fn.
+        :raise BedrockCapacityError: When throttling persists or the deadline is reached.
+        """
+        for attempt in range(self.max_attempts):
+            self.acquire(tokens, deadline)
+            try:
+                return fn()
+            except Exception as e:
+                self.release(throttled=is_throttling_error(e))
+                if not is_throttling_error(e):
+                    raise
+                backoff = random.uniform(0, self.base_backoff * 2 ** attempt)
+                if deadline is not None and time.time() + backoff >= deadline:
+                    raise BedrockCapacityError(f"throttled by Bedrock until the deadline: {e}",
+                                               retry_after=backoff) from e
+                print(f"Bedrock throttled (attempt {attempt + 1}), concurrency limit now {int(self.limit)}")
+                time.sleep(backoff)
+        raise BedrockCapacityError(f"still throttled by Bedrock after {self.max_attempts} attempts")
+
+    def call(self, fn, tokens, deadline=None, count_tokens=None):
+        """
+        Runs a model call under the scheduler, see start().
+
+        :param fn: Function without arguments making the call.
+        :param tokens: Estimated tokens of the call (prompt plus expected completion).
+        :param deadline: Optional epoch time by which the call must have completed.
+        :param count_tokens: Optional function giving the tokens actually used from the result.
+        :return: The result of fn.
+        :raise BedrockCapacityError: When throttling persists or the deadline is reached.
+        """
+        result = self.start(fn, tokens, deadline)
+        used = count_tokens(result) if count_tokens else tokens
+        self.release(unused_tokens=tokens - used)
+        return result
+
+    def stats(self):
+        """
+        Returns the call, throttling and rejection counters and the current concurrency limit.
+        """
+        with self.condition:
+            return {**self.counters, 'wait_seconds': round(self.counters['wait_seconds'], 3),
+                    'concurrency_limit': int(self.limit)}
@@ -0,0 +1,94 @@
+"""Helper utilities for sizing and splitting extracted book text before prompting"""
+# Python Built-Ins:
+import math
+import re
+
+# Rough characters-per-token ratio for Claude models on English prose
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of model tokens in a text without calling a tokenizer.
+
+    :param text: Text to be measured.
+    :return: Approximate token count.
+    """
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def _split_units(text):
+    """
+    Splits text into natural units (pages, then paragraphs) to pack into sections.
+
+    :param text: Extracted book text; pdfminer separates pages with form feeds.
+    :return: List of non-empty text units.
+    """
+    units = []
+    for page in text.split("\f"):
+        for paragraph in re.split(r"\n\s*\n", page):
+            paragraph = paragraph.strip()
+            if paragraph:
+                units.append(paragraph)
+    return units
+
+
+def split_text(text, max_tokens):
+    """
+    Splits text into sections of at most `max_tokens` estimated tokens each,
+    keeping page and paragraph boundaries whenever possible.
+
+    :param text: Text to be split.
+    :param max_tokens: Token budget of a single section.
+    :return: List of section strings, in document order.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    sections = []
+    current = []
+    current_len = 0
+    for unit in _split_units(text):
+        # Paragraphs larger than a whole section are hard-split on whitespace
+        while len(unit) > max_chars:
+            cut = unit.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            pieces = [unit[:cut], unit[cut:].strip()]
+            if current:
+                sections.append("\n\n".join(current))
+                current, current_len = [], 0
+            sections.append(pieces[0])
+            unit = pieces[1]
+        if current and current_len + len(unit) + 2 > max_chars:
+            sections.append("\n\n".join(current))
+            current, current_len = [], 0
+        if unit:
+            current.append(unit)
+            current_len += len(unit) + 2
+    if current:
+        sections.append("\n\n".join(current))
+    return sections
+
+
+def spread_indices(n_items, n_picks):
+    """
+    Picks `n_picks` indices evenly spread over `n_items` positions.
+
+    :param n_items: Number of available positions.
+    :param n_picks: Number of positions to pick.
+    :return: Sorted list of distinct indices.
+    """
+    if n_picks >= n_items:
+        return list(range(n_items))
+    step = n_items / n_picks
+    return sorted({int(step * i + step / 2) for i in range(n_picks)})
+
+
+def normalize_text(text):
+    """
+    Normalizes text so that trivially different wordings compare equal.
+
+    :param text: Text to be normalized.
+    :return: Lower-cased text without punctuation and extra spaces.
+    """
+    text = re.sub(r"[^\w\s]", " ", str(text).lower())
+    return " ".join(text.split())
@@ -1,26 +1,97 @@
+import base64
+import gzip
+import hashlib
 import json
 import boto3
 import os
+import random
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+import exam_format
+from instrumentation import span, timed
+from stats_keys import HISTOGRAM_PREFIX, question_key
 # Initialize S3 client outside of handler
 s3_client = boto3.client('s3')
+# Question bank index maintained by ExamGenFn, if deployed
+index_table = boto3.resource('dynamodb').Table(os.environ['INDEX_TABLE_NAME']) if os.environ.get('INDEX_TABLE_NAME') else None
+index_bank = 'questions_bank'
+# Quiz results written by the grading endpoint
+results_table = boto3.resource('dynamodb').Table(os.environ['RESULTS_TABLE_NAME']) if os.environ.get('RESULTS_TABLE_NAME') else None
+pass_percentage = int(os.environ.get('PASS_PERCENTAGE', 50))
+# Per-exam statistics maintained by DynamoDBTriggerFn
+stats_table = boto3.resource('dynamodb').Table(os.environ['STATS_TABLE_NAME']) if os.environ.get('STATS_TABLE_NAME') else None
+# Exams kept in memory by a warm container, least recently used first
+exam_cache = OrderedDict()
+exam_cache_max_bytes = int(os.environ.get('EXAM_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+exam_cache_revalidate_seconds = int(os.environ.get('EXAM_CACHE_REVALIDATE_SECONDS', 30))
+exam_max_age_seconds = int(os.environ.get('EXAM_MAX_AGE_SECONDS', 60))
+gzip_min_bytes = int(os.environ.get('GZIP_MIN_BYTES', 1024))
+# DynamoDB TransactWriteItems limit
+TRANSACT_MAX_ITEMS = 100
+# User pools of the API's Cognito authorizer: educators generate the exams, students take them
+educator_pool_id = os.environ.get('EDUCATOR_USER_POOL_ID')
+student_pool_id = os.environ.get('STUDENT_USER_POOL_ID')
+cognito_client = boto3.client('cognito-idp')
+# Emails of the users already looked up by a warm container, by (user pool, username)
+user_emails = {}
 
-def get_object(bucket_name, object_key):
+class ExamVersionConflict(Exception):
     """
-    Retrieve an object from S3.
+    A submission answers another version of the exam than the current one.
+    """
+
+def get_exam(bucket_name, object_key, revalidate=False):
+    """
+    Retrieve an exam through the warm-container cache.
+
+    Cached exams are served from memory for EXAM_CACHE_REVALIDATE_SECONDS, then revalidated
+    with a conditional GET so that an overwritten exam is picked up without re-downloading
+    unchanged ones.
 
     :param bucket_name: Name of the S3 bucket.
     :param object_key: Key of the object to retrieve.
-    :return: The object's content if the object is found. Otherwise, an error message.
+    :param revalidate: Revalidate a cached exam however recently it was checked.
+    :return: Cache entry with the 'body' JSON string and the S3 'etag'.
     """
+    entry = exam_cache.get(object_key)
+    now = time.time()
+    if entry and not revalidate and now - entry['checked_at'] < exam_cache_revalidate_seconds:
+        exam_cache.move_to_end(object_key)
+        return entry
+
+    kwargs = {'IfNoneMatch': entry['etag']} if entry else {}
     try:
-        response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-        content = response['Body'].read().decode('utf-8')  # Decoding from bytes to string
-        return content  # Return the raw string content
-    except Exception as e:
-        return {
-                    'statusCode': 500,
-                    'body': json.dumps({'error': str(e)})
-                }
+        response = s3_client.get_object(Bucket=bucket_name, Key=object_key, **kwargs)
+    except ClientError as e:
+        if entry and e.response['Error']['Code'] in ('304', 'NotModified'):
+            entry['checked_at'] = now
+            exam_cache.move_to_end(object_key)
+            return entry
+        raise
+    data = response['Body'].read()
+    if exam_format.is_exam(data):
+        # The blocks of compressed exams are separate gzip members, which HTTP clients may not read
+        # past the first of: gzip responses compress the body again, as a single member
+        body = gzip.decompress(exam_format.gzip_stream(data)).decode('utf-8')
+    else:
+        body = data.decode('utf-8')  # Decoding from bytes to string
+    entry = {
+        'body': body,
+        'etag': response['ETag'],
+        'checked_at': now,
+        'gzip': None,  # compressed body, filled on the first gzip response
+        'questions': None,  # parsed body, filled on first use
+    }
+    exam_cache.pop(object_key, None)
+    exam_cache[object_key] = entry
+    # Evict the least recently used exams beyond the memory budget
+    while len(exam_cache) > 1 and sum(len(e['body']) for e in exam_cache.values()) > exam_cache_max_bytes:
+        exam_cache.popitem(last=False)
+    return entry
 
 def list_bucket_objects(bucket_name, prefix):
     """
@@ -31,10 +102,10 @@ def list_bucket_objects(bucket_name, prefix):
     :return: List of object keys, excluding the prefix itself.
     """
     try:
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
         objects = []
-        if 'Contents' in response:
-            for obj in response['Contents']:
+        # Follow continuation tokens, a single call stops at 1000 keys
+        for response in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in response.get('Contents', []):
                 if obj['Key'] != prefix:  # Exclude the directory name itself
                     objects.append(obj['Key'].replace(prefix, ''))  # Remove the prefix
         return objects
@@ -44,6 +115,468 @@ def list_bucket_objects(bucket_name, prefix):
                     'body': json.dumps({'error': str(e)})
                 }
 
+def encode_token(key):
+    """
+    Encode a pagination key as an opaque URL-safe token.
+    """
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_token(token):
+    """
+    Decode a pagination token produced by encode_token.
+    """
+    return json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+
+def query_index(name_prefix, limit, next_token=None):
+    """
+    Read one page of the question bank index.
+
+    :param name_prefix: Only list exams whose name starts with this prefix.
+    :param limit: Maximum number of exams in the page.
+    :param next_token: Token returned with the previous page, if any.
+    :return: Tuple (list of exam entries, token of the next page or None).
+    """
+    condition = Key('bank').eq(index_bank)
+    if name_prefix:
+        condition = condition & Key('name').begins_with(name_prefix)
+    kwargs = {'KeyConditionExpression': condition, 'Limit': limit}
+    if next_token:
+        kwargs['ExclusiveStartKey'] = decode_token(next_token)
+    response = index_table.query(**kwargs)
+    items = []
+    for item in response.get('Items', []):
+        entry = {'name': item['name'], 'size': int(item['size']),
+                 'question_count': int(item['question_count']), 'created': item['created']}
+        if 'source_hash' in item:
+            entry['source_hash'] = item['source_hash']
+        items.append(entry)
+    last_key = response.get('LastEvaluatedKey')
+    return items, encode_token(last_key) if last_key else None
+
+def list_bucket_page(bucket_name, prefix, name_prefix, limit, next_token=None):
+    """
+    Read one page of the question bank straight from S3, for deployments without an index.
+
+    :param bucket_name: Name of the S3 bucket.
+    :param prefix: Prefix of the question bank.
+    :param name_prefix: Only list exams whose name starts with this prefix.
+    :param limit: Maximum number of exams in the page.
+    :param next_token: Token returned with the previous page, if any.
+    :return: Tuple (list of exam entries, token of the next page or None).
+    """
+    kwargs = {'Bucket': bucket_name, 'Prefix': prefix + (name_prefix or ''), 'MaxKeys': limit}
+    if next_token:
+        kwargs['ContinuationToken'] = next_token
+    response = s3_client.list_objects_v2(**kwargs)
+    items = [{'name': obj['Key'][len(prefix):], 'size': obj['Size'],
+              'created': obj['LastModified'].isoformat()}
+             for obj in response.get('Contents', []) if obj['Key'] != prefix]
+    return items, response.get('NextContinuationToken')
+
+def list_exam_names():
+    """
+    List the names of every exam in the question bank from the index.
+
+    :return: List of exam file names.
+    """
+    names = []
+    next_token = None
+    while True:
+        items, next_token = query_index(None, 1000, next_token)
+        names.extend(item['name'] for item in items)
+        if not next_token:
+            return names
+
+def get_header(event, name):
+    """
+    Read a request header case-insensitively.
+    """
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+def conditional_response(event, body, headers, etag=None):
+    """
+    Build a 200 response carrying an ETag, or a bodyless 304 when the client already has this body.
+
+    :param event: API Gateway proxy event.
+    :param body: Response body string.
+    :param headers: Headers common to both responses.
+    :param etag: ETag of the body; derived from its hash when not given.
+    :return: API Gateway proxy response.
+    """
+    if etag is None:
+        etag = '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+    headers = {**headers, 'ETag': etag}
+    if_none_match = get_header(event, 'If-None-Match')
+    if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
+    return {'statusCode': 200, 'headers': headers, 'body': body}
+
+def gzip_response(event, response, entry=None):
+    """
+    Compress a response body when the client accepts gzip and the body is large enough.
+
+    :param event: API Gateway proxy event.
+    :param response: API Gateway proxy response from conditional_response.
+    :param entry: Optional exam cache entry used to keep the compressed body across requests.
+    :return: The response, gzip-compressed and base64-encoded for API Gateway when applicable.
+    """
+    accept_encoding = get_header(event, 'Accept-Encoding') or ''
+    body = response['body']
+    headers = {**response['headers'], 'Vary': 'Accept-Encoding'}
+    if response['statusCode'] != 200 or 'gzip' not in accept_encoding.lower() or len(body) < gzip_min_bytes:
+        return {**response, 'headers': headers}
+    if entry is not None and entry['gzip'] is not None:
+        compressed = entry['gzip']
+    else:
+        compressed = gzip.compress(body.encode('utf-8'))
+        if entry is not None:
+            entry['gzip'] = compressed
+    return {
+        'statusCode': 200,
+        'headers': {**headers, 'Content-Encoding': 'gzip'},
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def student_seed(student, object_name):
+    """
+    Seed of the question and option order of a student's exam.
+    """
+    return hashlib.sha256(f"{student}:{object_name}".encode('utf-8')).hexdigest()[:16]
+
+def shuffle_questions(questions, seed):
+    """
+    Shuffle the order of the questions of an exam and of the options of each question, in place.
+    Answers are stored as option text, so the shuffled exam is graded like the original.
+
+    :param questions: List of question dictionaries, freshly parsed.
+    :param seed: String seeding the shuffle; the same seed always gives the same order.
+    :return: The shuffled list.
+    """
+    rng = random.Random(seed)
+    rng.shuffle(questions)
+    for question in questions:
+        options = question.get('options')
+        # True/false options keep their usual order
+        if isinstance(options, list) and sorted(str(option).lower() for option in options) != ['false', 'true']:
+            rng.shuffle(options)
+    return questions
+
+def student_exam(entry, object_name, student):
+    """
+    The exam in the order shown to a student.
+
+    :param entry: Exam cache entry.
+    :param object_name: File name of the exam.
+    :param student: Student email.
+    :return: List of question dictionaries, answers included.
+    """
+    return shuffle_questions(exam_questions(entry), student_seed(student, object_name))
+
+def exam_questions(entry):
+    """
+    The questions of a cached exam, parsed once per cache entry.
+
+    :param entry: Exam cache entry.
+    :return: List of question dictionaries, a copy the caller may modify.
+    """
+    if entry['questions'] is None:
+        entry['questions'] = json.loads(entry['body'])
+    return [{**question, 'options': list(question['options'])} for question in entry['questions']]
+
+def grade(questions, answers):
+    """
+    Grade the answers of a student.
+
+    :param questions: Questions in the order shown to the student.
+    :param answers: Index of the chosen option of each question.
+    :return: (score, details), details listing each question with the given and correct answers.
+    :raise ValueError: When the answers do not match the questions.
+    """
+    if len(answers) != len(questions):
+        raise ValueError(f"expected {len(questions)} answers, got {len(answers)}")
+    score = 0
+    details = []
+    for question, answer in zip(questions, answers):
+        options = question['options']
+        if not isinstance(answer, int) or isinstance(answer, bool) or not 0 <= answer < len(options):
+            raise ValueError(f"invalid answer index {answer!r}")
+        is_correct = options[answer] == question['correct_answer']
+        score += int(is_correct)
+        details.append({
+            'question': question['question'],
+            'user_answer': options[answer],
+            'correct_answer': question['correct_answer'],
+            'is_correct': is_correct
+        })
+    return score, details
+
+def json_default(value):
+    """
+    JSON encoding of the Decimal numbers returned by DynamoDB.
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def exam_version(entry):
+    """
+    Version of a cached exam (its S3 ETag), sent with the exam and required with its submissions.
+    """
+    return entry['etag'].strip('"')
+
+def attempt_key(object_name, submission_id):
+    """
+    Sort key of an attempt: the attempts of a student sort by exam, then by submission id (which starts with its time).
+    """
+    return f"{object_name}#{submission_id}"
+
+def grade_submission(bucket, prefix, request, student):
+    """
+    Grade a submission against the version of the exam the student answered.
+
+    :param bucket: Name of the S3 bucket.
+    :param prefix: Prefix of the question bank.
+    :param request: Submission with 'object_name', 'exam_version', 'answers' and 'idempotency_key'; the
+                    version is the one returned with the exam, the key is the submission id chosen by the
+                    frontend when the quiz was loaded.
+    :param student: Email of the authenticated student.
+    :return: Attempt item.
+    :raise ExamVersionConflict: When the exam was overwritten since the student loaded it.
+    """
+    object_name = request['object_name']
+    submission_id = str(request['idempotency_key'])
+    version = str(request['exam_version'])
+    with span('grade', object_name=object_name):
+        entry = get_exam(bucket, prefix + object_name)
+        if version != exam_version(entry):
+            # The cached exam may be older than the one the student loaded
+            entry = get_exam(bucket, prefix + object_name, revalidate=True)
+            if version != exam_version(entry):
+                raise ExamVersionConflict(f"{object_name} changed since it was loaded")
+        score, details = grade(student_exam(entry, object_name, student), request['answers'])
+    percentage = int(score / len(details) * 100) if details else 0
+    return {
+        'email': student,
+        'attempt': attempt_key(object_name, submission_id),
+        'exam': object_name,
+        'submission_id': submission_id,
+        'submitted_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'score': score,
+        'total': len(details),
+        'percentage': percentage,
+        'result': 'passed' if percentage >= pass_percentage else 'failed',
+        'details': details
+    }
+
+def submit_answers(bucket, prefix, request, student):
+    """
+    Grade a submission and record it as a new attempt with a single conditional write.
+    A retried submission (same idempotency key) is not written again: the recorded result
+    is returned instead.
+
+    :param bucket: Name of the S3 bucket.
+    :param prefix: Prefix of the question bank.
+    :param request: Submission, see grade_submission.
+    :param student: Email of the authenticated student.
+    :return: Attempt item.
+    :raise ExamVersionConflict: When the exam changed and the attempt was not recorded before.
+    """
+    try:
+        item = grade_submission(bucket, prefix, request, student)
+    except ExamVersionConflict:
+        # A retried submission is answered from its record, even if the exam changed since
+        recorded = recorded_attempt(request, student)
+        if recorded is None:
+            raise
+        return recorded
+    if results_table is None:
+        return item
+    try:
+        results_table.put_item(Item=item, ConditionExpression='attribute_not_exists(attempt)')
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        print(f"submission {item['submission_id']} of {item['email']} already recorded")
+        item = results_table.get_item(Key={'email': item['email'], 'attempt': item['attempt']},
+                                      ConsistentRead=True)['Item']
+    return item
+
+def recorded_attempt(request, student):
+    """
+    The recorded attempt of a submission, or None.
+    """
+    if results_table is None:
+        return None
+    key = {'email': student, 'attempt': attempt_key(request['object_name'], str(request['idempotency_key']))}
+    return results_table.get_item(Key=key, ConsistentRead=True).get('Item')
+
+def record_attempts(items):
+    """
+    Write new attempts in one transaction, each with the condition of a single submission.
+    Attempts recorded before are not written again; the others are written by a second transaction.
+
+    :param items: At most TRANSACT_MAX_ITEMS attempt items, of different attempts.
+    :return: Dictionary of (email, attempt) to the recorded item, for the attempts recorded before.
+    """
+    try:
+        results_table.meta.client.transact_write_items(TransactItems=[{'Put': {
+            'TableName': results_table.name,
+            'Item': item,
+            'ConditionExpression': 'attribute_not_exists(attempt)',
+        }} for item in items])
+        return {}
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise
+        reasons = e.response.get('CancellationReasons', [])
+        existing = [item for item, reason in zip(items, reasons) if reason.get('Code') == 'ConditionalCheckFailed']
+        if not existing:
+            raise
+    print(f"{len(existing)} submissions already recorded")
+    recorded = {}
+    for item in existing:
+        key = {'email': item['email'], 'attempt': item['attempt']}
+        recorded[(item['email'], item['attempt'])] = results_table.get_item(Key=key, ConsistentRead=True)['Item']
+    remaining = [item for item in items if (item['email'], item['attempt']) not in recorded]
+    if remaining:
+        recorded.update(record_attempts(remaining))
+    return recorded
+
+def submit_answers_batch(bucket, prefix, requests, student):
+    """
+    Grade several submissions (e.g. collected offline) and record them with transactional writes
+    of up to TRANSACT_MAX_ITEMS attempts. As with single submissions, a resubmitted attempt is
+    never overwritten: its recorded result is returned instead.
+
+    :param bucket: Name of the S3 bucket.
+    :param prefix: Prefix of the question bank.
+    :param requests: List of submissions, see grade_submission.
+    :param student: Email of the authenticated student.
+    :return: List of attempt items.
+    :raise ExamVersionConflict: When an exam changed and its attempt was not recorded before.
+    """
+    items = []
+    for request in requests:
+        try:
+            items.append(grade_submission(bucket, prefix, request, student))
+        except ExamVersionConflict:
+            recorded = recorded_attempt(request, student)
+            if recorded is None:
+                raise
+            items.append(recorded)  # not written again: the transaction returns the record
+    if results_table is None:
+        return items
+    # A transaction cannot write an item twice: a submission repeated in the batch is recorded once
+    unique = list({(item['email'], item['attempt']): item for item in reversed(items)}.values())[::-1]
+    recorded = {}
+    for first in range(0, len(unique), TRANSACT_MAX_ITEMS):
+        recorded.update(record_attempts(unique[first:first + TRANSACT_MAX_ITEMS]))
+    first_items = {(item['email'], item['attempt']): item for item in unique}
+    return [recorded.get(key, first_items[key]) for key in ((item['email'], item['attempt']) for item in items)]
+
+def query_attempts(student, exam, limit, next_token=None):
+    """
+    Read one page of attempts, newest first: the attempts of a student (optionally on one
+    exam) from the table, or all the attempts on an exam from its index.
+
+    :param student: Email of the student, or None to list the attempts on an exam.
+    :param exam: Exam file name.
+    :param limit: Maximum number of attempts in the page.
+    :param next_token: Token returned with the previous page, if any.
+    :return: Tuple (list of attempt items, token of the next page or None).
+    """
+    if student:
+        condition = Key('email').eq(student)
+        if exam:
+            condition = condition & Key('attempt').begins_with(exam + '#')
+        kwargs = {'KeyConditionExpression': condition}
+    elif exam:
+        kwargs = {'IndexName': 'exam-index', 'KeyConditionExpression': Key('exam').eq(exam)}
+    else:
+        raise ValueError("student or exam is required")
+    kwargs.update(Limit=limit, ScanIndexForward=False)
+    if next_token:
+        kwargs['ExclusiveStartKey'] = decode_token(next_token)
+    response = results_table.query(**kwargs)
+    last_key = response.get('LastEvaluatedKey')
+    return response.get('Items', []), encode_token(last_key) if last_key else None
+
+def exam_stats(bucket, prefix, object_name):
+    """
+    Read the statistics of an exam: one item, however many attempts were made.
+
+    :param bucket: Name of the S3 bucket.
+    :param prefix: Prefix of the question bank.
+    :param object_name: Exam file name.
+    :return: Dictionary with the counters, the mean score and percentage, the pass rate and the score
+             histogram, or None if nobody took the exam.
+    """
+    item = stats_table.get_item(Key={'exam': object_name}).get('Item')
+    if not item:
+        return None
+    attempts = int(item.get('attempts', 0))
+    stats = {
+        'exam': object_name,
+        'attempts': attempts,
+        'passed': int(item.get('passed', 0)),
+        'mean_score': float(item.get('score_sum', 0)) / attempts if attempts else None,
+        'mean_percentage': float(item.get('percentage_sum', 0)) / attempts if attempts else None,
+        'pass_rate': float(item.get('passed', 0)) / attempts if attempts else None,
+        # Attempts per score bucket, keyed by the lowest percentage of the bucket
+        'histogram': {str(int(name[len(HISTOGRAM_PREFIX):])): int(value) for name, value in sorted(item.items())
+                      if name.startswith(HISTOGRAM_PREFIX)},
+    }
+    # Correct answers per question, keyed by the question text
+    entry = get_exam(bucket, prefix + object_name)
+    stats['questions'] = [{
+        'question': question['question'],
+        'correct': int(item.get(question_key(question['question']), 0)),
+        'correct_rate': float(item.get(question_key(question['question']), 0)) / attempts if attempts else None,
+    } for question in exam_questions(entry)]
+    return stats
+
+def user_email(pool_id, username):
+    """
+    Email of a Cognito user: access tokens carry the username only.
+    """
+    if (pool_id, username) not in user_emails:
+        response = cognito_client.admin_get_user(UserPoolId=pool_id, Username=username)
+        attributes = {attribute['Name']: attribute['Value'] for attribute in response.get('UserAttributes', [])}
+        user_emails[(pool_id, username)] = attributes['email']
+    return user_emails[(pool_id, username)]
+
+def caller(event):
+    """
+    Identity of the caller, from the claims of the token verified by the API's Cognito authorizer.
+    Requests never name their own student: the student is always the authenticated user.
+
+    :param event: API Gateway proxy event.
+    :return: Tuple (email, 'educator' or 'student'), or None when the request carries no token of either user pool.
+    """
+    claims = ((event.get('requestContext') or {}).get('authorizer') or {}).get('claims') or {}
+    pool_id = claims.get('iss', '').rsplit('/', 1)[-1]
+    roles = {educator_pool_id: 'educator', student_pool_id: 'student'}
+    role = roles.get(pool_id) if pool_id else None
+    username = claims.get('username') or claims.get('cognito:username')
+    if role is None or not username:
+        return None
+    # ID tokens carry the email, access tokens (forwarded by the frontends' load balancers) do not
+    return claims.get('email') or user_email(pool_id, username), role
+
+def read_body(event):
+    """
+    Parse the JSON body of a request; API Gateway base64-encodes it since every media type is binary.
+    """
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    return json.loads(body)
+
+@timed('request')
 def lambda_handler(event, context):
     """
     Main Lambda function handler.
@@ -56,32 +589,153 @@ def lambda_handler(event, context):
     bucket = os.environ['BUCKET_NAME']
     prefix = 'questions_bank/'  # specify your folder if any
 
+    identity = caller(event)
+    if identity is None:
+        return {'statusCode': 401, 'headers': {'Content-Type': 'application/json', 'Cache-Control': 'no-store'},
+                'body': json.dumps({'error': 'authentication required'})}
+    email, role = identity
+
+    if event.get('httpMethod') == 'POST':
+        # Answers submitted by the quiz frontend
+        headers = {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',  # for CORS
+            'Cache-Control': 'no-store'
+        }
+        try:
+            request = read_body(event)
+            submissions = request['submissions'] if isinstance(request, dict) and 'submissions' in request else [request]
+            if any(submission.get('student', email) != email for submission in submissions):
+                return {'statusCode': 403, 'headers': headers,
+                        'body': json.dumps({'error': 'answers can only be submitted for the signed-in student'})}
+            if isinstance(request, dict) and 'submissions' in request:
+                result = submit_answers_batch(bucket, prefix, submissions, email)
+            else:
+                result = submit_answers(bucket, prefix, request, email)
+        except ExamVersionConflict as e:
+            # The student answered an exam that was regenerated since: their answers match other questions
+            return {'statusCode': 409, 'headers': headers,
+                    'body': json.dumps({'error': f"{e}, reload it and answer again"})}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+        except ClientError as e:
+            status_code = 404 if e.response['Error']['Code'] in ('NoSuchKey', '404') else 500
+            return {'statusCode': status_code, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(result, default=json_default)}
+
     params = event.get('queryStringParameters')
     if params:
         object_name = params.get('object_name')
 
         if object_name:
             full_object_key = prefix + object_name
-            get_response = get_object(bucket, full_object_key)
-            
-            # Return the raw string content, setting the appropriate content type
+            headers = {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',  # for CORS
+                'Cache-Control': f'private, max-age={exam_max_age_seconds}'
+            }
+            try:
+                with span('get_exam', object_name=object_name) as exam_span:
+                    cached = exam_cache.get(full_object_key)
+                    entry = get_exam(bucket, full_object_key)
+                    exam_span.metric('CacheHit', int(entry is cached))
+            except ClientError as e:
+                status_code = 404 if e.response['Error']['Code'] in ('NoSuchKey', '404') else 500
+                return {'statusCode': status_code, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+            # Submissions name the version they answer, so that they are not graded against a regenerated exam
+            headers = {**headers, 'X-Exam-Version': exam_version(entry)}
+
+            # Students only get their own exam; educators get any student's, or the exam with its answers
+            student = params.get('student') or (email if role == 'student' else None)
+            if role == 'student' and student != email:
+                return {'statusCode': 403, 'headers': headers,
+                        'body': json.dumps({'error': "another student's exam"})}
+            if student:
+                # Each student gets their own, stable, order of questions and options, without the
+                # answers: submissions are graded by the POST endpoint
+                questions = student_exam(entry, object_name, student)
+                for question in questions:
+                    question.pop('correct_answer', None)
+                etag = entry['etag'][:-1] + '-s' + student_seed(student, object_name) + '"'
+                if exam_format.CONTENT_TYPE in (get_header(event, 'Accept') or ''):
+                    # Compressed exam format, read question by question by the quiz frontend
+                    headers = {**headers, 'Content-Type': exam_format.CONTENT_TYPE, 'Vary': 'Accept'}
+                    response = conditional_response(event, '', headers, etag=etag[:-1] + '-x"')
+                    if response['statusCode'] == 200:
+                        response['body'] = base64.b64encode(exam_format.encode(questions)).decode('ascii')
+                        response['isBase64Encoded'] = True
+                    return response
+                response = conditional_response(event, json.dumps(questions), headers, etag=etag)
+                return gzip_response(event, response)
+
+            # Educators only: the raw string content, answers included
+            response = conditional_response(event, entry['body'], headers, etag=entry['etag'])
+            return gzip_response(event, response, entry)
+
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',  # for CORS
+        'Cache-Control': 'no-cache'  # clients revalidate listings with If-None-Match
+    }
+    params = params or {}
+    if params.get('stats') and stats_table is not None:
+        # Statistics of one exam, for a teacher dashboard
+        if role != 'educator':
+            return {'statusCode': 403, 'headers': headers,
+                    'body': json.dumps({'error': 'only educators can read the exam statistics'})}
+        try:
+            stats = exam_stats(bucket, prefix, params['stats'])
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                stats = None
+            else:
+                raise
+        if stats is None:
+            return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'no statistics for this exam'})}
+        return conditional_response(event, json.dumps(stats), headers)
+    if params.get('attempts') and results_table is not None:
+        # Attempt history: ?attempts=student[&exam=...] for the signed-in student (educators may name
+        # any &student=...), or ?attempts=exam&exam=... for educators
+        if params['attempts'] == 'student':
+            student = params.get('student') or email
+            if role != 'educator' and student != email:
+                return {'statusCode': 403, 'headers': headers,
+                        'body': json.dumps({'error': "another student's attempts"})}
+        elif role == 'educator':
+            student = None
+        else:
+            return {'statusCode': 403, 'headers': headers,
+                    'body': json.dumps({'error': 'only educators can list the attempts on an exam'})}
+        try:
+            limit = max(1, min(int(params.get('limit', 50)), 1000))
+            items, next_token = query_attempts(student, params.get('exam'), limit, params.get('next_token'))
+        except ValueError as e:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+        body = json.dumps({'items': items, 'next_token': next_token}, default=json_default)
+        return gzip_response(event, conditional_response(event, body, headers))
+    if any(name in params for name in ('limit', 'prefix', 'next_token')):
+        # Paginated listing: {"items": [...], "next_token": ...}
+        try:
+            limit = max(1, min(int(params.get('limit', 100)), 1000))
+            if index_table:
+                items, next_token = query_index(params.get('prefix'), limit, params.get('next_token'))
+            else:
+                items, next_token = list_bucket_page(bucket, prefix, params.get('prefix'), limit, params.get('next_token'))
+        except Exception as e:
             return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'  # for CORS
-                },
-                'body': get_response  # This is the raw string, not re-encoded as JSON
+                'statusCode': 500,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
             }
+        return gzip_response(event, conditional_response(event, json.dumps({'items': items, 'next_token': next_token}), headers))
 
     # If there's no object_name in the parameters, list the objects
-    list_response = list_bucket_objects(bucket, prefix)
+    if index_table:
+        try:
+            list_response = list_exam_names()
+        except Exception as e:
+            list_response = {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+    else:
+        list_response = list_bucket_objects(bucket, prefix)
 
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'  # for CORS
-        },
-        'body': json.dumps(list_response)  # List of files, excluding the prefix
-    }
\ No newline at end of file
+    return gzip_response(event, conditional_response(event, json.dumps(list_response), headers))  # List of files, excluding the prefix
\ No newline at end of file
@@ -0,0 +1,185 @@
+import base64
+import boto3
+import json
+import math
+import os
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from instrumentation import timed
+# Presigned URLs are signed with SigV4 for the bucket's region
+s3_client = boto3.client('s3', config=Config(signature_version='s3v4', s3={'addressing_style': 'virtual'}))
+upload_prefix = 'exams/'
+# Parts are at least this size; larger files get larger parts to stay within the S3 part limit
+part_size_min = int(os.environ.get('UPLOAD_PART_SIZE', 8 * 1024 * 1024))
+max_upload_bytes = int(os.environ.get('MAX_UPLOAD_BYTES', 1024 * 1024 * 1024))
+max_upload_files = int(os.environ.get('MAX_UPLOAD_FILES', 20))
+url_expires_seconds = int(os.environ.get('UPLOAD_URL_EXPIRES_SECONDS', 3600))
+# S3 multipart upload limit
+S3_MAX_PARTS = 10000
+# Limits of the question counts, as in the generate frontend
+MAX_QUESTIONS = 20
+MCQ_OPTIONS_RANGE = (2, 7)
+# Errors of the client (e.g. an expired upload or a missing part), not of this function
+CLIENT_ERROR_CODES = ('NoSuchUpload', 'InvalidPart', 'InvalidPartOrder', 'EntityTooSmall')
+
+def read_body(event):
+    """
+    Read the JSON body of a load balancer request.
+    """
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    return json.loads(body)
+
+def response(status_code, body):
+    """
+    Build a load balancer response with a JSON body.
+    """
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Cache-Control': 'no-store'},
+        'body': json.dumps(body),
+        'isBase64Encoded': False
+    }
+
+def upload_key(name):
+    """
+    Key of an uploaded PDF: the file name under the exams/ prefix, with the lower case '.pdf'
+    extension the upload notification filters on.
+
+    :raise ValueError: When the file is not a PDF.
+    """
+    name = name.replace('\\', '/').split('/')[-1]
+    if not name.lower().endswith('.pdf') or len(name) <= len('.pdf'):
+        raise ValueError(f"not a PDF file: {name!r}")
+    return upload_prefix + name[:-len('.pdf')] + '.pdf'
+
+def question_metadata(request):
+    """
+    Object metadata read by ExamGenFn: the number of questions to generate.
+
+    :raise ValueError: When a count is out of range.
+    """
+    n_mcq = int(request.get('n_mcq', 0))
+    n_tfq = int(request.get('n_tfq', 0))
+    n_mcq_options = int(request.get('n_mcq_options', 0))
+    if not 0 <= n_mcq <= MAX_QUESTIONS or not 0 <= n_tfq <= MAX_QUESTIONS:
+        raise ValueError(f"question counts must be between 0 and {MAX_QUESTIONS}")
+    if n_mcq and not MCQ_OPTIONS_RANGE[0] <= n_mcq_options <= MCQ_OPTIONS_RANGE[1]:
+        raise ValueError(f"multiple choice questions need {MCQ_OPTIONS_RANGE[0]} to {MCQ_OPTIONS_RANGE[1]} options")
+    return {'n_mcq': str(n_mcq), 'n_tfq': str(n_tfq), 'n_mcq_options': str(n_mcq_options if n_mcq else 0)}
+
+def part_size(size):
+    """
+    Size of the parts of an upload: at least UPLOAD_PART_SIZE, in whole MiB, and few enough parts for S3.
+    """
+    mib = 1024 * 1024
+    return max(part_size_min, math.ceil(size / S3_MAX_PARTS / mib) * mib)
+
+def create_uploads(request):
+    """
+    Start a multipart upload per file, the question counts attached as object metadata, and
+    presign the upload of each of its parts.
+
+    :param request: {'files': [{'name', 'size'}, ...], 'n_mcq', 'n_tfq', 'n_mcq_options'}
+    :return: {'uploads': [{'name', 'key', 'upload_id', 'part_size', 'urls'}, ...]}
+    :raise ValueError: When the request is invalid.
+    """
+    files = request['files']
+    if not files or len(files) > max_upload_files:
+        raise ValueError(f"upload between 1 and {max_upload_files} files")
+    metadata = question_metadata(request)
+    keys = [upload_key(file['name']) for file in files]
+    if len(set(keys)) != len(keys):
+        raise ValueError("files must have different names")
+    sizes = [int(file['size']) for file in files]
+    for file, size in zip(files, sizes):
+        if not 0 < size <= max_upload_bytes:
+            raise ValueError(f"{file['name']}: size must be between 1 and {max_upload_bytes} bytes")
+    uploads = []
+    for file, key, size in zip(files, keys, sizes):
+        upload_id = s3_client.create_multipart_upload(
+            Bucket=os.environ['BUCKET_NAME'],
+            Key=key,
+            ContentType='application/pdf',
+            Metadata=metadata
+        )['UploadId']
+        size_of_part = part_size(size)
+        urls = [s3_client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': os.environ['BUCKET_NAME'], 'Key': key, 'UploadId': upload_id, 'PartNumber': number},
+            ExpiresIn=url_expires_seconds
+        ) for number in range(1, math.ceil(size / size_of_part) + 1)]
+        uploads.append({'name': file['name'], 'key': key, 'upload_id': upload_id, 'part_size': size_of_part,
+                        'urls': urls})
+        print(f"Started upload of {key} ({size} bytes, {len(urls)} parts)")
+    return {'uploads': uploads}
+
+def check_upload(request):
+    """
+    Read the key and upload id of a request, which must target the exams/ prefix.
+    """
+    key = request['key']
+    if key != upload_key(key):
+        raise ValueError(f"not an exam upload: {key!r}")
+    return key, str(request['upload_id'])
+
+def complete_upload(request):
+    """
+    Assemble the uploaded parts; the new object starts the exam generation.
+
+    :param request: {'key', 'upload_id', 'parts': [{'PartNumber', 'ETag'}, ...]}
+    :return: {'key'}
+    """
+    key, upload_id = check_upload(request)
+    parts = sorted(({'PartNumber': int(part['PartNumber']), 'ETag': str(part['ETag'])} for part in request['parts']),
+                   key=lambda part: part['PartNumber'])
+    if not parts:
+        raise ValueError("no part uploaded")
+    s3_client.complete_multipart_upload(Bucket=os.environ['BUCKET_NAME'], Key=key, UploadId=upload_id,
+                                        MultipartUpload={'Parts': parts})
+    print(f"Completed upload of {key} ({len(parts)} parts)")
+    return {'key': key}
+
+def abort_upload(request):
+    """
+    Discard an upload that failed in the browser, and its parts.
+
+    :param request: {'key', 'upload_id'}
+    :return: {'key'}
+    """
+    key, upload_id = check_upload(request)
+    s3_client.abort_multipart_upload(Bucket=os.environ['BUCKET_NAME'], Key=key, UploadId=upload_id)
+    print(f"Aborted upload of {key}")
+    return {'key': key}
+
+ROUTES = {
+    '/upload/create': create_uploads,
+    '/upload/complete': complete_upload,
+    '/upload/abort': abort_upload,
+}
+
+@timed('upload_request')
+def lambda_handler(event, context):
+    """
+    Handler of the /upload/* routes of the generate frontend's load balancer, behind its Cognito
+    authentication: the browser sends the PDFs straight to S3 with the presigned URLs returned here.
+
+    :param event: Application Load Balancer request.
+    :param context: AWS Lambda uses this parameter to provide runtime information to your handler.
+    :return: Application Load Balancer response.
+    """
+    route = ROUTES.get(event.get('path'))
+    if route is None:
+        return response(404, {'error': 'not found'})
+    if event.get('httpMethod') != 'POST':
+        return response(405, {'error': 'method not allowed'})
+    try:
+        result = route(read_body(event))
+    except (ValueError, KeyError, TypeError) as e:
+        return response(400, {'error': str(e)})
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        print(f"Upload request failed: {e}")
+        return response(400 if code in CLIENT_ERROR_CODES else 500, {'error': code})
+    return response(200, result)
@@ -0,0 +1,125 @@
+"""Offline load test of the Bedrock call scheduler against a throttling fake Bedrock
+
+Simulates a burst of uploads: `--containers` ExamGenFn containers, each generating
+`--sections` sections in parallel against one shared account quota, with and without the
+scheduler. Without it, throttled calls are retried like botocore's standard retry mode.
+Time is compressed: the quota window lasts `--window` seconds instead of 60.
+
+Usage: python benchmarks/bedrock_load.py [--containers 8] [--sections 6] [--window 6] [--budget 4]
+"""
+# Python Built-Ins:
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "ExamGenFn"))
+sys.path.insert(0, os.path.join(ROOT, "common"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ["BEDROCK_CACHE"] = ""
+
+from fake_bedrock import FakeBedrockService  # noqa: E402
+from utils.helper_bedrock import HelperBedrock  # noqa: E402
+from utils.helper_scheduler import BedrockCapacityError, BedrockScheduler, is_throttling_error  # noqa: E402
+
+PROMPT = "Human: write exam questions about <exam_book>{text}</exam_book> Assistant:"
+
+
+def botocore_style_retry(fn, scale, max_attempts=10):
+    """Retry throttled calls like botocore's standard mode: jittered exponential backoff capped at 20 s"""
+    for attempt in range(max_attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if not is_throttling_error(e) or attempt == max_attempts - 1:
+                raise
+            time.sleep(random.uniform(0, min(20, 2 ** attempt)) * scale)
+
+
+def run_container(service, args, scheduled, results):
+    """One container: `--sections` concurrent calls sharing the invocation deadline"""
+    helper = HelperBedrock(client=service.client())
+    scale = args.window / 60
+    helper.scheduler = None
+    if scheduled:
+        # Each container gets its share of the account quota
+        helper.scheduler = BedrockScheduler(
+            tokens_per_minute=service.tokens_per_minute // args.budget,
+            requests_per_minute=max(1, service.requests_per_minute // args.budget),
+            max_concurrency=args.sections, window_seconds=args.window, base_backoff=scale)
+    deadline = time.time() + args.timeout * scale
+    text = "lecture notes " * (args.prompt_tokens // 3)
+
+    def section():
+        started = time.time()
+        try:
+            if scheduled:
+                helper.get_response(text, PROMPT, deadline)
+            else:
+                botocore_style_retry(lambda: helper.get_response(text, PROMPT), scale)
+            outcome = "ok" if time.time() <= deadline else "timeout"
+        except BedrockCapacityError:
+            outcome = "resumable"
+        except Exception:
+            outcome = "timeout" if time.time() > deadline else "error"
+        results.append((outcome, time.time() - started))
+
+    threads = [threading.Thread(target=section) for _ in range(args.sections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run(args, scheduled):
+    """Run one burst and return its summary"""
+    scale = args.window / 60
+    # Two seconds to the first token and ~30 output tokens per second, in simulated time
+    service = FakeBedrockService(tokens_per_minute=args.tpm, requests_per_minute=args.rpm, window_seconds=args.window,
+                                 base_latency=2 * scale, seconds_per_output_token=scale / 30)
+    results = []
+    started = time.time()
+    containers = []
+    for _ in range(args.containers):
+        container = threading.Thread(target=run_container, args=(service, args, scheduled, results))
+        container.start()
+        containers.append(container)
+        time.sleep(random.uniform(0, 0.05))
+    for container in containers:
+        container.join()
+    ok_latencies = sorted(latency for outcome, latency in results if outcome == "ok")
+    outcomes = {outcome: sum(1 for o, _ in results if o == outcome) for outcome in ("ok", "resumable", "timeout", "error")}
+    return {
+        "scheduler": scheduled,
+        "wall_seconds": round(time.time() - started, 2),
+        "outcomes": outcomes,
+        "service": dict(service.counters),
+        "p50_seconds": round(statistics.median(ok_latencies), 3) if ok_latencies else None,
+        "p99_seconds": round(ok_latencies[int(len(ok_latencies) * 0.99) - 1], 3) if ok_latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--containers", type=int, default=8, help="concurrent ExamGenFn invocations")
+    parser.add_argument("--sections", type=int, default=6, help="parallel calls per invocation")
+    parser.add_argument("--window", type=float, default=6.0, help="seconds standing for one minute")
+    parser.add_argument("--timeout", type=float, default=280, help="invocation deadline in simulated seconds")
+    parser.add_argument("--tpm", type=int, default=200000, help="account tokens per minute")
+    parser.add_argument("--rpm", type=int, default=30, help="account requests per minute")
+    parser.add_argument("--prompt-tokens", type=int, default=6000, help="prompt size of one call")
+    parser.add_argument("--budget", type=int, default=4, help="number of containers sharing the quota")
+    args = parser.parse_args()
+
+    for scheduled in (False, True):
+        print(json.dumps(run(args, scheduled)))
+
+
+if __name__ == "__main__":
+    main()
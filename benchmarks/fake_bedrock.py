@@ -0,0 +1,140 @@
+"""Local stand-in for the bedrock-runtime client, with latency and account-level throttling
+
+The fake enforces tokens-per-minute and requests-per-minute quotas shared by every client
+created from the same FakeBedrockService, like the quota of an AWS account is shared by all
+Lambda containers, and answers with a canned exam in the Claude completion format.
+
+Usage:
+    service = FakeBedrockService(tokens_per_minute=200000, requests_per_minute=100)
+    helper = HelperBedrock(client=service.client())
+"""
+# Python Built-Ins:
+import io
+import json
+import math
+import threading
+import time
+from collections import deque
+
+# External Dependencies:
+from botocore.exceptions import ClientError
+
+CHARS_PER_TOKEN = 4
+
+
+def canned_completion(n_questions=8):
+    """Return a completion holding `n_questions` questions in the format the prompt asks for"""
+    questions = []
+    for i in range(n_questions):
+        if i % 3 == 2:
+            questions.append({"question": f"Statement {i} holds?", "options": ["True", "False"],
+                              "correct_answer": "True"})
+        else:
+            questions.append({"question": f"Which option answers question {i}?",
+                              "options": ["Alpha", "Beta", "Gamma", "Delta"], "correct_answer": "Beta"})
+    return "<questions>" + json.dumps(questions, indent=1) + "</questions>"
+
+
+class FakeBedrockService:
+    """Quota and latency model shared by the fake clients of one simulated account"""
+
+    def __init__(self, tokens_per_minute=200000, requests_per_minute=100, window_seconds=60,
+                 base_latency=0.05, seconds_per_output_token=0.0005, completion=None):
+        """
+        :param tokens_per_minute: Account quota of input plus output tokens per window.
+        :param requests_per_minute: Account quota of requests per window.
+        :param window_seconds: Length of the quota window; shorten it to compress a load test.
+        :param base_latency: Seconds before the first output token.
+        :param seconds_per_output_token: Generation speed.
+        :param completion: Completion text returned by every call (canned exam by default), or a
+                           function of the prompt returning the completion.
+        """
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.window_seconds = window_seconds
+        self.base_latency = base_latency
+        self.seconds_per_output_token = seconds_per_output_token
+        self.completion = completion or canned_completion()
+        self.calls = deque()
+        self.lock = threading.Lock()
+        self.counters = {"accepted": 0, "throttled": 0, "tokens": 0}
+
+    def complete(self, prompt):
+        """Return the completion of a prompt"""
+        return self.completion(prompt) if callable(self.completion) else self.completion
+
+    def admit(self, prompt, completion):
+        """Count a call against the quotas, raising ThrottlingException like Bedrock when over"""
+        tokens = math.ceil(len(prompt) / CHARS_PER_TOKEN) + math.ceil(len(completion) / CHARS_PER_TOKEN)
+        now = time.monotonic()
+        with self.lock:
+            while self.calls and self.calls[0][0] <= now - self.window_seconds:
+                self.calls.popleft()
+            used_tokens = sum(call_tokens for _, call_tokens in self.calls)
+            if len(self.calls) >= self.requests_per_minute or used_tokens + tokens > self.tokens_per_minute:
+                self.counters["throttled"] += 1
+                raise ClientError({"Error": {"Code": "ThrottlingException",
+                                             "Message": "Too many requests, please wait before trying again."}},
+                                  "InvokeModel")
+            self.calls.append((now, tokens))
+            self.counters["accepted"] += 1
+            self.counters["tokens"] += tokens
+
+    def latency(self, completion):
+        """Seconds a call takes to complete"""
+        output_tokens = math.ceil(len(completion) / CHARS_PER_TOKEN)
+        return self.base_latency + output_tokens * self.seconds_per_output_token
+
+    def client(self):
+        """Return a new client object sharing this service's quotas"""
+        return FakeBedrockClient(self)
+
+
+class FakeStream:
+    """Iterable of response stream events with the close() method of botocore's EventStream"""
+
+    def __init__(self, service, prompt, completion, piece_chars=40):
+        self.service = service
+        self.prompt = prompt
+        self.completion = completion
+        self.piece_chars = piece_chars
+        self.closed = False
+
+    def __iter__(self):
+        pieces = [self.completion[i:i + self.piece_chars] for i in range(0, len(self.completion), self.piece_chars)]
+        time.sleep(self.service.base_latency)
+        for piece in pieces:
+            if self.closed:
+                return
+            time.sleep(self.service.seconds_per_output_token * len(piece) / CHARS_PER_TOKEN)
+            yield {"chunk": {"bytes": json.dumps({"completion": piece}).encode("utf-8")}}
+        # Like Bedrock, the last chunk reports the token counts of the call
+        metrics = {"inputTokenCount": math.ceil(len(self.prompt) / CHARS_PER_TOKEN),
+                   "outputTokenCount": math.ceil(len(self.completion) / CHARS_PER_TOKEN)}
+        yield {"chunk": {"bytes": json.dumps({"completion": "", "amazon-bedrock-invocationMetrics": metrics}).encode("utf-8")}}
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBedrockClient:
+    """Implements the two bedrock-runtime calls HelperBedrock makes"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def invoke_model(self, modelId, body, accept=None, contentType=None):
+        prompt = json.loads(body)["prompt"]
+        completion = self.service.complete(prompt)
+        self.service.admit(prompt, completion)
+        time.sleep(self.service.latency(completion))
+        payload = json.dumps({"completion": completion, "stop_reason": "stop_sequence"})
+        headers = {"x-amzn-bedrock-input-token-count": str(math.ceil(len(prompt) / CHARS_PER_TOKEN)),
+                   "x-amzn-bedrock-output-token-count": str(math.ceil(len(completion) / CHARS_PER_TOKEN))}
+        return {"body": io.BytesIO(payload.encode("utf-8")), "ResponseMetadata": {"HTTPHeaders": headers}}
+
+    def invoke_model_with_response_stream(self, modelId, body, accept=None, contentType=None):
+        prompt = json.loads(body)["prompt"]
+        completion = self.service.complete(prompt)
+        self.service.admit(prompt, completion)
+        return {"body": FakeStream(self.service, prompt, completion)}
@@ -0,0 +1,118 @@
+"""Import-time profile of the Lambda handlers, to track cold-start init duration per release
+
+Runs `python -X importtime -c "import <handler module>"` for each function, summarizes the
+slowest imports and stores the report under benchmarks/results/ keyed by the git commit.
+
+Usage: python benchmarks/importtime.py [--repeat 5] [--top 15] [--baseline results/importtime-<sha>.json]
+"""
+# Python Built-Ins:
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# (function directory, handler module)
+HANDLERS = [
+    ("ExamGenFn", "main"),
+    ("TakeExamFn", "take_exam"),
+    ("DynamoDBTriggerFn", "score_card"),
+]
+
+# Environment the handlers read at import time; no AWS call is made while importing
+HANDLER_ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "SNS_TOPIC_ARN": "arn:aws:sns:us-east-1:123456789012:importtime",
+    "BUCKET_NAME": "importtime",
+    # Modules of the common layer
+    "PYTHONPATH": os.path.join(ROOT, "common"),
+}
+
+
+def git_commit():
+    """Return the short hash of the current commit, or 'workdir' outside of git"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "workdir"
+
+
+def run_importtime(function_dir, module):
+    """Import `module` in a fresh interpreter and return the parsed -X importtime entries
+
+    Returns a list of (self_us, cumulative_us, depth, name) tuples in import order.
+    """
+    env = {**os.environ, **HANDLER_ENV}
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.join(ROOT, function_dir), env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"importing {function_dir}/{module} failed:\n{completed.stderr[-2000:]}")
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return entries
+
+
+def summarize(entries, top):
+    """Summarize importtime entries: total, per top-level package and slowest direct imports"""
+    per_package = defaultdict(int)
+    for self_us, _, _, name in entries:
+        per_package[name.split(".")[0]] += self_us
+    first_level = min(depth for _, _, depth, _ in entries)
+    direct = [(cumulative_us, name) for _, cumulative_us, depth, name in entries if depth == first_level]
+    return {
+        "total_ms": sum(self_us for self_us, _, _, _ in entries) / 1000,
+        "modules": len(entries),
+        "packages_ms": {name: us / 1000 for name, us in sorted(per_package.items(), key=lambda x: -x[1])[:top]},
+        "direct_imports_ms": {name: us / 1000 for us, name in sorted(direct, reverse=True)[:top]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per handler, the median total is reported")
+    parser.add_argument("--top", type=int, default=15, help="number of packages/imports listed")
+    parser.add_argument("--baseline", help="previous report to compare against")
+    args = parser.parse_args()
+
+    report = {"commit": git_commit(), "python": sys.version.split()[0], "handlers": {}}
+    for function_dir, module in HANDLERS:
+        runs = [summarize(run_importtime(function_dir, module), args.top) for _ in range(args.repeat)]
+        median_run = sorted(runs, key=lambda run: run["total_ms"])[len(runs) // 2]
+        median_run["runs_total_ms"] = [run["total_ms"] for run in runs]
+        report["handlers"][f"{function_dir}/{module}"] = median_run
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["handlers"]
+
+    for handler, summary in report["handlers"].items():
+        line = f"{handler}: {summary['total_ms']:.1f} ms over {summary['modules']} modules"
+        if baseline and handler in baseline:
+            line += f" (baseline {baseline[handler]['total_ms']:.1f} ms)"
+        print(line)
+        print(f"  stdev {statistics.pstdev(summary['runs_total_ms']):.1f} ms")
+        for name, ms in summary["packages_ms"].items():
+            print(f"  {ms:9.1f} ms  {name}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"importtime-{report['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {os.path.relpath(path, ROOT)}")
+
+
+if __name__ == "__main__":
+    main()
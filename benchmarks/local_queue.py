@@ -0,0 +1,191 @@
+"""Local stand-in for the upload queue and its Lambda event source mapping
+
+LocalQueue mimics the SQS semantics the pipeline relies on: visibility timeout, receive
+count and redrive to a dead-letter queue. LocalPoller plays the event source mapping: it
+receives batches, invokes the handler with an SQS event (at most `max_concurrency`
+invocations at a time) and deletes the messages not listed in batchItemFailures.
+
+Running the module bursts `--uploads` uploads through ExamGenFn's batch handler with a
+simulated exam generator, and reports throughput and how many generations ran at once.
+
+Usage: python benchmarks/local_queue.py [--uploads 40] [--batch-size 2] [--max-concurrency 5]
+"""
+# Python Built-Ins:
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LocalQueue:
+    """In-memory queue with visibility timeout and dead-letter redrive"""
+
+    def __init__(self, visibility_timeout=30.0, max_receive_count=3, dead_letter_queue=None):
+        self.visibility_timeout = visibility_timeout
+        self.max_receive_count = max_receive_count
+        self.dead_letter_queue = dead_letter_queue
+        self.messages = deque()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def send(self, body):
+        """Enqueue a message and return its id"""
+        message = {"messageId": str(uuid.uuid4()), "body": body, "receive_count": 0, "visible_at": 0.0}
+        with self.lock:
+            self.messages.append(message)
+        return message["messageId"]
+
+    def receive(self, max_messages=10):
+        """Return up to `max_messages` visible messages as SQS event records, hiding them meanwhile"""
+        now = time.monotonic()
+        records = []
+        with self.lock:
+            # Messages whose visibility timeout expired become visible again
+            for message_id, message in list(self.in_flight.items()):
+                if message["visible_at"] <= now:
+                    del self.in_flight[message_id]
+                    self.messages.append(message)
+            while self.messages and len(records) < max_messages:
+                message = self.messages.popleft()
+                if message["receive_count"] >= self.max_receive_count:
+                    if self.dead_letter_queue is not None:
+                        self.dead_letter_queue.send(message["body"])
+                    continue
+                message["receive_count"] += 1
+                message["visible_at"] = now + self.visibility_timeout
+                self.in_flight[message["messageId"]] = message
+                records.append({
+                    "messageId": message["messageId"],
+                    "receiptHandle": message["messageId"],
+                    "body": message["body"],
+                    "attributes": {"ApproximateReceiveCount": str(message["receive_count"])},
+                    "eventSource": "aws:sqs",
+                })
+        return records
+
+    def delete(self, receipt_handle):
+        """Remove a message that was processed"""
+        with self.lock:
+            self.in_flight.pop(receipt_handle, None)
+
+    def make_visible(self, receipt_handle):
+        """Return a failed message to the queue right away (instead of waiting for the timeout)"""
+        with self.lock:
+            message = self.in_flight.pop(receipt_handle, None)
+            if message is not None:
+                self.messages.append(message)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.messages) + len(self.in_flight)
+
+
+class LocalPoller:
+    """Event source mapping: batches, bounded concurrency and partial batch responses"""
+
+    def __init__(self, queue, handler, batch_size=2, max_concurrency=5):
+        self.queue = queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+
+    def invoke(self, records):
+        """Invoke the handler with one batch and settle its messages"""
+        try:
+            response = self.handler({"Records": records}, None) or {}
+            failed = {item["itemIdentifier"] for item in response.get("batchItemFailures", [])}
+        except Exception as e:
+            print(f"invocation failed, whole batch returned to the queue: {e!r}")
+            failed = {record["messageId"] for record in records}
+        for record in records:
+            if record["messageId"] in failed:
+                self.queue.make_visible(record["receiptHandle"])
+            else:
+                self.queue.delete(record["receiptHandle"])
+
+    def drain(self):
+        """Process messages until the queue is empty"""
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            running = set()
+            while len(self.queue) or running:
+                running = {future for future in running if not future.done()}
+                if len(running) < self.max_concurrency:
+                    records = self.queue.receive(self.batch_size)
+                    if records:
+                        running.add(executor.submit(self.invoke, records))
+                        continue
+                time.sleep(0.01)
+
+
+def s3_notification(bucket_name, key):
+    """Return the body S3 sends to the queue for an uploaded object"""
+    return json.dumps({"Records": [{"eventSource": "aws:s3", "eventName": "ObjectCreated:Put",
+                                    "s3": {"bucket": {"name": bucket_name}, "object": {"key": key}}}]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=40, help="PDFs uploaded at once")
+    parser.add_argument("--batch-size", type=int, default=2, help="messages per invocation (ExamGenBatchSize)")
+    parser.add_argument("--max-concurrency", type=int, default=5, help="concurrent invocations (ExamGenMaxConcurrency)")
+    parser.add_argument("--generation-seconds", type=float, default=0.2, help="simulated time to generate one exam")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="share of generations failing")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(ROOT, "ExamGenFn"))
+    sys.path.insert(0, os.path.join(ROOT, "common"))
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("SNS_TOPIC_ARN", "arn:aws:sns:us-east-1:123456789012:local")
+    os.environ["EXAM_BATCH_WORKERS"] = str(args.batch_size)
+    import main as exam_gen  # noqa: E402
+
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0, "generated": 0, "failed": 0}
+
+    def fake_generate(bucket_name, file_key, context, sequencer=None):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        try:
+            time.sleep(args.generation_seconds)
+            if random.random() < args.failure_rate:
+                with lock:
+                    state["failed"] += 1
+                raise RuntimeError(f"simulated failure for {file_key}")
+            with lock:
+                state["generated"] += 1
+        finally:
+            with lock:
+                state["running"] -= 1
+
+    def handler(event, context):
+        return exam_gen.process_sqs_batch(event["Records"], context, process=fake_generate)
+
+    dead_letters = LocalQueue()
+    queue = LocalQueue(visibility_timeout=60, dead_letter_queue=dead_letters)
+    for i in range(args.uploads):
+        queue.send(s3_notification("local-bucket", f"exams/lecture{i}.pdf"))
+    started = time.monotonic()
+    LocalPoller(queue, handler, args.batch_size, args.max_concurrency).drain()
+    elapsed = time.monotonic() - started
+    print(json.dumps({
+        "uploads": args.uploads,
+        "generated": state["generated"],
+        "failed_attempts": state["failed"],
+        "dead_letters": len(dead_letters),
+        "peak_concurrent_generations": state["peak"],
+        "seconds": round(elapsed, 2),
+        "exams_per_second": round(state["generated"] / elapsed, 2),
+    }))
+
+
+if __name__ == "__main__":
+    main()
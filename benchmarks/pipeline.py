@@ -0,0 +1,315 @@
+"""Offline end-to-end benchmark of the exam pipeline
+
+Runs the three Lambda handlers in-process against local stand-ins: S3, SNS and DynamoDB are
+mocked with moto and Bedrock is the deterministic fake of fake_bedrock.py (configurable
+latency and account quotas). For each document size, synthetic PDFs are uploaded and
+turned into exams by ExamGenFn (`main.main`), the exams are then served by TakeExamFn
+(`take_exam.lambda_handler`) and score cards sent by DynamoDBTriggerFn
+(`score_card.lambda_handler`).
+
+The report lists p50/p99 latencies and throughput per handler, the per-stage breakdown
+read from the EMF records the handlers log, Bedrock calls and tokens, and the peak RSS.
+It is stored under benchmarks/results/ keyed by the git commit; pass --baseline with an
+earlier report to see the changes.
+
+Requires moto (`pip install moto`) besides the functions' own dependencies.
+
+Usage: python benchmarks/pipeline.py [--pages 10,100,1000] [--repeat 3] [--requests 200]
+                                     [--baseline benchmarks/results/pipeline-<sha>.json]
+"""
+# Python Built-Ins:
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import time
+import zlib
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+BUCKET = "exam-gen-benchmark"
+STUDENT_POOL_ID = "us-east-1_benchmark"
+
+# Tables of template.yml the handlers use: name -> (key schema, attribute types, global secondary indexes)
+TABLES = {
+    "QuestionBankIndex": ([("bank", "HASH"), ("name", "RANGE")], {"bank": "S", "name": "S"}, {}),
+    "ExamJobs": ([("job_id", "HASH")], {"job_id": "S", "file_key": "S", "updated_at": "S"},
+                 {"file_key-index": [("file_key", "HASH"), ("updated_at", "RANGE")]}),
+    "ScoreCardNotifications": ([("notification_id", "HASH")], {"notification_id": "S"}, {}),
+}
+
+
+class LambdaContext:
+    """The part of the Lambda context the handlers use"""
+
+    def __init__(self, timeout_seconds):
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int(max(0.0, self.deadline - time.monotonic()) * 1000)
+
+
+def git_commit():
+    """Return the short hash of the current commit, or 'workdir' outside of git"""
+    import subprocess
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "workdir"
+
+
+def percentile(values, q):
+    """Return the q-th percentile (0-100) of values, by nearest rank"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+def latency_summary(seconds):
+    """Summarize a list of durations in seconds"""
+    return {
+        "count": len(seconds),
+        "p50_ms": round(percentile(seconds, 50) * 1000, 3),
+        "p99_ms": round(percentile(seconds, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(seconds) * 1000, 3),
+        "per_second": round(len(seconds) / sum(seconds), 2) if sum(seconds) else None,
+    }
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process and of its finished children (PDF workers)"""
+    scale = 1024 if sys.platform != "darwin" else 1024 * 1024  # ru_maxrss is in KB on Linux, bytes on macOS
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+
+def fake_completion(prompt, n_questions=10):
+    """Answer a question generation prompt with distinct questions built from the words of the prompt"""
+    rng = random.Random(zlib.crc32(prompt.encode("utf-8")))
+    words = sorted({word for word in prompt.lower().split() if word.isalpha() and len(word) > 5}) or ["topic"]
+    questions = []
+    for i in range(n_questions):
+        picked = [rng.choice(words) for _ in range(5)]
+        if i % 3 == 2:
+            questions.append({"question": f"It is stated that {' '.join(picked)}?", "options": ["True", "False"],
+                              "correct_answer": rng.choice(["True", "False"])})
+        else:
+            options = [rng.choice(words) for _ in range(4)]
+            questions.append({"question": f"What links {' '.join(picked)}?", "options": options,
+                              "correct_answer": options[0]})
+    return "<questions>" + json.dumps(questions, indent=1) + "</questions>"
+
+
+def stage_durations(log_text):
+    """Sum the span durations of the EMF records of a log, per stage"""
+    durations = defaultdict(float)
+    for line in log_text.splitlines():
+        if not line.startswith('{"_aws"'):
+            continue
+        record = json.loads(line)
+        if "Duration" in record and "Stage" in record:
+            durations[record["Stage"]] += record["Duration"]
+    return durations
+
+
+def setup_aws():
+    """Create the bucket, topic and tables, and point the handlers' environment at them"""
+    import boto3
+    boto3.client("s3").create_bucket(Bucket=BUCKET)
+    topic_arn = boto3.client("sns").create_topic(Name="exam-gen-benchmark")["TopicArn"]
+    dynamodb = boto3.client("dynamodb")
+    for name, (key_schema, attributes, indexes) in TABLES.items():
+        kwargs = {}
+        if indexes:
+            kwargs["GlobalSecondaryIndexes"] = [{
+                "IndexName": index_name,
+                "KeySchema": [{"AttributeName": attribute, "KeyType": key_type} for attribute, key_type in index_keys],
+                "Projection": {"ProjectionType": "ALL"},
+            } for index_name, index_keys in indexes.items()]
+        dynamodb.create_table(
+            TableName=name, BillingMode="PAY_PER_REQUEST",
+            KeySchema=[{"AttributeName": attribute, "KeyType": key_type} for attribute, key_type in key_schema],
+            AttributeDefinitions=[{"AttributeName": attribute, "AttributeType": attribute_type}
+                                  for attribute, attribute_type in attributes.items()],
+            **kwargs,
+        )
+    os.environ.update({
+        "SNS_TOPIC_ARN": topic_arn,
+        "BUCKET_NAME": BUCKET,
+        "INDEX_TABLE_NAME": "QuestionBankIndex",
+        "JOBS_TABLE_NAME": "ExamJobs",
+        "IDEMPOTENCY_TABLE_NAME": "ScoreCardNotifications",
+    })
+
+
+def run_generation(exam_gen, s3, pages, repeat, timeout):
+    """Upload `repeat` distinct PDFs of `pages` pages and generate their exams one after the other"""
+    from synthetic_pdf import make_pdf
+    latencies, stages, exams = [], defaultdict(list), []
+    for run in range(repeat):
+        key = f"exams/bench-{pages}p-{run}.pdf"
+        s3.put_object(Bucket=BUCKET, Key=key, Body=make_pdf(pages, seed=pages * 1000 + run),
+                      Metadata={"n_mcq": "5", "n_tfq": "3", "n_mcq_options": "4"})
+        event = {"Records": [{"eventSource": "aws:s3", "s3": {"bucket": {"name": BUCKET}, "object": {"key": key}}}]}
+        log = io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            exam_gen.main(event, LambdaContext(timeout))
+        latencies.append(time.perf_counter() - started)
+        for stage, duration in stage_durations(log.getvalue()).items():
+            stages[stage].append(duration)
+        exams.append(f"bench-{pages}p-{run}{exam_gen.exam_extension()}")
+    return latencies, {stage: round(statistics.median(values), 3) for stage, values in sorted(stages.items())}, exams
+
+
+def student_context(student):
+    """Request context of a student authenticated by the API's Cognito authorizer"""
+    return {"authorizer": {"claims": {"iss": f"https://cognito-idp.us-east-1.amazonaws.com/{STUDENT_POOL_ID}",
+                                      "cognito:username": student, "email": student}}}
+
+
+def run_take_exam(take_exam, exams, n_requests):
+    """Request the exams (per-student order) and the paginated listing, as the quiz frontend does"""
+    latencies = {"get_exam": [], "list_exams": []}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(n_requests):
+            context = student_context(f"s{i}@example.com")
+            event = {"queryStringParameters": {"object_name": exams[i % len(exams)]},
+                     "headers": {"Accept-Encoding": "gzip"}, "requestContext": context}
+            started = time.perf_counter()
+            response = take_exam.lambda_handler(event, None)
+            latencies["get_exam"].append(time.perf_counter() - started)
+            assert response["statusCode"] == 200, response
+            started = time.perf_counter()
+            take_exam.lambda_handler({"queryStringParameters": {"limit": "50"}, "requestContext": context}, None)
+            latencies["list_exams"].append(time.perf_counter() - started)
+    return {name: latency_summary(values) for name, values in latencies.items()}
+
+
+def run_score_cards(score_card, n_batches, batch_size=100):
+    """Send batches of quiz result stream records through the score card handler"""
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for batch in range(n_batches):
+            records = [{
+                "eventID": f"{batch}-{i}",
+                "eventName": "INSERT",
+                "dynamodb": {
+                    "SequenceNumber": f"{batch:06d}{i:06d}",
+                    "NewImage": {"email": {"S": f"s{i}@example.com"}, "score": {"N": "80"}, "result": {"S": "pass"},
+                                 "details": {"L": []}},
+                },
+            } for i in range(batch_size)]
+            started = time.perf_counter()
+            response = score_card.lambda_handler({"Records": records}, None)
+            latencies.append(time.perf_counter() - started)
+            assert not response["batchItemFailures"], response
+    return latency_summary(latencies)
+
+
+def print_report(report, baseline):
+    """Print the report, with the relative change of each p50 against the baseline"""
+    def change(path, value):
+        previous = baseline
+        for part in path:
+            previous = (previous or {}).get(part)
+        if not previous or value is None:
+            return ""
+        return f" ({(value - previous) / previous * 100:+.1f}% vs {baseline['commit']})"
+
+    for pages, scenario in report["scenarios"].items():
+        generation = scenario["generation"]
+        print(f"{pages} pages: exam p50 {generation['p50_ms']:.0f} ms"
+              f"{change(['scenarios', pages, 'generation', 'p50_ms'], generation['p50_ms'])}, "
+              f"p99 {generation['p99_ms']:.0f} ms, peak RSS {scenario['peak_rss_mb']} MB")
+        for stage, ms in scenario["stages_ms"].items():
+            print(f"  {stage:<16} {ms:10.1f} ms{change(['scenarios', pages, 'stages_ms', stage], ms)}")
+        print(f"  bedrock calls {scenario['bedrock']['accepted']}, throttled {scenario['bedrock']['throttled']}, "
+              f"tokens {scenario['bedrock']['tokens']}")
+    for name in ("get_exam", "list_exams", "score_cards"):
+        summary = report[name]
+        print(f"{name}: p50 {summary['p50_ms']:.2f} ms{change([name, 'p50_ms'], summary['p50_ms'])}, "
+              f"p99 {summary['p99_ms']:.2f} ms, {summary['per_second']}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", default="10,100,1000", help="comma-separated document sizes in pages")
+    parser.add_argument("--repeat", type=int, default=3, help="documents generated per size")
+    parser.add_argument("--requests", type=int, default=200, help="exam requests sent to TakeExamFn")
+    parser.add_argument("--score-card-batches", type=int, default=20, help="stream batches of 100 records")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake Bedrock seconds before the first token")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0002, help="fake Bedrock generation speed")
+    parser.add_argument("--tpm", type=int, default=400000, help="fake account quota of tokens per window")
+    parser.add_argument("--rpm", type=int, default=200, help="fake account quota of requests per window")
+    parser.add_argument("--window", type=float, default=60, help="fake quota window in seconds")
+    parser.add_argument("--timeout", type=float, default=300, help="simulated Lambda timeout of ExamGenFn")
+    parser.add_argument("--baseline", help="previous report to compare against")
+    parser.add_argument("--no-save", action="store_true", help="do not write the report")
+    args = parser.parse_args()
+
+    for path in ("ExamGenFn", "TakeExamFn", "DynamoDBTriggerFn", "common", "benchmarks"):
+        sys.path.insert(0, os.path.join(ROOT, path))
+    # Fake credentials keep boto3 away from any real account; caches start empty on every run
+    os.environ.update({
+        "AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "benchmark", "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "BEDROCK_CACHE": "", "TEXT_CACHE_PREFIX": f"text_cache_benchmark_{os.getpid()}",
+        "METRICS_SERVICE": "benchmark", "BEDROCK_STREAMING": "true", "STUDENT_USER_POOL_ID": STUDENT_POOL_ID,
+    })
+    from moto import mock_aws
+
+    with mock_aws():
+        import boto3
+        setup_aws()
+        # The handlers create their clients at import time, so they are imported inside the mock
+        import main as exam_gen
+        import take_exam
+        import score_card
+        from fake_bedrock import FakeBedrockService
+
+        s3 = boto3.client("s3")
+        report = {"commit": git_commit(), "python": sys.version.split()[0], "args": vars(args), "scenarios": {}}
+        exams = []
+        for pages in [int(value) for value in args.pages.split(",")]:
+            service = FakeBedrockService(tokens_per_minute=args.tpm, requests_per_minute=args.rpm,
+                                         window_seconds=args.window, base_latency=args.latency,
+                                         seconds_per_output_token=args.seconds_per_token, completion=fake_completion)
+            exam_gen.bedrock._client = service.client()
+            latencies, stages, scenario_exams = run_generation(exam_gen, s3, pages, args.repeat, args.timeout)
+            exams.extend(scenario_exams)
+            own_rss, children_rss = peak_rss_mb()
+            report["scenarios"][str(pages)] = {
+                "generation": latency_summary(latencies),
+                "stages_ms": stages,
+                "bedrock": dict(service.counters),
+                "peak_rss_mb": own_rss,
+                "peak_worker_rss_mb": children_rss,
+            }
+        report.update(run_take_exam(take_exam, exams, args.requests))
+        report["score_cards"] = run_score_cards(score_card, args.score_card_batches)
+    shutil.rmtree(os.path.join("/tmp", os.environ["TEXT_CACHE_PREFIX"]), ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"pipeline-{report['commit']}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {os.path.relpath(path, ROOT)}")
+
+
+if __name__ == "__main__":
+    main()
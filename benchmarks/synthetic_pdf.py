@@ -0,0 +1,90 @@
+"""Deterministic synthetic lecture PDFs for the benchmarks
+
+The documents are written by hand (one Helvetica text stream per page), so no PDF library
+is needed. Every chapter of `pages_per_chapter` pages mixes common words with words of its
+own topic, which gives passage retrieval and topic tagging something to find.
+
+Usage: python benchmarks/synthetic_pdf.py --pages 100 --out lecture.pdf
+"""
+# Python Built-Ins:
+import argparse
+import random
+
+COMMON_WORDS = """the cell energy system process structure function model data result study analysis
+theory method change level rate form part value effect control group type factor case
+example figure table section chapter lecture student course review concept principle""".split()
+SYLLABLES = "ka lo mi ne ru sa ti vo xe zu ba de fi go hu ja ke lu mo ni pa qu re so ta".split()
+
+
+def topic_words(chapter, rng, count=40):
+    """Return the invented vocabulary of a chapter"""
+    return [f"{''.join(rng.choice(SYLLABLES) for _ in range(3))}{chapter}" for _ in range(count)]
+
+
+def page_lines(rng, topic, lines=45, words_per_line=9):
+    """Return the text lines of one page"""
+    text = []
+    for _ in range(lines):
+        words = [rng.choice(topic) if rng.random() < 0.3 else rng.choice(COMMON_WORDS) for _ in range(words_per_line)]
+        text.append(" ".join(words).capitalize() + ".")
+    return text
+
+
+def make_pdf(n_pages, seed=0, pages_per_chapter=10):
+    """
+    Build a PDF of `n_pages` pages of text.
+
+    :param n_pages: Number of pages.
+    :param seed: Seed of the text; the same seed gives the same bytes.
+    :param pages_per_chapter: Pages sharing one topic vocabulary.
+    :return: PDF content as bytes.
+    """
+    rng = random.Random(seed)
+    objects = []  # bodies of objects 1..n, in order
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    kids = []
+    topic = []
+    for page in range(n_pages):
+        if page % pages_per_chapter == 0:
+            topic = topic_words(page // pages_per_chapter, rng)
+        lines = [f"Chapter {page // pages_per_chapter + 1}, page {page + 1}"] + page_lines(rng, topic)
+        stream = "BT /F1 10 Tf 12 TL 50 760 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        stream = stream.encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+                        b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages, font, content)))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages
+    objects[pages - 1] = (b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % kid for kid in kids)
+                          + b"] /Count %d >>" % n_pages)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10, help="number of pages")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the text")
+    parser.add_argument("--out", required=True, help="output path")
+    args = parser.parse_args()
+    with open(args.out, "wb") as f:
+        f.write(make_pdf(args.pages, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Compressed question bank exam format
+
+An exam file is:
+    MAGIC | version (1 byte) | header length (4 bytes, big-endian) | header | blocks
+
+The header is JSON: {"version": 1, "codec": "gzip", "count": <questions>, "blocks": [[offset, length, first], ...]}
+with the offset of each block from the end of the header, its length and the index of its first
+question. Each block is one gzip member holding the JSON text of up to BLOCK_SIZE questions, with
+the opening bracket or separating comma in front and the closing bracket after the last one, so
+that the blocks together are a multi-member gzip stream of the JSON array of the exam:
+    - the whole exam is read with a single gzip.decompress call
+    - a single question is read by decompressing its block only
+The stream is not served with 'Content-Encoding: gzip': HTTP clients may stop after the first
+member, i.e. the first BLOCK_SIZE questions. Exams are sent as a whole in this format, under CONTENT_TYPE.
+
+Exams stored as plain JSON arrays (files written before this format) are read as well.
+
+Usage:
+    data = encode(questions)
+    questions = decode(data)          # either format
+    question = read_question(data, 12)
+    reader = ExamReader(data)         # len(reader), reader[12], ...
+"""
+# Python Built-Ins:
+import gzip
+import json
+import struct
+
+MAGIC = b'EXAMGZ'
+VERSION = 1
+EXTENSION = '.exam'
+CONTENT_TYPE = 'application/vnd.exam-generator.exam'
+BLOCK_SIZE = 64
+_PREAMBLE = struct.Struct('>BI')  # version, header length
+
+
+def is_exam(data):
+    """
+    Tell whether bytes hold an exam in this format (and not plain JSON).
+    """
+    return data[:len(MAGIC)] == MAGIC
+
+
+def encode(questions, block_size=BLOCK_SIZE, compresslevel=6):
+    """
+    Encode a list of questions.
+
+    :param questions: List of question dictionaries.
+    :param block_size: Questions per compressed block.
+    :param compresslevel: gzip compression level.
+    :return: Exam file content as bytes.
+    """
+    blocks = []
+    table = []
+    offset = 0
+    for first in range(0, max(len(questions), 1), block_size):
+        chunk = questions[first:first + block_size]
+        text = ('[' if first == 0 else ',') + ','.join(json.dumps(question) for question in chunk)
+        if first + block_size >= len(questions):
+            text += ']'
+        # mtime=0 keeps the bytes (and the ETag) identical for identical exams
+        block = gzip.compress(text.encode('utf-8'), compresslevel=compresslevel, mtime=0)
+        blocks.append(block)
+        table.append([offset, len(block), first])
+        offset += len(block)
+    header = json.dumps({'version': VERSION, 'codec': 'gzip', 'count': len(questions), 'blocks': table},
+                        separators=(',', ':')).encode('utf-8')
+    return b''.join([MAGIC, _PREAMBLE.pack(VERSION, len(header)), header] + blocks)
+
+
+def read_header(data):
+    """
+    Read the header of an exam.
+
+    :param data: Exam file content, or at least its beginning up to the end of the header.
+    :return: Tuple (header dictionary, position of the first block in the file).
+    :raise ValueError: When the data is not an exam of a supported version.
+    """
+    if not is_exam(data):
+        raise ValueError("not an exam file")
+    version, length = _PREAMBLE.unpack_from(data, len(MAGIC))
+    if version > VERSION:
+        raise ValueError(f"unsupported exam format version {version}")
+    start = len(MAGIC) + _PREAMBLE.size
+    return json.loads(data[start:start + length]), start + length
+
+
+def gzip_stream(data):
+    """
+    Return the multi-member gzip stream of the JSON array of an exam, without decompressing it.
+    """
+    _, start = read_header(data)
+    return data[start:]
+
+
+def decode(data):
+    """
+    Decode a whole exam, in this format or plain JSON.
+
+    :param data: Exam file content as bytes.
+    :return: List of question dictionaries.
+    """
+    if not is_exam(data):
+        return json.loads(data)
+    return json.loads(gzip.decompress(gzip_stream(data)))
+
+
+def read_question(data, index):
+    """
+    Decode one question of an exam, decompressing only its block.
+
+    :param data: Exam file content (plain JSON exams are decoded whole).
+    :param index: Index of the question.
+    :return: Question dictionary.
+    """
+    if not is_exam(data):
+        return json.loads(data)[index]
+    return ExamReader(data)[index]
+
+
+class ExamReader:
+    """
+    Random access to the questions of an exam, each block decompressed once, when one of its
+    questions is first read (e.g. as a student moves through a quiz).
+    """
+
+    def __init__(self, data):
+        """
+        :param data: Exam file content in this format.
+        :raise ValueError: When the data is not an exam of a supported version.
+        """
+        self.header, self.start = read_header(data)
+        self.data = data
+        self.blocks = {}
+
+    def __len__(self):
+        return self.header['count']
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(f"question {index} out of range")
+        for offset, length, first in reversed(self.header['blocks']):
+            if first <= index:
+                break
+        if first not in self.blocks:
+            text = gzip.decompress(self.data[self.start + offset:self.start + offset + length]).decode('utf-8')
+            # Drop the bracket or comma in front and the closing bracket, if any
+            self.blocks[first] = json.loads('[' + text[1:].rstrip(']') + ']')
+        return self.blocks[first][index - first]
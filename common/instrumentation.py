@@ -0,0 +1,168 @@
+"""Structured timing and metric logs in CloudWatch Embedded Metric Format (EMF)
+
+Every record is one JSON line on stdout. CloudWatch Logs turns the values listed under
+"_aws" into metrics of the METRICS_NAMESPACE namespace; the other properties (job id,
+file key, ...) stay searchable with Logs Insights. Shared by the Lambda functions through
+the common layer.
+
+Usage:
+    with span('extract', file_key=key) as s:
+        text = extract(...)
+        s.metric('Pages', pages)
+
+    @timed('upload')
+    def upload(...): ...
+"""
+# Python Built-Ins:
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ExamGenerator')
+SERVICE = os.environ.get('METRICS_SERVICE') or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+ENABLED = os.environ.get('METRICS', 'on').lower() == 'on'
+
+# Per-thread state: the open spans and the properties bound to every record
+_local = threading.local()
+_print_lock = threading.Lock()
+
+
+def _state():
+    if not hasattr(_local, 'spans'):
+        _local.spans = []
+        _local.properties = {}
+    return _local
+
+
+def emit(metrics, dimensions=None, units=None, **properties):
+    """
+    Writes one EMF record.
+
+    :param metrics: Dictionary of metric name to number; None values are skipped.
+    :param dimensions: Dictionary of dimension name to value; 'Service' is always added.
+    :param units: Dictionary of metric name to CloudWatch unit ('Count' when not listed).
+    :param properties: Extra properties logged with the record, not turned into metrics.
+    """
+    if not ENABLED:
+        return
+    units = units or {}
+    metrics = {name: value for name, value in metrics.items() if value is not None}
+    dimensions = {'Service': SERVICE, **(dimensions or {})}
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': units.get(name, 'Count')} for name in metrics],
+            }],
+        },
+        **_state().properties,
+        **properties,
+        **dimensions,
+        **metrics,
+    }
+    line = json.dumps(record, default=str)
+    with _print_lock:
+        print(line)
+
+
+@contextmanager
+def bind(**properties):
+    """
+    Adds properties (e.g. a job id) to every record written by the current thread in the block.
+    """
+    state = _state()
+    previous = state.properties
+    state.properties = {**previous, **properties}
+    try:
+        yield
+    finally:
+        state.properties = previous
+
+
+class Span:
+    """
+    Times a block of code and writes its duration, with the metrics recorded meanwhile,
+    as one record with the span name as 'Stage' dimension.
+    """
+
+    def __init__(self, name, **properties):
+        """
+        :param name: Stage name, e.g. 'extract' or 'bedrock.invoke'.
+        :param properties: Properties logged with the record.
+        """
+        self.name = name
+        self.properties = properties
+        self.metrics = {}
+        self.units = {}
+        self.started = None
+
+    def metric(self, name, value, unit='Count'):
+        """
+        Records a metric of the span, written when the span ends.
+        """
+        self.metrics[name] = value
+        self.units[name] = unit
+
+    def set(self, **properties):
+        """
+        Adds properties to the record of the span.
+        """
+        self.properties.update(properties)
+
+    def elapsed(self):
+        """
+        Returns the seconds since the span started.
+        """
+        return time.perf_counter() - self.started
+
+    def __enter__(self):
+        state = _state()
+        if state.spans:
+            self.properties.setdefault('Parent', state.spans[-1].name)
+        state.spans.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = self.elapsed()
+        state = _state()
+        if self in state.spans:
+            state.spans.remove(self)
+        # A generator closed early by its consumer is not an error
+        failed = exc_type is not None and not issubclass(exc_type, GeneratorExit)
+        if failed:
+            self.properties['Error'] = exc_type.__name__
+        emit({'Duration': round(duration * 1000, 3), 'Errors': int(failed), **self.metrics},
+             dimensions={'Stage': self.name}, units={'Duration': 'Milliseconds', **self.units}, **self.properties)
+        return False
+
+
+def span(name, **properties):
+    """
+    Returns a Span to use as context manager.
+
+    :param name: Stage name.
+    :param properties: Properties logged with the record.
+    """
+    return Span(name, **properties)
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of a function in a span (not for generator functions,
+    whose body runs after the call returns).
+
+    :param name: Stage name; the function's qualified name by default.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name or function.__qualname__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
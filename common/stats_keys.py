@@ -0,0 +1,31 @@
+"""Attribute names of the exam statistics items
+
+DynamoDBTriggerFn adds the attempts of the quiz results stream to one item per exam, and
+TakeExamFn reads it back: both name the counters with these functions, through the common layer.
+
+Usage:
+    counters[question_key(question['question'])] += 1
+    counters[histogram_key(percentage)] += 1
+"""
+# Python Built-Ins:
+import hashlib
+
+# Width of the score histogram buckets, in percent
+HISTOGRAM_BUCKET = 10
+HISTOGRAM_PREFIX = 'hist_'
+
+
+def question_key(question):
+    """
+    Attribute name of the correct answer counter of a question. Questions are identified by
+    their text, as every student gets them in a different order.
+    """
+    return 'correct_' + hashlib.sha256(question.encode('utf-8')).hexdigest()[:16]
+
+
+def histogram_key(percentage):
+    """
+    Attribute name of the histogram bucket of a score, 'hist_000' to 'hist_090'.
+    """
+    bucket = min(int(percentage) // HISTOGRAM_BUCKET, 100 // HISTOGRAM_BUCKET - 1) * HISTOGRAM_BUCKET
+    return f'{HISTOGRAM_PREFIX}{bucket:03d}'
@@ -1,10 +1,24 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import boto3
-from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
+from boto3.dynamodb.conditions import Key
 import os 
 
-# Initialize AWS S3 client with the default profile
-s3 = boto3.client('s3')
+jobs_table_name = os.getenv('JOBS_TABLE_NAME')
+jobs_table = boto3.resource('dynamodb').Table(jobs_table_name) if jobs_table_name else None
+
+# Stages of an exam generation job, as recorded by ExamGenFn
+JOB_STAGES = ['extract', 'generate', 'upload', 'notify']
+# Parts of a PDF sent to S3 at the same time by the browser
+UPLOAD_PARALLEL_PARTS = int(os.getenv('UPLOAD_PARALLEL_PARTS', 4))
+
+# The browser uploads the PDFs straight to S3: the /upload/* routes of this load balancer (UploadFn)
+# start a multipart upload per file with the question counts as metadata and return presigned part
+# URLs, the parts are sent in parallel, then the upload is completed. The component then returns the
+# uploaded keys (no page navigation, which the component iframe is not allowed), so that the progress
+# of their exams can be shown.
+upload_component = components.declare_component(
+    'upload', path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload_component'))
 
 # Define a Streamlit app
 st.set_page_config(page_title="Generate Quiz", page_icon="🪄")
@@ -12,11 +26,40 @@ st.sidebar.header("Generate Quiz")
 #st.sidebar.image("exam-logo.png", width=100)  # Adjust the path to your logo image
 st.sidebar.markdown("""Here you can generate your quiz, made of multiple choice and true/false questions. 
 
-You can start by uploading a PDF file for the quiz topic.""")
+You can start by uploading one or more PDF files for the quiz topics.""")
+
+def get_job_status(file_key):
+    """
+    Return the latest generation job of an uploaded file, or None if it has not started yet.
+
+    :param file_key: Key of the uploaded PDF (e.g. 'exams/lecture1.pdf').
+    """
+    response = jobs_table.query(
+        IndexName='file_key-index',
+        KeyConditionExpression=Key('file_key').eq(file_key),
+        ScanIndexForward=False,
+        Limit=1,
+    )
+    items = response.get('Items', [])
+    return items[0] if items else None
+
+
+def show_job_status(file_key):
+    """
+    Display the progress of the exam generation of an uploaded file.
+    """
+    job = get_job_status(file_key)
+    if job is None:
+        st.info("Waiting for exam generation to start...")
+        return
+    completed = [stage for stage in JOB_STAGES if stage in job.get('stages', {})]
+    st.progress(len(completed) / len(JOB_STAGES), text=f"Exam generation: {job['job_status']}")
+    st.write(f"Completed stages: {', '.join(completed) or 'none'} (attempt {job.get('attempts', 1)})")
+    if job['job_status'] == 'failed':
+        st.warning(f"Stage {job.get('failed_stage')} failed, it will be retried: {job.get('job_error')}")
+
 
 def main():
-    #bucketname = 'exam-generator-genai'
-    bucketname = os.getenv('BUCKET_NAME')
     # Header with logo
     col1, col2 = st.columns([4, 1])  # Create two columns
     with col1:  # With first column
@@ -41,43 +84,22 @@ def main():
     n_tfq = st.number_input('How many true/false questions?', value=0,
                                 step=1, min_value=0, max_value=20, format="%d", key="tfq")
 
-    # File Upload
-    uploaded_file = st.file_uploader("Upload PDF File", type=["pdf"])
-    if uploaded_file is not None:
-        # Display uploaded file details
-        st.write("File Details:")
-        st.write(f"Name: {uploaded_file.name}")
-        st.write(f"Type: {uploaded_file.type}")
-        st.write(f"Size: {uploaded_file.size} bytes")
-
-        # Upload file to S3 in the "exams" directory with specified ContentType
-        try:
-            s3.upload_fileobj(
-                uploaded_file,
-                bucketname,
-                'exams/' + uploaded_file.name,
-                ExtraArgs={
-                    'ContentType': 'application/pdf',
-                    'Metadata': {
-                        'n_mcq': str(n_mcq),
-                        'n_tfq': str(n_tfq),
-                        'n_mcq_options': str(n_mcq_options)
-                    },
-                })
-            # Display completion message
-            st.success("Upload completed!")
-        except ClientError as e:
-            # Specific error handling for AWS Client errors
-            st.error(f"An error occurred: {e}")
-        except NoCredentialsError:
-            st.error(
-                "No credentials provided. Please configure your AWS credentials.")
-        except PartialCredentialsError:
-            st.error(
-                "Incomplete credentials provided. Please complete your AWS credentials.")
-        except Exception as e:
-            # General error handling
-            st.error(f"An unexpected error occurred: {e}")
+    # File Upload: the PDFs go from the browser to S3, not through this container
+    st.write("Upload PDF Files")
+    config = {'n_mcq': int(n_mcq), 'n_tfq': int(n_tfq), 'n_mcq_options': int(n_mcq_options),
+              'parallel_parts': UPLOAD_PARALLEL_PARTS}
+    # Keys of the files uploaded by the browser, kept by the component across reruns
+    uploaded_keys = [key for key in upload_component(config=config, key='upload', default=[])
+                     if key.startswith('exams/')]
+    if uploaded_keys:
+        st.success(f"Upload completed: {', '.join(key[len('exams/'):] for key in uploaded_keys)}")
+
+    if jobs_table is not None and uploaded_keys:
+        st.markdown("---")
+        for file_key in uploaded_keys:
+            st.subheader(file_key[len('exams/'):])
+            show_job_status(file_key)
+        st.button("Refresh status")
 
 
 if __name__ == "__main__":
@@ -1,16 +1,24 @@
 import requests
+import requests.adapters
 import streamlit as st
 import os
-from streamlit.web.server.websocket_headers import _get_websocket_headers
 import base64
 import json
-import boto3
-from botocore.exceptions import ClientError
+import uuid
+from datetime import datetime, timezone
+# Copied from common/ into the image (see the Dockerfile)
+import exam_format
+from exam_format import ExamReader
 st.set_page_config(page_title="Take Quiz", page_icon="📝")
 # URL of the API Gateway
 #API_GATEWAY_URL = 'https://htprjtcml7.execute-api.us-east-1.amazonaws.com/test/exam'
 
 API_GATEWAY_URL = os.getenv('API_GATEWAY_URL')
+# Seconds the quiz list and loaded quizzes are reused across reruns and sessions
+QUIZ_LIST_CACHE_TTL = int(os.getenv('QUIZ_LIST_CACHE_TTL', 60))
+QUIZ_CACHE_TTL = int(os.getenv('QUIZ_CACHE_TTL', 300))
+# Quizzes per page of the question bank listing
+QUIZ_PAGE_SIZE = int(os.getenv('QUIZ_PAGE_SIZE', 50))
 
 # Initialize session state variables
 if 'current_question' not in st.session_state:
@@ -23,9 +31,22 @@ if 'questions' not in st.session_state:
     st.session_state['questions'] = []
 if 'show_results' not in st.session_state:
     st.session_state['show_results'] = False  # Flag to display the results page
-
-headers = _get_websocket_headers()
+if 'submission_id' not in st.session_state:
+    st.session_state['submission_id'] = None  # Idempotency key of the current attempt
+if 'results' not in st.session_state:
+    st.session_state['results'] = None  # Graded submission returned by the API
+if 'exam_version' not in st.session_state:
+    st.session_state['exam_version'] = None  # Version of the loaded exam, sent with the answers
+if 'quiz_list_prefix' not in st.session_state:
+    st.session_state['quiz_list_prefix'] = ''  # Name prefix searched in the question bank
+if 'quiz_list_pages' not in st.session_state:
+    st.session_state['quiz_list_pages'] = 1  # Pages of the question bank listing shown
+
+# Headers of the request, set by the load balancer's Cognito authentication
+headers = st.context.headers
 token = headers.get('X-Amzn-Oidc-Data')
+# Cognito access token of the student, checked by the API's authorizer: the API takes the student from it
+access_token = headers.get('X-Amzn-Oidc-Accesstoken')
 parts = token.split('.')
 if len(parts) > 1:
     payload = parts[1]
@@ -55,21 +76,48 @@ def strip_file_extension(filename):
         return filename[:filename.rindex(".")]
     else:
         return filename
+# HTTP session shared by every user session of this container, reusing pooled connections
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 # Function to load questions from S3 through the API Gateway
-def load_questions_from_s3(file_name):
+# (arguments starting with an underscore are not part of the cache key)
+@st.cache_data(ttl=QUIZ_CACHE_TTL, show_spinner=False)
+def load_questions_from_s3(file_name, student, _access_token):
     timeout = 300
-    response = requests.get(f'{API_GATEWAY_URL}?object_name={file_name}', timeout=timeout)
+    # The API returns the questions and options in the signed-in student's own order,
+    # in the compressed exam format
+    params = {'object_name': file_name}
+    headers = {'Authorization': _access_token, 'Accept': f'{exam_format.CONTENT_TYPE}, application/json;q=0.9'}
+    response = get_http_session().get(API_GATEWAY_URL, params=params, headers=headers, timeout=timeout)
     response.raise_for_status()  # Raises HTTPError for bad responses (4xx and 5xx)
+    # The answers are graded against this version of the exam
+    version = response.headers.get('X-Exam-Version')
+    if response.headers.get('Content-Type', '').startswith(exam_format.CONTENT_TYPE):
+        return response.content, version  # decoded by ExamReader, one block at a time as the student moves through the quiz
     questions = response.json()
-    return questions
+    return questions, version
 
-# Function to get the list of files in the questions_bank directory in S3 through the API Gateway
-def get_files_in_questions_bank():
+# Function to get one page of the files in the questions_bank directory in S3 through the API Gateway:
+# the question bank is listed page by page, never read whole
+@st.cache_data(ttl=QUIZ_LIST_CACHE_TTL, show_spinner=False)
+def get_files_in_questions_bank(prefix, next_token, _access_token):
     timeout = 300
-    response = requests.get(API_GATEWAY_URL, timeout=timeout)
+    params = {'limit': QUIZ_PAGE_SIZE}
+    if prefix:
+        params['prefix'] = prefix
+    if next_token:
+        params['next_token'] = next_token
+    response = get_http_session().get(API_GATEWAY_URL, params=params, headers={'Authorization': _access_token},
+                                      timeout=timeout)
     response.raise_for_status()  # Raises HTTPError for bad responses (4xx and 5xx)
-    files = response.json()
-    return files
+    page = response.json()
+    return [item['name'] for item in page['items']], page.get('next_token')
 
 # Start page: File selection
 def start_page():
@@ -81,19 +129,39 @@ def start_page():
     #    st.image("logo.png",
     #             caption="", width=100)
 
-    files = get_files_in_questions_bank()
+    prefix = st.text_input("Search quizzes", placeholder="Quiz name starts with...")
+    if prefix != st.session_state['quiz_list_prefix']:
+        st.session_state['quiz_list_prefix'] = prefix
+        st.session_state['quiz_list_pages'] = 1
+    # The pages already shown come from the cache; "More quizzes" reads the next one
+    files = []
+    next_token = None
+    for _ in range(st.session_state['quiz_list_pages']):
+        names, next_token = get_files_in_questions_bank(prefix, next_token, access_token)
+        files.extend(names)
+        if not next_token:
+            break
     f_dic = {strip_file_extension(file): file for file in files}
     selected_file = st.selectbox("Select Quiz", ["Select a quiz"] + list(f_dic.keys()))
     if selected_file != "Select a quiz":
         st.session_state['selected_file'] = f_dic[selected_file]
+    if next_token and st.button("More quizzes"):
+        st.session_state['quiz_list_pages'] += 1
+        st.rerun()
 
     if st.session_state['selected_file']:
         if st.button("Load quiz"):
-            st.session_state['questions'] = load_questions_from_s3(st.session_state['selected_file'])
+            questions, st.session_state['exam_version'] = load_questions_from_s3(st.session_state['selected_file'],
+                                                                                 email, access_token)
+            st.session_state['questions'] = ExamReader(questions) if isinstance(questions, bytes) else questions
             st.session_state['current_question'] = 0
             st.session_state['answers'] = {}
             st.session_state['show_results'] = False  # Ensure results are not shown yet
-            st.experimental_rerun()
+            # A new attempt: retried submissions of this attempt are recorded only once.
+            # The id starts with the UTC time, so the attempt history sorts by time
+            st.session_state['submission_id'] = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ') + '-' + uuid.uuid4().hex[:8]
+            st.session_state['results'] = None
+            st.rerun()
 
 # Quiz page: Display one question at a time with the user's previous selection
 def quiz_page():
@@ -119,75 +187,76 @@ def quiz_page():
         if st.session_state['current_question'] > 0:
             if col1.button("Back", key=f"back_button_{st.session_state['current_question']}"):  # Modified this line
                 st.session_state['current_question'] -= 1
-                st.experimental_rerun()
+                st.rerun()
 
         if st.session_state['current_question'] < len(st.session_state['questions']) - 1:
             if col2.button("Next") and user_answer:  # Only go next if an option is selected
                 st.session_state['current_question'] += 1
-                st.experimental_rerun()
+                st.rerun()
         else:
             if col2.button("Submit") and user_answer:  # Only submit if an option is selected
                 st.session_state['show_results'] = True  # Set the flag to display results
-                st.experimental_rerun()
-
-# Results page: Evaluate answers and display results
+                st.rerun()
+
+# Submit the answers through the API Gateway, which grades and records them
+def submit_answers(file_name, exam_version, answers, submission_id):
+    timeout = 30
+    response = get_http_session().post(API_GATEWAY_URL, json={
+        'object_name': file_name,
+        'exam_version': exam_version,
+        'answers': answers,
+        'idempotency_key': submission_id,
+    }, headers={'Authorization': access_token}, timeout=timeout)
+    response.raise_for_status()  # Raises HTTPError for bad responses (4xx and 5xx)
+    return response.json()
+
+# Back to the start page
+def close_quiz():
+    st.session_state['current_question'] = 0  # Resetting the question number
+    st.session_state['answers'] = {}  # Clearing the answers
+    st.session_state['questions'] = []  # Clearing the questions
+    st.session_state['selected_file'] = None  # Resetting the selected file
+    st.session_state['show_results'] = False  # Reset the flag
+    st.session_state['results'] = None  # Clearing the graded submission
+    st.session_state['exam_version'] = None  # Clearing the version of the exam
+    st.rerun()  # Rerunning the app from start
+
+# Results page: Submit the answers once and display the graded results
 def results_page():
     st.title("Results")
-    score = 0
-    results_data = []  # List to hold each question's result
-    for idx, question in enumerate(st.session_state['questions']):
-        user_answer_index = st.session_state['answers'][idx]
-        correct_answer = question['correct_answer']
-
-        question_str = f"**Q{idx+1}**: {question['question']} "
-        answers_str = f"&nbsp;&nbsp;&nbsp;&nbsp;Correct answer: {correct_answer}"
-        if question['options'][user_answer_index] == correct_answer:
-            score += 1
+    if st.session_state['results'] is None:
+        answers = [st.session_state['answers'][idx] for idx in range(len(st.session_state['questions']))]
+        try:
+            st.session_state['results'] = submit_answers(st.session_state['selected_file'],
+                                                         st.session_state['exam_version'], answers,
+                                                         st.session_state['submission_id'])
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 409:
+                raise
+            # The quiz was regenerated while it was taken: the answers belong to its previous version
+            load_questions_from_s3.clear()
+            st.error("This quiz was updated while you were taking it. Please load it again.")
+            if st.button("Back to the quizzes"):
+                close_quiz()
+            return
+    results = st.session_state['results']
+
+    for idx, detail in enumerate(results['details']):
+        question_str = f"**Q{idx+1}**: {detail['question']} "
+        answers_str = f"&nbsp;&nbsp;&nbsp;&nbsp;Correct answer: {detail['correct_answer']}"
+        if detail['is_correct']:
             question_str += "✅"
         else:
             question_str += "❌"
-            answers_str += f"&nbsp;&nbsp;&nbsp;&nbsp;Your answer: {question['options'][user_answer_index]}"
+            answers_str += f"&nbsp;&nbsp;&nbsp;&nbsp;Your answer: {detail['user_answer']}"
         st.markdown(question_str)
         st.markdown(answers_str)
-        is_correct = question['options'][user_answer_index] == correct_answer
-        # Append result for each question
-        results_data.append({
-            "question": question['question'],
-            "user_answer": question['options'][user_answer_index],
-            "correct_answer": correct_answer,
-            "is_correct": is_correct
-        })
-
-    percentage = int((score / len(st.session_state['questions'])) * 100)
-    pass_status = "passed" if percentage >= 50 else "failed"
-
-    # Compile final results data
-    final_results = {
-        "email": email,
-        "score": score,
-        "result": pass_status,
-        "details": results_data
-    }
-    save_quiz_results(final_results)
-
-    st.subheader(f"You scored {score}/{len(st.session_state['questions'])}. That's {percentage}%. You {pass_status}.")
-
-    if st.button("Close"):
-        st.session_state['current_question'] = 0  # Resetting the question number
-        st.session_state['answers'] = {}  # Clearing the answers
-        st.session_state['questions'] = []  # Clearing the questions
-        st.session_state['selected_file'] = None  # Resetting the selected file
-        st.session_state['show_results'] = False  # Reset the flag
-        st.experimental_rerun()  # Rerunning the app from start
 
+    st.subheader(f"You scored {results['score']}/{results['total']}. That's {results['percentage']}%. You {results['result']}.")
 
-def save_quiz_results(data):
+    if st.button("Close"):
+        close_quiz()
 
-    # Initialize DynamoDB table
-    table_name = os.getenv('DYNAMODB_TABLE_NAME')
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(table_name)
-    table.put_item(Item=data)
 
 def main():
     if st.session_state['show_results']: